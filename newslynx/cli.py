@@ -8,7 +8,7 @@ from flask.ext.migrate import MigrateCommand
 
 from newslynx.views import app
 from newslynx.core import db_session, db
-from newslynx.models import User, SousChef
+from newslynx.models import User, SousChef, Org
 from newslynx.init import load_sous_chefs
 from newslynx.models import sous_chef_schema
 from newslynx.dev import random_data
@@ -16,6 +16,8 @@ from newslynx.init import load_sql
 from newslynx import settings
 from newslynx.models import URLCache, ExtractCache, ThumbnailCache
 from newslynx.models import ComparisonsCache
+from newslynx.tasks import thumbnail
+from newslynx.tasks import rollup_metric
 
 log = logging.getLogger(__name__)
 
@@ -69,6 +71,17 @@ def init():
     db_session.commit()
 
 
+@manager.command
+def reload_sql():
+    """
+    (Re)load sql extensions, functions, and migrations
+    into an existing database.
+    """
+    for sql in load_sql():
+        db_session.execute(sql)
+    db_session.commit()
+
+
 @manager.command
 def gen_random_data():
 
@@ -92,5 +105,32 @@ def flush_work_cache():
     ThumbnailCache.flush()
 
 
+@manager.command
+def backfill_thumbnails(batch_size=100):
+    """
+    Queue up thumbnail generation for events and
+    content items which are missing them.
+    """
+    for table in thumbnail.THUMBNAIL_TABLES:
+        n = thumbnail.backfill(table, batch_size=int(batch_size))
+        sys.stderr.write(
+            "Queued {} thumbnail jobs for {}\n".format(n, table))
+
+
+@manager.command
+def rollup_content_timeseries(rebuild=False):
+    """
+    Bring every org's day / month content timeseries rollups up to date.
+    """
+    for org in db_session.query(Org).all():
+        if rebuild:
+            rollup_metric.content_timeseries_to_rollups(
+                org, session=db_session)
+        else:
+            rollup_metric.refresh_content_rollups(org, session=db_session)
+        sys.stderr.write(
+            "Rolled up content timeseries for {}\n".format(org.slug))
+
+
 def run():
     manager.run()
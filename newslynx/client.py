@@ -8,7 +8,7 @@ from requests import Session, Request
 from urlparse import urljoin
 
 from newslynx import settings
-from newslynx.lib.serialize import obj_to_json, json_to_obj
+from newslynx.lib.serialize import obj_to_json, json_to_obj, msgpack_to_obj
 from newslynx.exc import ERRORS, ClientError, JobError
 from newslynx.logs import log
 
@@ -67,8 +67,15 @@ class BaseClient(object):
         if url.startswith(self._format_url('orgs')):
             kw['params'].pop('org')
 
+        # stream generators as newline-delimited json
+        # so bulk uploads are sent in chunks.
+        if isgenerator(kw.get('data')):
+            kw['data'] = self._iter_ndjson(kw['data'])
+            kw.setdefault('headers', {})
+            kw['headers']['Content-Type'] = 'application/x-ndjson'
+
         # dump json
-        if kw.get('data'):
+        elif kw.get('data'):
             kw['data'] = obj_to_json(kw['data'])
 
         # execute
@@ -88,6 +95,13 @@ class BaseClient(object):
         # format response
         return self._format_response(resp)
 
+    def _iter_ndjson(self, data):
+        """
+        Serialize a generator of objects as newline-delimited json.
+        """
+        for obj in data:
+            yield obj_to_json(obj) + "\n"
+
     def _split_auth_params_from_data(self, kw, kw_incl=[]):
         params = {}
         if 'apikey' in kw:
@@ -112,8 +126,6 @@ class BaseClient(object):
         if 'data' not in kw:
             raise ClientError(
                 'Bulk endpoints require a "data" keyword argument.')
-        if isgenerator(kw['data']):
-            kw['data'] = list(kw['data'])
         return kw
 
     def _handle_errors(self, resp, err=None):
@@ -143,6 +155,11 @@ class BaseClient(object):
         # if there's no response just return true.
         if resp.status_code == 204:
             return True
+        content_type = resp.headers.get('content-type', '')
+        if 'msgpack' in content_type:
+            return msgpack_to_obj(resp.content)
+        if 'ndjson' in content_type:
+            return [json_to_obj(l) for l in resp.iter_lines() if l]
         return resp.json()
 
     def login(self, **kw):
@@ -616,6 +633,13 @@ class Content(BaseClient):
         url = self._format_url('content', content_id, 'timeseries')
         return self._request('GET', url, params=kw)
 
+    def get_bulk_timeseries(self, **kw):
+        """
+        Get the timeseries of many content items.
+        """
+        url = self._format_url('content', 'timeseries')
+        return self._request('GET', url, params=kw)
+
     def create_timeseries(self, content_id, **kw):
         """
         Create timeseries metric(s) for a content item.
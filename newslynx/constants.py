@@ -27,10 +27,19 @@ METRIC_TS_UNITS = [
     'hour', 'day', 'month'
 ]
 
+METRIC_TS_TRANSFORMS = [
+    'cumulative', 'roll_avg', 'per_change', 'median', 'avg'
+]
+
 CONTENT_METRIC_COMPARISONS = [
     'all', 'types', 'impact_tags', 'subject_tags'
 ]
 
+# aggregations for timeseries across many ids.
+TIMESERIES_ID_AGGREGATIONS = [
+    'sum', 'avg', 'min', 'max'
+]
+
 # EVENTS
 EVENT_STATUSES = [
     'approved', 'pending', 'deleted'
@@ -138,7 +147,16 @@ IMPACT_TAG_LEVELS = [
 
 TASK_QUEUE_NAMES = [
     'recipe',
-    'bulk'
+    'bulk',
+    'thumbnail',
+    'rollup',
+    'cache'
+]
+
+# streaming bulk uploads.
+NDJSON_MIMETYPES = [
+    'application/x-ndjson', 'application/ndjson',
+    'application/jsonlines', 'application/x-jsonlines'
 ]
 
 # boolean parsing.
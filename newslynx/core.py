@@ -81,6 +81,14 @@ db_session.execute('SET TIMEZONE TO UTC')
 # redis connection
 rds = redis.from_url(settings.REDIS_URL)
 
+# release a redis lock only if we still hold it.
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
 # task queues
 queues = {k: Queue(k, connection=rds) for k in TASK_QUEUE_NAMES}
 
@@ -19,29 +19,68 @@ SQLALCHEMY_POOL_SIZE = 1000
 SQLALCHEMY_POOL_MAX_OVERFLOW = 300
 SQLALCHEMY_POOL_TIMEOUT = 30
 SQLALCHEMY_ECHO = False
+SQL_FETCH_SIZE = 1000 # rows per round trip when streaming results
+TIMESERIES_ROLL_WINDOW = 7 # default number of units in a rolling average
+TIMESERIES_TEMPLATE_CACHE_SIZE = 500 # compiled timeseries queries per process
+TIMESERIES_TEMPLATE_CACHE_TTL = 86400 # seconds
+
+# RESPONSES
+COMPRESS_MIMETYPES = [
+    'text/html', 'text/css', 'text/xml',
+    'application/json', 'application/javascript',
+    'application/x-msgpack'
+]
+COMPRESS_MIN_SIZE = 500
 
 # TASK QUEUE
 REDIS_URL = "redis://localhost:6379/0"
 SCHEDULER_REFRESH_INTERVAL = 60
 
+# CACHES
+CACHE_LOCK_TTL = 60 # seconds a worker may hold a key it's computing
+CACHE_LOCK_WAIT = 15 # seconds to wait on another worker's result
+CACHE_LOCK_POLL = 0.1 # seconds
+CACHE_REFRESH_TIMEOUT = 600 # seconds a background refresh may take
+
 # URL CACHE
 URL_CACHE_PREFIX = "newslynx-url-cache"
 URL_CACHE_TTL = 1209600 # 14 DAYS
+URL_CACHE_LOCAL_SIZE = 10000 # urls held in-process, 0 to disable
+URL_CACHE_LOCAL_TTL = 3600 # seconds
 URL_CACHE_POOL_SIZE = 5
 
+# BULK URL / THUMBNAIL RESOLUTION
+RESOLVE_POOL_SIZE = 30
+RESOLVE_PER_HOST = 4
+
 # EXTRACTION CACHE
 EXTRACT_CACHE_PREFIX = "newslynx-extract-cache"
 EXTRACT_CACHE_TTL = 259200 # 3 DAYS
+EXTRACT_CACHE_SOFT_TTL = 86400 # serve stale + refresh after 1 day
+
+# BULK INGEST INDEX
+INGEST_INDEX_TTL = 604800 # 7 DAYS an unchanged item is skipped for
 
 # THUMBNAIL SETTINGS
-THUMBNAIL_CACHE_PREFIX = "newslynx-thumbnail-cache"
+THUMBNAIL_CACHE_PREFIX = "newslynx-thumbnail-ref-cache"
 THUMBNAIL_CACHE_TTL = 1209600 # 14 DAYS
+THUMBNAIL_CACHE_LOCAL_SIZE = 10000 # img urls held in-process, 0 to disable
+THUMBNAIL_CACHE_LOCAL_TTL = 3600 # seconds
 THUMBNAIL_SIZE = [150, 150]
 THUMBNAIL_DEFAULT_FORMAT = "PNG"
+THUMBNAIL_JOB_TIMEOUT = 300 # seconds
+
+# CONTENT TIMESERIES ROLLUPS
+SUMMARY_BATCH_SIZE = 500 # content items per incremental summary rollup
+SUMMARY_JOB_TIMEOUT = 600 # seconds
+CONTENT_ROLLUP_UNITS = ["day", "month"]
+CONTENT_ROLLUP_OVERLAP = 3600 # seconds to look back past the last refresh
 
 # COMPARISON CACHE
 COMPARISON_CACHE_PREFIX = "newslynx-comparison-cache"
 COMPARISON_CACHE_TTL = 86400 # 1 day
+COMPARISON_CACHE_SOFT_TTL = 3600 # serve stale + refresh after 1 hour
+COMPARISON_POOL_SIZE = 4 # facets computed concurrently
 
 # MERLYNNE KWARGS PREFIX
 MERLYNNE_KWARGS_PREFIX = "newslynx-merlynne-kwargs"
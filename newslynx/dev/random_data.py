@@ -404,6 +404,7 @@ def main(
         print "rolling up metrics"
     rollup_metric.content_timeseries_to_summary(org)
     rollup_metric.event_tags_to_summary(org)
+    rollup_metric.refresh_content_rollups(org)
 
 
 def run(**kw):
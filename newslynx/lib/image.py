@@ -15,9 +15,10 @@ from newslynx.util import uniq
 IMG_TAGS = [('img', 'src'), ('a', 'href')]
 
 
-def b64_thumbnail_from_url(img_url, **kw):
+def thumbnail_from_url(img_url, **kw):
     """
-    Download an image and create a base64 thumbnail.
+    Download an image and create a thumbnail.
+    Returns the raw bytes + format.
     """
 
     size = kw.get('size', settings.THUMBNAIL_SIZE)
@@ -57,13 +58,22 @@ def b64_thumbnail_from_url(img_url, **kw):
     except:
         return None
 
-    # convert to base64
     img_buffer = cStringIO.StringIO()
     thumb.save(img_buffer, format=fmt)
-    img_str = base64.b64encode(img_buffer.getvalue())
+    return img_buffer.getvalue(), fmt
+
+
+def b64_thumbnail_from_url(img_url, **kw):
+    """
+    Download an image and create a base64 thumbnail.
+    """
+    resp = thumbnail_from_url(img_url, **kw)
+    if not resp:
+        return None
+    data, fmt = resp
 
     # format + return
-    return "data:image/{};base64,{}".format(fmt, img_str)
+    return "data:image/{};base64,{}".format(fmt, base64.b64encode(data))
 
 
 @network.retry(attempts=2)
@@ -17,6 +17,11 @@ from collections import OrderedDict
 import yaml
 from flask import Response, request
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 from newslynx.lib.search import SearchString
 from newslynx.lib.regex import RE_TYPE
 from newslynx.lib.pkg.crontab import CronTab
@@ -113,6 +118,22 @@ def zip_to_str(s):
     return zlib.decompress(s)
 
 
+def obj_to_msgpack(obj):
+    """
+    obj > msgpack. str + unicode are both packed as
+    (utf-8) strings, never as binary.
+    """
+    return msgpack.packb(obj, use_bin_type=False)
+
+
+def msgpack_to_obj(s):
+    """
+    msgpack > obj
+    """
+    return msgpack.unpackb(
+        s, encoding='utf-8', object_pairs_hook=OrderedDict)
+
+
 def obj_to_yaml(obj):
     """
     obj > yamlstring
@@ -2,17 +2,23 @@ from .auth import Auth
 from .author import Author
 from .event import Event
 from .metric import Metric
+from .metric_schema import MetricSchema, get_metric_schema
 from .org import Org
 from .org_metric import OrgMetricTimeseries, OrgMetricSummary
 from .recipe import Recipe
 from .setting import Setting
 from .tag import Tag
 from .content_item import ContentItem
-from .content_metric import ContentMetricTimeseries, ContentMetricSummary
+from .content_metric import (
+    ContentMetricTimeseries, ContentMetricSummary, ContentMetricRollup)
 from .user import User
 from .sous_chef import SousChef
+from .thumbnail import Thumbnail
 from .work_cache import URLCache, ExtractCache, ThumbnailCache
 from .compare_cache import (
     ComparisonsCache, AllContentComparisonCache,
     SubjectTagsComparisonCache, ContentTypeComparisonCache,
     ImpactTagsComparisonCache)
+from .ingest_index import EventIngestIndex, ContentItemIngestIndex
+from .change_log import (
+    ContentTimeseriesChangeLog, EventTagsChangeLog, ContentSummaryChangeTimes)
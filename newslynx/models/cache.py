@@ -1,6 +1,14 @@
+import time
 from hashlib import md5
+from collections import OrderedDict, Counter
 
-from newslynx.core import rds
+import gevent
+from gevent.pool import Pool
+from gevent.event import AsyncResult
+
+from newslynx.core import rds, queues, RELEASE_SCRIPT
+from newslynx import settings
+from newslynx.util import gen_uuid
 from newslynx.lib import dates
 from newslynx.lib.serialize import (
     obj_to_pickle, pickle_to_obj)
@@ -12,11 +20,14 @@ class CacheResponse(object):
     A class that we return from a cache request.
     """
 
-    def __init__(self, key, value, last_modified, is_cached):
+    def __init__(self, key, value, last_modified, is_cached,
+                 is_stale=False, refreshed=None):
         self.key = key
         self.value = value
         self.last_modified = last_modified
         self.is_cached = is_cached
+        self.is_stale = is_stale
+        self.refreshed = refreshed
 
     @property
     def age(self):
@@ -24,27 +35,135 @@ class CacheResponse(object):
             return (dates.now() - self.last_modified).seconds
         return 0
 
+    @property
+    def refresh_age(self):
+        """
+        How long a background refresh of a stale value has been running.
+        """
+        if self.refreshed:
+            return (dates.now() - self.refreshed).seconds
+        return None
+
     def to_dict(self):
         return {
             'key': self.key,
             'last_modified': self.last_modified,
             'age': self.age,
-            'is_cached': self.is_cached
+            'is_cached': self.is_cached,
+            'is_stale': self.is_stale,
+            'refresh_age': self.refresh_age
         }
 
 
+class LocalCache(object):
+
+    """
+    An in-process LRU cache of at most `size` entries,
+    each of which expires after `ttl` seconds.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        try:
+            expires, value = self._entries.pop(key)
+        except KeyError:
+            return None
+        if expires < time.time():
+            return None
+        # move to the end, most recently used.
+        self._entries[key] = (expires, value)
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._entries.pop(key, None)
+        ttl = min([ttl or self.ttl, self.ttl])
+        self._entries[key] = (time.time() + ttl, value)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+# per-class local caches + hit / miss counters:
+# Cache subclass => LocalCache / Counter
+_local = {}
+_stats = {}
+
+# keys being computed in this process: key => AsyncResult
+_inflight = {}
+
+
+def cache_stats():
+    """
+    Hit / miss counters for every cache used in this process.
+    """
+    return dict((cls.__name__, cls.stats()) for cls in _stats.keys())
+
+
 class Cache(object):
 
     """
-    An abstract Cache object to inherit from.
+    An abstract Cache object to inherit from. Values live in redis
+    and, when `local_size` is set, in an in-process LRU cache in
+    front of it for `local_ttl` seconds. When `soft_ttl` is set,
+    values older than it are still served by `get` but are refreshed
+    in the background, until they expire after `ttl`.
     """
     redis = rds
     ttl = 84600  # 1 day
     key_prefix = None
+    local_size = 0
+    local_ttl = 60
+    pool_size = 5  # concurrent work in `get_many`
+    lock_ttl = settings.CACHE_LOCK_TTL
+    lock_wait = settings.CACHE_LOCK_WAIT
+    lock_poll = settings.CACHE_LOCK_POLL
+    soft_ttl = None
+    refresh_timeout = settings.CACHE_REFRESH_TIMEOUT
 
     def __init__(self, debug=False):
         self.debug = debug
 
+    @classmethod
+    def local(cls):
+        """
+        This class's in-process cache, if it has one.
+        """
+        if not cls.local_size:
+            return None
+        if cls not in _local:
+            _local[cls] = LocalCache(cls.local_size, cls.local_ttl)
+        return _local[cls]
+
+    @classmethod
+    def stats(cls):
+        """
+        Hit / miss counters for this class in this process.
+        """
+        counts = _stats.get(cls, Counter())
+        local = _local.get(cls)
+        return {
+            'local_hits': counts['local_hits'],
+            'hits': counts['hits'],
+            'misses': counts['misses'],
+            'coalesced': counts['coalesced'],
+            'local_size': len(local) if local else 0
+        }
+
+    def count(self, name):
+        _stats.setdefault(self.__class__, Counter())[name] += 1
+
     def serialize(self, obj):
         """
         The function for serializing the object
@@ -73,6 +192,9 @@ class Cache(object):
         for k in cls.redis.keys():
             if k.startswith(cls.key_prefix):
                 cls.redis.delete(k)
+        local = cls.local()
+        if local:
+            local.clear()
 
     def exists(self, *args, **kw):
         return self.redis.get(self.format_key(*args, **kw)) is not None
@@ -81,7 +203,11 @@ class Cache(object):
         """
         Remove a key from the cache.
         """
-        self.redis.delete(self.format_key(*args, **kw))
+        key = self.format_key(*args, **kw)
+        self.redis.delete(key, "{}:last_modified".format(key))
+        local = self.local()
+        if local:
+            local.delete(key)
 
     def format_key(self, *args, **kw):
         """
@@ -116,40 +242,346 @@ class Cache(object):
         # last modified key
         lm_key = "{}:last_modified".format(key)
 
-        # attempt to get the object from redis
+        local = self.local()
+
+        # attempt to get the object from the local cache, then redis
+        obj = None
+        last_modified = None
+        refreshed = None
+        remaining = ttl
         if not self.debug:
-            obj = self.redis.get(key)
-        else:
-            obj = None
+            if local:
+                hit = local.get(key)
+                if hit is not None:
+                    self.count('local_hits')
+                    obj, last_modified = hit
+                    return self._response(
+                        key, obj, last_modified, None, args, dict(kw, ttl=ttl))
+
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.mget(key, lm_key, self.format_refresh_key(key))
+            pipe.pttl(key)
+            (obj, last_modified, refreshed), pttl = pipe.execute()
+            remaining = self._remaining_ttl(pttl, ttl)
 
         # if it doesn't exist, proceed with work
         if not obj:
 
-            # not cached
-            is_cached = False
-
-            obj = self.work(*args, **kw)
+            # not cached, do the work once across
+            # greenlets + processes.
+            fx = lambda: self.work(*args, **kw)
+            if self.debug:
+                obj, last_modified, is_cached = self._compute(key, ttl, fx)
+            else:
+                obj, last_modified, is_cached = self.coalesce(key, ttl, fx)
 
             # if the worker returns None, break out
             if not obj:
                 return CacheResponse(key, obj, None, False)
 
-            # set the object in redis at the specified
-            # key with the specified ttl
-            self.redis.set(key, self.serialize(obj), ex=ttl)
-
-            # set the last modified time
-            last_modified = dates.now()
-            self.redis.set(lm_key, last_modified.isoformat(), ex=ttl)
-
         else:
             # is cached
             is_cached = True
+            self.count('hits')
 
             # if it does exist, deserialize it.
             obj = self.deserialize(obj)
 
-            # get the cached last modified time
-            last_modified = dates.parse_iso(self.redis.get(lm_key))
+            # parse the cached last modified time
+            if last_modified:
+                last_modified = dates.parse_iso(last_modified)
+
+        if local:
+            local.set(key, (obj, last_modified),
+                      ttl=remaining if is_cached else ttl)
+
+        if not is_cached:
+            return CacheResponse(key, obj, last_modified, is_cached)
+        return self._response(
+            key, obj, last_modified, refreshed, args, dict(kw, ttl=ttl))
+
+    def _remaining_ttl(self, pttl, ttl):
+        """
+        The seconds left before a redis key expires, from it's
+        PTTL, so local copies never outlive it.
+        """
+        if pttl is None or pttl < 0:
+            return ttl
+        return max(pttl / 1000.0, 0.001)
+
+    def format_lock_key(self, key):
+        return "{}:lock".format(key)
 
-        return CacheResponse(key, obj, last_modified, is_cached)
+    def format_refresh_key(self, key):
+        return "{}:refresh".format(key)
+
+    def _response(self, key, obj, last_modified, refreshed, args, kw):
+        """
+        A response for a cached value, refreshing it in the
+        background if it's past it's `soft_ttl`.
+        """
+        if not self.soft_ttl or not last_modified or \
+           (dates.now() - last_modified).total_seconds() < self.soft_ttl:
+            return CacheResponse(key, obj, last_modified, True)
+
+        if refreshed:
+            refreshed = dates.parse_iso(refreshed)
+        else:
+            refreshed = self.revalidate(key, args, kw)
+        return CacheResponse(key, obj, last_modified, True,
+                             is_stale=True, refreshed=refreshed)
+
+    def revalidate(self, key, args, kw):
+        """
+        Queue up a refresh of a stale key, unless one already is.
+        Returns when the refresh was queued.
+        """
+        now = dates.now()
+        refresh_key = self.format_refresh_key(key)
+        if self.redis.set(refresh_key, now.isoformat(),
+                          nx=True, ex=self.refresh_timeout):
+            queues['cache'].enqueue(
+                'newslynx.tasks.refresh_cache.refresh',
+                self.__class__.__name__, args, kw,
+                timeout=self.refresh_timeout,
+                result_ttl=0)
+            return now
+        refreshed = self.redis.get(refresh_key)
+        if refreshed:
+            return dates.parse_iso(refreshed)
+        return now
+
+    def refresh(self, *args, **kw):
+        """
+        Do the work for a key and replace it's cached value.
+        """
+        ttl = kw.pop('ttl', self.ttl)
+        key = self.format_key(*args, **kw)
+        try:
+            obj, last_modified, is_cached = \
+                self._compute(key, ttl, lambda: self.work(*args, **kw))
+        finally:
+            self.redis.delete(self.format_refresh_key(key))
+        local = self.local()
+        if local:
+            local.delete(key)
+        return CacheResponse(key, obj, last_modified, False)
+
+    def _compute(self, key, ttl, fx):
+        """
+        Do the work for a key and store the result.
+        Returns (obj, last_modified, is_cached).
+        """
+        self.count('misses')
+        obj = fx()
+        if not obj:
+            return obj, None, False
+
+        # set the object + it's last modified time in redis
+        # at the specified key with the specified ttl
+        last_modified = dates.now()
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.set(key, self.serialize(obj), ex=ttl)
+        pipe.set("{}:last_modified".format(key),
+                 last_modified.isoformat(), ex=ttl)
+        pipe.execute()
+        return obj, last_modified, False
+
+    def _wait(self, key):
+        """
+        Wait for another worker to store a key. Returns
+        (obj, last_modified, is_cached) or None if the worker
+        gave up or we timed out.
+        """
+        lm_key = "{}:last_modified".format(key)
+        lock_key = self.format_lock_key(key)
+        deadline = time.time() + self.lock_wait
+        while time.time() < deadline:
+            gevent.sleep(self.lock_poll)
+            obj, last_modified, locked = \
+                self.redis.mget(key, lm_key, lock_key)
+            if obj:
+                self.count('coalesced')
+                if last_modified:
+                    last_modified = dates.parse_iso(last_modified)
+                return self.deserialize(obj), last_modified, True
+            if not locked:
+                return None
+        return None
+
+    def _compute_once(self, key, ttl, fx):
+        """
+        Do the work for a key under a short redis lock, or wait
+        for the worker holding the lock and use it's result.
+        Falls back to doing the work ourselves after `lock_wait`.
+        """
+        lock_key = self.format_lock_key(key)
+        token = gen_uuid()
+        if not self.redis.set(lock_key, token, nx=True, ex=self.lock_ttl):
+            result = self._wait(key)
+            if result is not None:
+                return result
+            token = None
+        try:
+            return self._compute(key, ttl, fx)
+        finally:
+            if token:
+                release = self.redis.register_script(RELEASE_SCRIPT)
+                release(keys=[lock_key], args=[token])
+
+    def coalesce(self, key, ttl, fx):
+        """
+        Single-flight work for a key: concurrent misses in this
+        process share one result and those in other processes wait
+        on the redis lock. Returns (obj, last_modified, is_cached).
+        """
+        inflight = _inflight.get(key)
+        if inflight is not None:
+            try:
+                result = inflight.get(timeout=self.lock_wait)
+                self.count('coalesced')
+                return result
+            except gevent.Timeout:
+                return self._compute(key, ttl, fx)
+
+        inflight = _inflight[key] = AsyncResult()
+        try:
+            result = self._compute_once(key, ttl, fx)
+            inflight.set(result)
+            return result
+        except Exception as e:
+            inflight.set_exception(e)
+            raise
+        finally:
+            _inflight.pop(key, None)
+
+    def _claim(self, key, inflight, tokens):
+        """
+        Claim the work for a key in `get_many`, single-flight as
+        in `coalesce`. Returns the (obj, last_modified, is_cached)
+        of another worker or None if the work is ours. Claims are
+        recorded in `inflight` and lock tokens in `tokens`.
+        """
+        if key in _inflight:
+            try:
+                result = _inflight[key].get(timeout=self.lock_wait)
+                self.count('coalesced')
+                return result
+            except gevent.Timeout:
+                return None
+
+        inflight[key] = _inflight[key] = AsyncResult()
+        token = gen_uuid()
+        lock_key = self.format_lock_key(key)
+        if self.redis.set(lock_key, token, nx=True, ex=self.lock_ttl):
+            tokens[key] = token
+            return None
+        return self._wait(key)
+
+    def get_many(self, values, work=None, pool_size=None, **kw):
+        """
+        Get/cache many values at once, where each value is the
+        first argument to `work`. Hits are fetched with a single
+        MGET, misses are worked on concurrently (with `work`, if
+        passed, instead of `self.work`), single-flight as in `get`,
+        and those worked on here are written back in a single
+        pipeline. Returns a dictionary of value => CacheResponse.
+        """
+        ttl = kw.pop('ttl', self.ttl)
+        work = work or (lambda v: self.work(v, **kw))
+        pool_size = pool_size or self.pool_size
+        local = self.local()
+
+        values = list(set(values))
+        keys = dict((v, self.format_key(v, **kw)) for v in values)
+        responses = {}
+
+        # attempt to get the objects from the local cache, then redis
+        misses = []
+        for v in values:
+            hit = None
+            if local and not self.debug:
+                hit = local.get(keys[v])
+            if hit is not None:
+                self.count('local_hits')
+                responses[v] = CacheResponse(keys[v], hit[0], hit[1], True)
+            else:
+                misses.append(v)
+
+        if len(misses) and not self.debug:
+            redis_keys = []
+            pipe = self.redis.pipeline(transaction=False)
+            for v in misses:
+                redis_keys.extend([keys[v], "{}:last_modified".format(keys[v])])
+                pipe.pttl(keys[v])
+            pipe.mget(redis_keys)
+            results = pipe.execute()
+            found, pttls = results[-1], results[:-1]
+            _misses = []
+            for i, v in enumerate(misses):
+                obj, last_modified = found[i * 2], found[i * 2 + 1]
+                if not obj:
+                    _misses.append(v)
+                    continue
+                self.count('hits')
+                obj = self.deserialize(obj)
+                if last_modified:
+                    last_modified = dates.parse_iso(last_modified)
+                responses[v] = CacheResponse(keys[v], obj, last_modified, True)
+                if local:
+                    local.set(keys[v], (obj, last_modified),
+                              ttl=self._remaining_ttl(pttls[i], ttl))
+            misses = _misses
+
+        if not len(misses):
+            return responses
+
+        # work on the misses, waiting on those another worker
+        # has claimed.
+        inflight = {}
+        tokens = {}
+
+        def fx(v):
+            result = None
+            if not self.debug:
+                result = self._claim(keys[v], inflight, tokens)
+            if result is None:
+                self.count('misses')
+                result = (work(v), None, False)
+            return v, result
+
+        release = self.redis.register_script(RELEASE_SCRIPT)
+        pool = Pool(min([len(misses), pool_size]))
+        try:
+            for v, (obj, lm, is_cached) in pool.imap_unordered(fx, misses):
+                key = keys[v]
+                if obj and lm is None:
+                    lm = dates.now()
+                    pipe = self.redis.pipeline(transaction=False)
+                    pipe.set(key, self.serialize(obj), ex=ttl)
+                    pipe.set("{}:last_modified".format(key),
+                             lm.isoformat(), ex=ttl)
+                    pipe.execute()
+                responses[v] = CacheResponse(key, obj, lm, is_cached)
+                if obj and local:
+                    local.set(key, (obj, lm), ttl=ttl)
+
+                # publish each key as soon as it's done so workers
+                # waiting on it don't wait on the rest of the batch.
+                result = inflight.pop(key, None)
+                if result is not None:
+                    result.set((obj, lm, is_cached))
+                    _inflight.pop(key, None)
+                token = tokens.pop(key, None)
+                if token:
+                    release(keys=[self.format_lock_key(key)], args=[token])
+        except Exception as e:
+            for result in inflight.values():
+                result.set_exception(e)
+            raise
+        finally:
+            for key, token in tokens.items():
+                release(keys=[self.format_lock_key(key)], args=[token])
+            for key in inflight:
+                _inflight.pop(key, None)
+        return responses
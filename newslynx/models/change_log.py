@@ -0,0 +1,198 @@
+import time
+
+from newslynx.core import rds, RELEASE_SCRIPT
+from newslynx.util import gen_uuid
+
+
+# remove members which haven't changed again since they were claimed.
+ACK_SCRIPT = """
+local n = 0
+for i, member in ipairs(ARGV) do
+    if i > 1 then
+        local score = redis.call('ZSCORE', KEYS[1], member)
+        if score and tonumber(score) <= tonumber(ARGV[1]) then
+            n = n + redis.call('ZREM', KEYS[1], member)
+        end
+    end
+end
+return n
+"""
+
+
+class ChangeLog(object):
+
+    """
+    A per-org redis log of the ids of items which have changed and
+    need to be reprocessed. Each id is stored once in a sorted set,
+    scored by the last time it changed. A run claims ids which
+    changed before it started (it's watermark), in batches, and
+    acknowledges them once they're processed. Ids which change again
+    mid-run have a newer score, so they're kept for the next one.
+    """
+    redis = rds
+    key_prefix = 'change-log'
+    type = None
+    lock_ttl = 3600  # seconds
+
+    def format_key(self, org_id):
+        return "{}:{}:{}".format(self.key_prefix, self.type, org_id)
+
+    def format_lock_key(self, org_id):
+        return "{}:lock".format(self.format_key(org_id))
+
+    @classmethod
+    def flush(cls):
+        """
+        Flush this log.
+        """
+        for k in cls.redis.keys():
+            if k.startswith("{}:{}".format(cls.key_prefix, cls.type)):
+                cls.redis.delete(k)
+
+    def record(self, org_id, ids):
+        """
+        Log that these ids have changed.
+        """
+        ids = set(ids)
+        if not len(ids):
+            return
+        now = time.time()
+        self.redis.zadd(
+            self.format_key(org_id), **dict((str(i), now) for i in ids))
+
+    def count(self, org_id):
+        return self.redis.zcard(self.format_key(org_id))
+
+    def claim(self, org_id, watermark, batch_size=1000):
+        """
+        Fetch a batch of ids which changed at or before the watermark.
+        """
+        ids = self.redis.zrangebyscore(
+            self.format_key(org_id), '-inf', watermark,
+            start=0, num=batch_size)
+        return [int(i) for i in ids]
+
+    def ack(self, org_id, watermark, ids):
+        """
+        Remove processed ids unless they've changed since the watermark.
+        """
+        if not len(ids):
+            return 0
+        ack = self.redis.register_script(ACK_SCRIPT)
+        return ack(keys=[self.format_key(org_id)],
+                   args=[watermark] + [str(i) for i in ids])
+
+    def acquire(self, org_id):
+        """
+        Lock this log for a run. Returns a token or None
+        if another run holds the lock.
+        """
+        token = gen_uuid()
+        if self.redis.set(self.format_lock_key(org_id), token,
+                          nx=True, ex=self.lock_ttl):
+            return token
+
+    def release(self, org_id, token):
+        """
+        Unlock this log.
+        """
+        release = self.redis.register_script(RELEASE_SCRIPT)
+        release(keys=[self.format_lock_key(org_id)], args=[token])
+
+    def process(self, org_id, fx, batch_size=1000):
+        """
+        Run `fx` over batches of changed ids. Returns the number of
+        ids processed or None if another run is in progress.
+        """
+        token = self.acquire(org_id)
+        if not token:
+            return None
+
+        watermark = time.time()
+        n = 0
+        try:
+            while True:
+                ids = self.claim(org_id, watermark, batch_size)
+                if not len(ids):
+                    break
+                fx(ids)
+                self.ack(org_id, watermark, ids)
+                n += len(ids)
+        finally:
+            self.release(org_id, token)
+        return n
+
+
+class ContentTimeseriesChangeLog(ChangeLog):
+    type = 'content-timeseries'
+
+
+class EventTagsChangeLog(ChangeLog):
+    type = 'event-tags'
+
+
+class ChangeTimes(object):
+
+    """
+    A per-org redis record of the last time each item changed, used
+    to check whether anything derived from a set of items is stale.
+    Unlike a ChangeLog this is never drained. `record_all` marks
+    every item in the org as changed.
+    """
+    redis = rds
+    key_prefix = 'change-times'
+    type = None
+
+    def format_key(self, org_id):
+        return "{}:{}:{}".format(self.key_prefix, self.type, org_id)
+
+    def format_all_key(self, org_id):
+        return "{}:all".format(self.format_key(org_id))
+
+    @classmethod
+    def flush(cls):
+        """
+        Flush these change times.
+        """
+        for k in cls.redis.keys():
+            if k.startswith("{}:{}".format(cls.key_prefix, cls.type)):
+                cls.redis.delete(k)
+
+    def record(self, org_id, ids):
+        """
+        Note that these ids have changed.
+        """
+        ids = set(ids)
+        if not len(ids):
+            return
+        now = time.time()
+        self.redis.zadd(
+            self.format_key(org_id), **dict((str(i), now) for i in ids))
+
+    def record_all(self, org_id):
+        """
+        Note that every item has changed.
+        """
+        self.redis.set(self.format_all_key(org_id), time.time())
+
+    def all_changed(self, org_id):
+        """
+        The last time every item changed.
+        """
+        t = self.redis.get(self.format_all_key(org_id))
+        if t is not None:
+            return float(t)
+        return 0
+
+    def since(self, org_id, t):
+        """
+        The ids which changed after a time => when they changed.
+        """
+        changed = self.redis.zrangebyscore(
+            self.format_key(org_id), '({}'.format(t), '+inf',
+            withscores=True)
+        return dict((int(i), score) for i, score in changed)
+
+
+class ContentSummaryChangeTimes(ChangeTimes):
+    type = 'content-summary'
@@ -3,6 +3,9 @@ Compute and cache content metric comparisons.
 """
 from gevent.pool import Pool
 
+import time
+from hashlib import md5
+
 from sqlalchemy import func
 
 from newslynx.core import db
@@ -14,12 +17,17 @@ from newslynx.models.relations import (
     content_items_tags,
     content_items_events)
 
-from newslynx.models.cache import Cache
+from newslynx.lib import dates
+from newslynx.models.cache import Cache, CacheResponse
+from newslynx.models.change_log import ContentSummaryChangeTimes
+from newslynx.models.metric_schema import get_schema_version
 
 
 class ComparisonCache(Cache):
     key_prefix = settings.COMPARISON_CACHE_PREFIX
-    tll = settings.COMPARISON_CACHE_TTL
+    ttl = settings.COMPARISON_CACHE_TTL
+    pool_size = settings.COMPARISON_POOL_SIZE
+    summary_changes = ContentSummaryChangeTimes()
 
     def get_facets(self, org, **kw):
         raise NotImplemented
@@ -35,15 +43,114 @@ class ComparisonCache(Cache):
         kw.update({'name__': self.name})
         return self._format_key(*args, **kw)
 
-    # TODO: Pooled Exectution
+    def format_facet_key(self, org_id, facet):
+        return "{}:{}:{}:facet:{}".format(
+            self.key_prefix, self.name, org_id, facet)
+
+    def format_facets_key(self, org_id):
+        return "{}:{}:{}:facets".format(
+            self.key_prefix, self.name, org_id)
+
+    def get(self, org_id, **kw):
+        """
+        Comparisons of one type aren't cached as a whole, only per
+        facet (see `work`). They're served through ComparisonsCache,
+        which caches them all.
+        """
+        kw.pop('ttl', None)
+        key = self.format_key(org_id, **kw)
+        return CacheResponse(key, self.work(org_id, **kw), dates.now(), False)
+
+    def invalidate(self, org_id, **kw):
+        """
+        Remove every cached facet comparison for an org.
+        """
+        facets_key = self.format_facets_key(org_id)
+        keys = self.redis.smembers(facets_key)
+        self.redis.delete(facets_key, *keys)
+
+    def ids_hash(self, ids):
+        """
+        A fingerprint of a facet's content items.
+        """
+        return md5(",".join([str(i) for i in sorted(ids)])).hexdigest()
+
+    def is_stale(self, cached, ids, ids_hash, version, changed, all_changed):
+        """
+        Does a cached facet comparison need recomputing?
+        """
+        if self.debug or not cached:
+            return True
+        if cached['version'] != version or cached['ids_hash'] != ids_hash:
+            return True
+        if all_changed > cached['computed']:
+            return True
+        for id, t in changed.items():
+            if t > cached['computed'] and id in ids:
+                return True
+        return False
+
     def work(self, org_id, **kw):
+        """
+        Compute comparisons for every facet, reusing each facet's
+        cached comparison unless the summaries of it's content items
+        (or the items themselves) have changed since.
+        """
         org = Org.query.get(org_id)
+        version = str(get_schema_version(org.id))
+        facets = self.get_facets(org, **kw)
+        if not len(facets):
+            return self.format_comparisons({})
+
+        keys = [self.format_facet_key(org.id, f) for f in facets]
+        cached = [self.deserialize(c) if c else None
+                  for c in self.redis.mget(keys)]
+        computed = [c['computed'] for c in cached if c]
+        changed = {}
+        if len(computed):
+            changed = self.summary_changes.since(org.id, min(computed))
+        all_changed = self.summary_changes.all_changed(org.id)
+
         comparisons = {}
-        for facet in self.get_facets(org, **kw):
-            ids = self.get_content_item_ids(org, facet, **kw)
-            if len(ids):
+        stale = []
+        for facet, key, c in zip(facets, keys, cached):
+            ids = sorted(self.get_content_item_ids(org, facet, **kw))
+            if not len(ids):
+                continue
+            ids_hash = self.ids_hash(ids)
+            if self.is_stale(c, set(ids), ids_hash, version, changed, all_changed):
+                # build the comparison here, it reads the org's metrics.
                 cc = ContentComparison(org, ids)
-                comparisons[facet] = list(cc.execute())
+                stale.append((facet, key, ids_hash, cc))
+            else:
+                comparisons[facet] = c['value']
+
+        def fx(args):
+            facet, key, ids_hash, cc = args
+            try:
+                computed = time.time()
+                value = list(cc.execute())
+            finally:
+                # each greenlet gets it's own session.
+                db.session.remove()
+            # note the key so `invalidate` needn't scan for it.
+            facets_key = self.format_facets_key(org.id)
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.set(key, self.serialize({
+                'value': value,
+                'ids_hash': ids_hash,
+                'version': version,
+                'computed': computed
+            }), ex=self.ttl)
+            pipe.sadd(facets_key, key)
+            pipe.expire(facets_key, self.ttl)
+            pipe.execute()
+            return facet, value
+
+        if len(stale):
+            pool = Pool(min([len(stale), self.pool_size]))
+            for facet, value in pool.imap_unordered(fx, stale):
+                comparisons[facet] = value
         return self.format_comparisons(comparisons)
 
 
@@ -54,6 +161,7 @@ class ComparisonsCache(Cache):
     """
     key_prefix = settings.COMPARISON_CACHE_PREFIX
     ttl = settings.COMPARISON_CACHE_TTL
+    soft_ttl = settings.COMPARISON_CACHE_SOFT_TTL
     pool_size = 4
 
     @property
@@ -5,6 +5,7 @@ from sqlalchemy import Index
 from newslynx.core import db, SearchQuery
 from newslynx.lib import dates
 from newslynx.models import relations
+from newslynx.models.thumbnail import thumbnail_url
 from newslynx.constants import (
     CONTENT_ITEM_TYPES, CONTENT_ITEM_PROVENANCES)
 
@@ -210,7 +211,7 @@ class ContentItem(db.Model):
                 d['metrics'] = {}
 
         if incl_img:
-            d['thumbnail'] = self.thumbnail
+            d['thumbnail'] = thumbnail_url(self.thumbnail)
             d['img_url'] = self.img_url
 
         return d
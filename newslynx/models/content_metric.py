@@ -1,7 +1,7 @@
-from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.dialects.postgresql import JSONB
 
 from newslynx.lib import dates
-from newslynx.core import db
+from newslynx.core import db, rds
 
 
 class ContentMetricTimeseries(db.Model):
@@ -18,7 +18,7 @@ class ContentMetricTimeseries(db.Model):
         db.Integer, db.ForeignKey('orgs.id'), index=True, primary_key=True)
     content_item_id = db.Column(db.Integer, db.ForeignKey('content.id'), index=True, primary_key=True)
     datetime = db.Column(db.DateTime(timezone=True), primary_key=True)
-    metrics = db.Column(JSON)
+    metrics = db.Column(JSONB)
     updated = db.Column(db.DateTime(timezone=True), onupdate=dates.now, default=dates.now)
 
     def __init__(self, **kw):
@@ -44,7 +44,7 @@ class ContentMetricSummary(db.Model):
     org_id = db.Column(
         db.Integer, db.ForeignKey('orgs.id'), index=True, primary_key=True)
     content_item_id = db.Column(db.Integer, db.ForeignKey('content.id'), index=True, primary_key=True)
-    metrics = db.Column(JSON)
+    metrics = db.Column(JSONB)
 
     def __init__(self, **kw):
         self.org_id = kw.get('org_id')
@@ -53,3 +53,60 @@ class ContentMetricSummary(db.Model):
 
     def __repr__(self):
         return '<ContentMetricSummary %r >' % (self.content_item_id)
+
+
+class ContentMetricRollup(db.Model):
+
+    """
+    Content timeseries metrics pre-aggregated into day / month buckets.
+    These are rebuilt from content_metric_timeseries by
+    rollup_metric.content_timeseries_to_rollups.
+
+    """
+    __tablename__ = 'content_metric_rollup'
+    __module__ = 'newslynx.models.content_metric'
+
+    # bumped with the org's metric schema version on full rebuilds.
+    version_key = 'content-rollup:version:{}'
+    # the last time incremental rollups ran.
+    watermark_key = 'content-rollup:watermark:{}'
+
+    org_id = db.Column(
+        db.Integer, db.ForeignKey('orgs.id'), index=True)
+    content_item_id = db.Column(
+        db.Integer, db.ForeignKey('content.id', ondelete='CASCADE'),
+        index=True, primary_key=True)
+    unit = db.Column(db.Text, primary_key=True)
+    datetime = db.Column(db.DateTime(timezone=True), primary_key=True)
+    metrics = db.Column(JSONB)
+    updated = db.Column(db.DateTime(timezone=True), onupdate=dates.now, default=dates.now)
+
+    def __init__(self, **kw):
+        self.org_id = kw.get('org_id')
+        self.content_item_id = kw.get('content_item_id')
+        self.unit = kw.get('unit')
+        self.datetime = kw.get('datetime')
+        self.metrics = kw.get('metrics', {})
+
+    @classmethod
+    def is_current(cls, org_id, version):
+        """
+        Were these rollups built with this version of the org's metrics?
+        """
+        return rds.get(cls.version_key.format(org_id)) == str(version)
+
+    @classmethod
+    def set_version(cls, org_id, version):
+        rds.set(cls.version_key.format(org_id), str(version))
+
+    @classmethod
+    def get_watermark(cls, org_id):
+        return rds.get(cls.watermark_key.format(org_id))
+
+    @classmethod
+    def set_watermark(cls, org_id, watermark):
+        rds.set(cls.watermark_key.format(org_id), watermark.isoformat())
+
+    def __repr__(self):
+        return '<ContentMetricRollup %r / %r / %r >' % (
+            self.content_item_id, self.unit, self.datetime)
@@ -6,6 +6,7 @@ from sqlalchemy_utils.types import TSVectorType
 from newslynx.core import db, SearchQuery
 from newslynx.lib import dates
 from newslynx.models import relations
+from newslynx.models.thumbnail import thumbnail_url
 from newslynx.constants import (
     EVENT_STATUSES, EVENT_PROVENANCES)
 
@@ -131,7 +132,7 @@ class Event(db.Model):
         if kw.get('incl_body', False):
             d['body'] = self.body
         if kw.get('incl_img', False):
-            d['thumbnail'] = self.thumbnail
+            d['thumbnail'] = thumbnail_url(self.thumbnail)
             d['img_url'] = self.img_url
         return d
 
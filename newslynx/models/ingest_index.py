@@ -0,0 +1,124 @@
+import json
+import time
+from hashlib import md5
+
+from newslynx.core import rds
+from newslynx import settings
+
+
+class IngestIndex(object):
+
+    """
+    A per-org redis index of the raw keys of items we've ingested
+    (eg: a recipe's source_id or a content item's url) mapped to the
+    id they were stored as and a fingerprint of the raw item. This
+    lets bulk loaders skip items they've already seen, unchanged,
+    before doing any extraction / url normalization. A reverse map
+    of id => raw keys allows removing entries on delete. Entries
+    expire after `ttl` seconds, so an item is eventually reloaded
+    even if it hasn't changed.
+    """
+    redis = rds
+    key_prefix = 'ingest-index'
+    type = None
+    ttl = settings.INGEST_INDEX_TTL
+
+    def format_key(self, org_id):
+        return "{}:{}:{}".format(self.key_prefix, self.type, org_id)
+
+    def format_ids_key(self, org_id):
+        return "{}:ids".format(self.format_key(org_id))
+
+    @classmethod
+    def flush(cls):
+        """
+        Flush this index.
+        """
+        for k in cls.redis.keys():
+            if k.startswith("{}:{}".format(cls.key_prefix, cls.type)):
+                cls.redis.delete(k)
+
+    def fingerprint(self, item):
+        """
+        A stable hash of a raw item.
+        """
+        return md5(json.dumps(item, sort_keys=True, default=str)).hexdigest()
+
+    def get_many(self, org_id, keys):
+        """
+        Fetch the (id, fingerprint) of many raw keys in one request.
+        """
+        keys = list(set(keys))
+        if not len(keys):
+            return {}
+        found = {}
+        now = time.time()
+        values = self.redis.hmget(self.format_key(org_id), keys)
+        for key, value in zip(keys, values):
+            if value is None:
+                continue
+            value = value.split(':')
+            # entries without an expiry are from before we had one.
+            if len(value) == 3 and float(value[2]) > now:
+                found[key] = (int(value[0]), value[1])
+        return found
+
+    def set_many(self, org_id, entries):
+        """
+        Index many raw keys => (id, fingerprint).
+        """
+        if not len(entries):
+            return
+        ids_key = self.format_ids_key(org_id)
+
+        # merge with the raw keys we already have for these ids.
+        by_id = {}
+        for key, (id, fingerprint) in entries.items():
+            by_id.setdefault(str(id), set()).add(key)
+        ids = by_id.keys()
+        for id, existing in zip(ids, self.redis.hmget(ids_key, ids)):
+            if existing:
+                by_id[id].update(json.loads(existing))
+
+        # hash fields can't expire on their own, so each entry
+        # carries it's expiry and the hashes expire once an org
+        # stops loading items.
+        expires = int(time.time() + self.ttl)
+        pipe = self.redis.pipeline()
+        pipe.hmset(self.format_key(org_id), dict(
+            (key, "{}:{}:{}".format(id, fingerprint, expires))
+            for key, (id, fingerprint) in entries.items()
+        ))
+        pipe.hmset(ids_key, dict(
+            (id, json.dumps(sorted(keys))) for id, keys in by_id.items()
+        ))
+        pipe.expire(self.format_key(org_id), self.ttl)
+        pipe.expire(ids_key, self.ttl)
+        pipe.execute()
+
+    def remove(self, org_id, ids):
+        """
+        Remove all raw keys for these ids.
+        """
+        ids = [str(id) for id in ids]
+        if not len(ids):
+            return
+        ids_key = self.format_ids_key(org_id)
+        keys = []
+        for existing in self.redis.hmget(ids_key, ids):
+            if existing:
+                keys.extend(json.loads(existing))
+
+        pipe = self.redis.pipeline()
+        if len(keys):
+            pipe.hdel(self.format_key(org_id), *keys)
+        pipe.hdel(ids_key, *ids)
+        pipe.execute()
+
+
+class EventIngestIndex(IngestIndex):
+    type = 'events'
+
+
+class ContentItemIngestIndex(IngestIndex):
+    type = 'content'
@@ -0,0 +1,196 @@
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from newslynx.core import rds
+from newslynx.exc import RequestError
+from newslynx.constants import METRIC_FACET_KEYS
+from .metric import Metric
+
+
+# bumped whenever an org's metrics change.
+VERSION_KEY = 'metric-schema:version:{}'
+
+# an in-process cache of compiled schemas:
+# (org_id, metrics_attr) => (version, schema)
+_schemas = {}
+
+_facet_keys = frozenset(METRIC_FACET_KEYS)
+
+
+def _parse_number(n):
+    """
+    stats.parse_number, inlined.
+    """
+    try:
+        return float(n)
+    except ValueError:
+        try:
+            return int(n)
+        except ValueError:
+            raise ValueError(
+                '"{}" is not a valid number.'
+                .format(n))
+
+
+def _parse_facets(k, v):
+    if not isinstance(v, list):
+        raise RequestError(
+            "Metric '{}' is faceted but was not passed in as a list."
+            .format(k))
+    if len(v) and not set(v[0].keys()) == _facet_keys:
+        raise RequestError(
+            "Metric '{}' is faceted, but it\'s elements are not properly formatted. "
+            "Each facet must be a dictionary of '{{\"facet\":\"facet_name\", \"value\": 1234}}"
+            .format(k))
+    return [{'facet': f['facet'], 'value': _parse_number(f['value'])}
+            for f in v]
+
+
+class MetricBatch(object):
+
+    """
+    A column-oriented batch of validated metric rows.
+    ``index`` holds the position of each row in the input and
+    ``errors`` holds (position, error) for rows that failed.
+    """
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self.columns = OrderedDict((f, []) for f in self.fields + ['metrics'])
+        self.index = []
+        self.errors = []
+
+    def __len__(self):
+        return len(self.index)
+
+    def rows(self):
+        """
+        Yield (position, row) pairs.
+        """
+        names = self.columns.keys()
+        for i, values in zip(self.index, zip(*self.columns.values())):
+            yield i, dict(zip(names, values))
+
+
+class MetricSchema(object):
+
+    """
+    A compiled lookup of the metrics which can exist at a level,
+    built from a dict of Metric.to_dict()s (IE: Org.content_timeseries_metrics).
+    Validates and coerces metrics the same way as
+    ``ingest_util.prepare_metrics`` with a parser per metric
+    decided once, up front.
+    """
+
+    def __init__(self, metrics_lookup):
+        self.metrics = metrics_lookup
+        self.parsers = {}
+        for name, m in metrics_lookup.items():
+            if m['faceted']:
+                self.parsers[name] = _parse_facets
+            else:
+                self.parsers[name] = None
+
+    def get(self, name, default=None):
+        return self.metrics.get(name, default)
+
+    def __contains__(self, name):
+        return name in self.parsers
+
+    def validate(self, obj):
+        """
+        Validate and coerce the metrics in an object.
+        """
+        parsers = self.parsers
+        obj.update(obj.pop('metrics', {}))
+        for k, v in obj.iteritems():
+            try:
+                fx = parsers[k]
+            except KeyError:
+                raise RequestError(
+                    "Metric '{}' does not exist at this level."
+                    .format(k))
+            if fx is None:
+                obj[k] = _parse_number(v)
+            else:
+                obj[k] = fx(k, v)
+        return obj
+
+    def validate_batch(self, pairs, fields=[]):
+        """
+        Validate and coerce a batch of (position, row) pairs in a
+        single pass, splitting out ``fields`` (which should already
+        be prepared) into their own columns. Returns a MetricBatch.
+        """
+        batch = MetricBatch(fields)
+        columns = [batch.columns[f] for f in fields]
+        metrics = batch.columns['metrics']
+        index = batch.index
+        errors = batch.errors
+        validate = self.validate
+
+        for i, row in pairs:
+            try:
+                values = [row.pop(f) for f in fields]
+                m = validate(row)
+            except Exception as e:
+                errors.append((i, e))
+                continue
+            for col, v in zip(columns, values):
+                col.append(v)
+            metrics.append(m)
+            index.append(i)
+        return batch
+
+
+def get_schema_version(org_id):
+    """
+    The current version of an org's metrics.
+    """
+    return rds.get(VERSION_KEY.format(org_id))
+
+
+def get_metric_schema(org, metrics_attr):
+    """
+    Fetch the compiled schema for an Org's metrics at a level,
+    IE: get_metric_schema(org, 'content_timeseries_metrics').
+    Schemas are cached in-process until the org's metrics change.
+    """
+    version = get_schema_version(org.id)
+    key = (org.id, metrics_attr)
+    cached = _schemas.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    schema = MetricSchema(getattr(org, metrics_attr))
+    _schemas[key] = (version, schema)
+    return schema
+
+
+# keep cached schemas in sync. we only bump the version
+# once the change has been committed so other processes
+# don't rebuild a schema from stale data.
+
+def _metric_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('metric_schema_orgs', set())\
+            .add(target.org_id)
+
+
+event.listen(Metric, 'after_insert', _metric_changed)
+event.listen(Metric, 'after_update', _metric_changed)
+event.listen(Metric, 'after_delete', _metric_changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_versions(session):
+    for org_id in session.info.pop('metric_schema_orgs', []):
+        rds.incr(VERSION_KEY.format(org_id))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_versions(session, previous_transaction):
+    session.info.pop('metric_schema_orgs', None)
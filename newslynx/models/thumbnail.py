@@ -0,0 +1,66 @@
+from hashlib import md5
+
+from newslynx.core import db
+from newslynx.lib import dates
+from newslynx import settings
+
+
+# legacy rows carry the b64 thumbnail inline.
+DATA_URI_PREFIX = 'data:'
+
+
+def thumbnail_id(img_url):
+    """
+    The id of a thumbnail is the md5 of it's image url.
+    """
+    if isinstance(img_url, unicode):
+        img_url = img_url.encode('utf-8')
+    return md5(img_url).hexdigest()
+
+
+def thumbnail_url(ref):
+    """
+    Turn a thumbnail reference stored on a row into a url.
+    Legacy data-uris are passed through.
+    """
+    if not ref:
+        return None
+    if ref.startswith(DATA_URI_PREFIX):
+        return ref
+    return "{}/api/{}/thumbnails/{}".format(
+        settings.API_URL, settings.API_VERSION, ref)
+
+
+class Thumbnail(db.Model):
+
+    """
+    A store of thumbnail images, keyed by the md5 of their image url.
+    Events and content items only store this key.
+    """
+    __tablename__ = 'thumbnails'
+    __module__ = 'newslynx.models.thumbnail'
+
+    id = db.Column(db.Text, primary_key=True)
+    img_url = db.Column(db.Text)
+    format = db.Column(db.Text)
+    etag = db.Column(db.Text)
+    data = db.Column(db.LargeBinary)
+    created = db.Column(db.DateTime(timezone=True), default=dates.now)
+
+    def __init__(self, **kw):
+        self.img_url = kw.get('img_url')
+        self.id = kw.get('id', thumbnail_id(self.img_url))
+        self.format = kw.get('format')
+        self.data = kw.get('data')
+        self.etag = kw.get('etag', md5(self.data).hexdigest())
+
+    @property
+    def mimetype(self):
+        return "image/{}".format(self.format.lower())
+
+    @property
+    def url(self):
+        return thumbnail_url(self.id)
+
+    def __repr__(self):
+        return '<Thumbnail %r >' % (self.id)
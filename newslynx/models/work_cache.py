@@ -1,9 +1,11 @@
 from newslynx import settings
+from newslynx.core import gen_session
 from newslynx.lib import url
 from newslynx.lib import article
 from newslynx.lib import image
 
 from .cache import Cache
+from .thumbnail import Thumbnail
 
 
 class URLCache(Cache):
@@ -13,6 +15,9 @@ class URLCache(Cache):
     """
     key_prefix = settings.URL_CACHE_PREFIX
     ttl = settings.URL_CACHE_TTL
+    pool_size = settings.URL_CACHE_POOL_SIZE
+    local_size = settings.URL_CACHE_LOCAL_SIZE
+    local_ttl = settings.URL_CACHE_LOCAL_TTL
 
     def work(self, raw_url):
         """
@@ -34,6 +39,7 @@ class ExtractCache(Cache):
     """
     key_prefix = settings.EXTRACT_CACHE_PREFIX
     ttl = settings.EXTRACT_CACHE_TTL
+    soft_ttl = settings.EXTRACT_CACHE_SOFT_TTL
 
     def work(self, url, type='article'):
         """
@@ -54,13 +60,27 @@ class ExtractCache(Cache):
 class ThumbnailCache(Cache):
 
     """
-    A redis cache of img url to base 64 thumbnail.
+    A redis cache of img url to the id of it's thumbnail
+    in the thumbnails table.
     """
     key_prefix = settings.THUMBNAIL_CACHE_PREFIX
     ttl = settings.THUMBNAIL_CACHE_TTL
+    local_size = settings.THUMBNAIL_CACHE_LOCAL_SIZE
+    local_ttl = settings.THUMBNAIL_CACHE_LOCAL_TTL
 
     def work(self, img_url):
         """
-        Grab an image and create a b64 encoded thumbnail.
+        Grab an image, create a thumbnail, and store it.
         """
-        return image.b64_thumbnail_from_url(img_url)
+        resp = image.thumbnail_from_url(img_url)
+        if not resp:
+            return None
+        data, fmt = resp
+        thumb = Thumbnail(img_url=img_url, data=data, format=fmt)
+        session = gen_session()
+        try:
+            session.merge(thumb)
+            session.commit()
+        finally:
+            session.close()
+        return thumb.id
@@ -90,8 +90,7 @@ class EventSousChef(SousChef):
 class ContentTimeseriesSousChef(SousChef):
 
     def load(self, data):
-        if isgenerator(data):
-            data = list(data)
+        # generators are streamed as newline-delimited json.
         status_resp = self.api.content.bulk_create_timeseries(data)
         return self.api.jobs.poll_status(**status_resp)
 
@@ -99,7 +98,6 @@ class ContentTimeseriesSousChef(SousChef):
 class ContentSummarySousChef(SousChef):
 
     def load(self, data):
-        if isgenerator(data):
-            data = list(data)
+        # generators are streamed as newline-delimited json.
         status_resp = self.api.content.bulk_create_summary(data)
         return self.api.jobs.poll_status(**status_resp)
@@ -14,17 +14,12 @@ SELECT COALESCE(
 $function$;
 
 --- merge json objects
-CREATE OR REPLACE FUNCTION json_merge(left JSON, right JSON)
-RETURNS JSON AS $$
-  import json
-  l, r = json.loads(left), json.loads(right)
-  if not l:
-      return json.dumps(r)
-  if not r:
-      return json.dumps(l)
-  l.update(r)
-  return json.dumps(l)
-$$ LANGUAGE PLPYTHONU;
+--- a shallow merge where keys on the right take precedence,
+--- done natively via jsonb concatenation.
+CREATE OR REPLACE FUNCTION json_merge(left JSONB, right JSONB)
+RETURNS JSONB AS $$
+  SELECT COALESCE($1, '{}'::jsonb) || COALESCE($2, '{}'::jsonb)
+$$ LANGUAGE SQL IMMUTABLE;
 
 --- delete an individual key
 CREATE OR REPLACE FUNCTION "json_del_key"(
@@ -11,7 +11,7 @@ BEGIN
     LOOP
         -- first try to update the row
         UPDATE content_metric_timeseries 
-        SET metrics = json_merge(metrics, "_metrics"::json),
+        SET metrics = COALESCE(metrics, '{}'::jsonb) || "_metrics"::jsonb,
             updated = current_timestamp
         WHERE
             org_id = "_org_id" AND
@@ -26,7 +26,7 @@ BEGIN
         -- we could get a unique-key failure
         BEGIN
             INSERT INTO content_metric_timeseries
-            VALUES ("_org_id", "_content_item_id", "_datetime", "_metrics"::json, current_timestamp);
+            VALUES ("_org_id", "_content_item_id", "_datetime", "_metrics"::jsonb, current_timestamp);
             RETURN;
         EXCEPTION WHEN unique_violation THEN
             -- do nothing, and loop to try the UPDATE again
@@ -48,7 +48,7 @@ BEGIN
     LOOP
         -- first try to update the row
         UPDATE content_metric_summary 
-        SET metrics = json_merge(metrics, "_metrics"::json)
+        SET metrics = COALESCE(metrics, '{}'::jsonb) || "_metrics"::jsonb
         WHERE
             org_id = "_org_id" AND
             content_item_id = "_content_item_id";
@@ -61,7 +61,7 @@ BEGIN
         -- we could get a unique-key failure
         BEGIN
             INSERT INTO content_metric_summary
-            VALUES ("_org_id", "_content_item_id", "_metrics"::json);
+            VALUES ("_org_id", "_content_item_id", "_metrics"::jsonb);
             RETURN;
         EXCEPTION WHEN unique_violation THEN
             -- do nothing, and loop to try the UPDATE again
@@ -83,7 +83,7 @@ BEGIN
     LOOP
         -- first try to update the row
         UPDATE org_metric_timeseries 
-        SET metrics = json_merge(metrics, "_metrics"::json),
+        SET metrics = COALESCE(metrics, '{}'::jsonb) || "_metrics"::jsonb,
             updated = current_timestamp
         WHERE
             org_id = "_org_id" AND
@@ -97,7 +97,7 @@ BEGIN
         -- we could get a unique-key failure
         BEGIN
             INSERT INTO org_metric_timeseries
-            VALUES ("_org_id", "_datetime", "_metrics"::json, current_timestamp);
+            VALUES ("_org_id", "_datetime", "_metrics"::jsonb, current_timestamp);
             RETURN;
         EXCEPTION WHEN unique_violation THEN
             -- do nothing, and loop to try the UPDATE again
@@ -119,7 +119,7 @@ BEGIN
     LOOP
         -- first try to update the row
         UPDATE org_metric_summary 
-        SET metrics = json_merge(metrics, "_metrics"::json)
+        SET metrics = COALESCE(metrics, '{}'::jsonb) || "_metrics"::jsonb
         WHERE org_id = "_org_id";
 
         IF found THEN
@@ -130,7 +130,7 @@ BEGIN
         -- we could get a unique-key failure
         BEGIN
             INSERT INTO org_metric_summary
-            VALUES ("_org_id", "_metrics"::json);
+            VALUES ("_org_id", "_metrics"::jsonb);
             RETURN;
         EXCEPTION WHEN unique_violation THEN
             -- do nothing, and loop to try the UPDATE again
@@ -1,4 +1,6 @@
 -- A function for creating a lookup table to make timeseries non-sparse.
+-- The bounds of every requested id are found in one grouped scan and
+-- each is expanded with a lateral generate_series.
 CREATE OR REPLACE FUNCTION content_metric_calendar(
   text, 
   "c_ids" anyarray, 
@@ -6,46 +8,24 @@ CREATE OR REPLACE FUNCTION content_metric_calendar(
   "before" timestamp with time zone DEFAULT '2100-01-01') 
 RETURNS TABLE(content_item_id int, datetime timestamp with time zone) AS
 $BODY$
-DECLARE
-   c_id int;
-   bucket int;
-   unit text;
-BEGIN
-  -- parse argument
-  unit := split_part($1, ' ', 2);
-  IF unit = 'days' THEN
-    unit := 'day';
-  END IF;
-  IF unit = 'hours' THEN
-    unit := 'hour';
-  END IF;
-
-  FOR c_id IN
-    SELECT unnest("c_ids")
-  LOOP
-    -- generate calendar
-    RETURN QUERY EXECUTE 
-      'WITH cal AS (
-          WITH mm AS (
-              SELECT 
-                  MIN(date_trunc('''|| unit || ''', datetime)) AS minmin,
-                  MAX(date_trunc('''|| unit || ''', datetime)) AS maxmax,
-                  content_item_id
-              FROM content_metric_timeseries
-                  WHERE content_item_id=' || c_id || ' AND 
-                        datetime >='''|| "after" || ''' AND 
-                        datetime <='''|| "before" || '''
-                  GROUP BY content_item_id)
-          SELECT
-              content_item_id,
-              generate_series(mm.minmin , mm.maxmax , '''|| $1 || '''::interval) AS datetime
-          FROM mm
-          )
-     SELECT content_item_id, datetime FROM cal ORDER BY datetime ASC';
-  END LOOP;
-END
+  SELECT
+      mm.content_item_id,
+      cal.datetime
+  FROM (
+      SELECT
+          content_item_id,
+          MIN(date_trunc(rtrim(split_part($1, ' ', 2), 's'), datetime)) AS minmin,
+          MAX(date_trunc(rtrim(split_part($1, ' ', 2), 's'), datetime)) AS maxmax
+      FROM content_metric_timeseries
+      WHERE content_item_id = ANY("c_ids") AND
+            datetime >= "after" AND
+            datetime <= "before"
+      GROUP BY content_item_id
+  ) mm,
+  LATERAL generate_series(mm.minmin, mm.maxmax, $1::interval) AS cal(datetime)
+  ORDER BY mm.content_item_id, cal.datetime ASC
 $BODY$
-LANGUAGE plpgsql;
+LANGUAGE sql STABLE;
 
 -- A function for creating a lookup table to make timeseries non-sparse.
 CREATE OR REPLACE FUNCTION org_metric_calendar(
@@ -55,43 +35,21 @@ CREATE OR REPLACE FUNCTION org_metric_calendar(
   "before" timestamp with time zone DEFAULT '2100-01-01') 
 RETURNS TABLE(org_id int, datetime timestamp with time zone) AS
 $BODY$
-DECLARE
-   o_id int;
-   bucket int;
-   unit text;
-BEGIN
-  -- parse argument
-  unit := split_part($1, ' ', 2);
-  IF unit = 'days' THEN
-    unit := 'day';
-  END IF;
-  IF unit = 'hours' THEN
-    unit := 'hour';
-  END IF;
-  FOR o_id IN
-    SELECT unnest("o_ids")
-  LOOP
-    -- generate calendar
-    RETURN QUERY EXECUTE 
-      'WITH cal AS (
-          WITH mm AS (
-              SELECT 
-                  MIN(date_trunc('''|| unit || ''', datetime)) AS minmin,
-                  MAX(date_trunc('''|| unit || ''', datetime)) AS maxmax,
-                  org_id
-              FROM org_metric_timeseries
-                  WHERE org_id=' || o_id || ' AND 
-                        datetime >='''|| "after" || ''' AND 
-                        datetime <='''|| "before" || '''
-                  GROUP BY org_id
-          )
-          SELECT
-              org_id,
-              generate_series(mm.minmin , mm.maxmax , '''|| $1 || '''::interval) AS datetime
-          FROM mm
-          )
-     SELECT org_id, datetime FROM cal ORDER BY datetime ASC';
-  END LOOP;
-END
+  SELECT
+      mm.org_id,
+      cal.datetime
+  FROM (
+      SELECT
+          org_id,
+          MIN(date_trunc(rtrim(split_part($1, ' ', 2), 's'), datetime)) AS minmin,
+          MAX(date_trunc(rtrim(split_part($1, ' ', 2), 's'), datetime)) AS maxmax
+      FROM org_metric_timeseries
+      WHERE org_id = ANY("o_ids") AND
+            datetime >= "after" AND
+            datetime <= "before"
+      GROUP BY org_id
+  ) mm,
+  LATERAL generate_series(mm.minmin, mm.maxmax, $1::interval) AS cal(datetime)
+  ORDER BY mm.org_id, cal.datetime ASC
 $BODY$
-LANGUAGE plpgsql;
\ No newline at end of file
+LANGUAGE sql STABLE;
@@ -0,0 +1,28 @@
+-- Migrate the metric stores from json to jsonb so that
+-- upserts can merge metrics natively instead of via plpythonu.
+-- This is a no-op for tables which have already been migrated.
+DO $$
+DECLARE
+  t text;
+BEGIN
+  FOREACH t IN ARRAY ARRAY[
+    'content_metric_timeseries',
+    'content_metric_summary',
+    'org_metric_timeseries',
+    'org_metric_summary']
+  LOOP
+    IF EXISTS (
+      SELECT 1 FROM information_schema.columns
+      WHERE table_name = t AND
+            column_name = 'metrics' AND
+            data_type = 'json')
+    THEN
+      EXECUTE 'ALTER TABLE ' || quote_ident(t) ||
+              ' ALTER COLUMN metrics TYPE jsonb USING metrics::jsonb';
+    END IF;
+  END LOOP;
+END
+$$;
+
+-- the old plpythonu merge function.
+DROP FUNCTION IF EXISTS json_merge(json, json);
@@ -0,0 +1,11 @@
+-- A store of thumbnail images keyed by the md5 of their image url.
+-- Events and content items only carry this key in their thumbnail
+-- column. This is a no-op for databases which already have it.
+CREATE TABLE IF NOT EXISTS thumbnails (
+  id text PRIMARY KEY,
+  img_url text,
+  format text,
+  etag text,
+  data bytea,
+  created timestamp with time zone
+);
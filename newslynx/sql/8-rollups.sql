@@ -0,0 +1,15 @@
+-- Content timeseries metrics pre-aggregated into day / month buckets.
+-- This is a no-op for databases which already have it.
+CREATE TABLE IF NOT EXISTS content_metric_rollup (
+  org_id integer REFERENCES orgs(id),
+  content_item_id integer REFERENCES content(id) ON DELETE CASCADE,
+  unit text,
+  datetime timestamp with time zone,
+  metrics jsonb,
+  updated timestamp with time zone,
+  PRIMARY KEY (content_item_id, unit, datetime)
+);
+CREATE INDEX IF NOT EXISTS ix_content_metric_rollup_org_id
+  ON content_metric_rollup (org_id);
+CREATE INDEX IF NOT EXISTS ix_content_metric_rollup_content_item_id
+  ON content_metric_rollup (content_item_id);
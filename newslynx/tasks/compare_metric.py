@@ -1,9 +1,13 @@
-from newslynx.util import gen_uuid
 from newslynx.core import db
-from .util import ResultIter
+from .util import ResultIter, stream
 
 
 class ContentComparison(object):
+
+    """
+    Compute the mean, median, min, max and percentiles of each
+    comparison metric over a set of content items, all in one scan.
+    """
     table = "content_metric_summary"
     id_col = "content_item_id"
     metrics_attr = "content_metric_comparisons"
@@ -18,74 +22,96 @@ class ContentComparison(object):
         self.metrics = getattr(org, self.metrics_attr)
 
     @property
-    def ids_array(self):
-        return "ARRAY[{}]".format(",".join([str(i) for i in self.ids]))
-
-    def select_metric(self, metric):
-        return "(metrics ->> '{name}')::text::numeric as metric".format(**metric)
-
-    def null_metric(self, metric):
-        return "(metrics ->> '{name}')::text::numeric IS NOT NULL".format(**metric)
-
-    def init_query(self, metric):
-        select = self.select_metric(metric)
-        null_metric = self.null_metric(metric)
-        return \
-            """SELECT {select}
-               FROM {table}
-               WHERE {id_col} in (select unnest({ids_array})) AND
-               {null_metric}
-               """\
-            .format(select=select, table=self.table,
-                    id_col=self.id_col, ids_array=self.ids_array,
-                    null_metric=null_metric)
+    def names(self):
+        return [m['name'] for m in self.metrics.values()]
 
-    def metric_summary_query(self, metric):
-        return \
-            """ SELECT array_agg(metric) as metric_arr,
-                       ROUND(avg(metric), 2) as mean,
-                       ROUND(min(metric), 2) as min,
-                       ROUND(median(metric), 2) as median,
-                       ROUND(max(metric), 2) as max
-                       FROM ({}) AS "{}"
-            """.format(self.init_query(metric), gen_uuid())
-
-    def select_percentile(self, per):
+    def percentile_col(self, per):
         per_col = "per_" + str(per).replace('.', '_')
         if per_col.endswith('_0'):
             per_col = per_col[:-2]
-        return "percentile(metric_arr, {}) as {}".format(per, per_col)
+        return per_col
 
     @property
-    def select_percentiles(self):
-        ss = []
-        for per in self.percentiles:
-            ss.append(self.select_percentile(per))
-        return ",\n".join(ss)
+    def fractions(self):
+        return ", ".join([str(per / 100.0) for per in self.percentiles])
 
-    def metric_query(self, metric):
-        kw = {
-            'name': metric.get('name'),
-            'percentiles': self.select_percentiles,
-            'summary_query': self.metric_summary_query(metric),
-            'alias': gen_uuid()
-        }
+    @property
+    def query(self):
+        # the median is the mean of the middle value from either end,
+        # which keeps it exact (percentile_cont works in floats).
+        # percentiles exclude zeros, just like they always have.
         return \
-            """SELECT '{name}' as metric,
-                      mean, median, min, max,
-                      {percentiles}
-               FROM (\n{summary_query}\n) AS "{alias}"
-            """.format(**kw)
+            """WITH names AS (
+                    SELECT name, ord
+                    FROM unnest(CAST(:names AS text[]))
+                        WITH ORDINALITY AS n(name, ord)
+               ),
+               vals AS (
+                    SELECT
+                        names.name,
+                        (metrics ->> names.name)::text::numeric AS metric
+                    FROM {table}, names
+                    WHERE {id_col} = ANY(CAST(:ids AS int[])) AND
+                          (metrics ->> names.name)::text::numeric IS NOT NULL
+               )
+               SELECT
+                    names.name AS metric,
+                    ROUND(avg(metric), 2) AS mean,
+                    ROUND((
+                        percentile_disc(0.5) WITHIN GROUP (ORDER BY metric ASC) +
+                        percentile_disc(0.5) WITHIN GROUP (ORDER BY metric DESC)
+                    ) / 2.0, 2) AS median,
+                    ROUND(min(metric), 2) AS min,
+                    ROUND(max(metric), 2) AS max,
+                    count(metric) AS n,
+                    percentile_cont(ARRAY[{fractions}]::float8[])
+                        WITHIN GROUP (ORDER BY metric)
+                        FILTER (WHERE metric != 0) AS percentiles
+               FROM names
+               LEFT JOIN vals ON vals.name = names.name
+               GROUP BY names.name, names.ord
+               ORDER BY names.ord
+            """.format(table=self.table, id_col=self.id_col,
+                       fractions=self.fractions)
 
     @property
-    def query(self):
-        queries = []
-        for metric in self.metrics.values():
-            queries.append(self.metric_query(metric))
-        return "\nUNION ALL\n".join(queries)
+    def params(self):
+        return {
+            'names': self.names,
+            'ids': [int(i) for i in self.ids]
+        }
+
+    def format_percentile(self, n, value):
+        """
+        Format a percentile the way we always have: null when there
+        are no values, 0 when they're all zero, otherwise 2 decimals.
+        """
+        if not n:
+            return None
+        if value is None:
+            return 0
+        return float("{0:.2f}".format(value))
+
+    def format(self, row):
+        d = {
+            'metric': row['metric'],
+            'mean': row['mean'],
+            'median': row['median'],
+            'min': row['min'],
+            'max': row['max']
+        }
+        values = row['percentiles'] or [None] * len(self.percentiles)
+        for per, value in zip(self.percentiles, values):
+            d[self.percentile_col(per)] = \
+                self.format_percentile(row['n'], value)
+        return d
 
-    def execute(self):
+    def execute(self, **kw):
         """
         Execute the query stream the results.
         """
-        return ResultIter(db.session.execute(self.query))
+        if not len(self.metrics.keys()):
+            return iter([])
+        rows = ResultIter(
+            db.session.execute(stream(self.query), self.params), **kw)
+        return (self.format(r) for r in rows)
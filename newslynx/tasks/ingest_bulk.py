@@ -3,35 +3,54 @@ import gevent.monkey
 gevent.monkey.patch_all()
 from gevent.pool import Pool
 
+import copy
 import time
+import logging
 
 from functools import partial
+from rq import get_current_job
 from rq.timeouts import JobTimeoutException
+from sqlalchemy import inspect
 
 from newslynx.core import queues, db
 from newslynx.core import rds, gen_session
 from newslynx.exc import (
     RequestError, InternalServerError)
-from newslynx.util import gen_uuid
+from newslynx.util import gen_uuid, chunk_list
 from newslynx.lib.serialize import (
     pickle_to_obj, obj_to_pickle)
+from newslynx.models import (
+    Event, ContentItem, Org, EventIngestIndex, ContentItemIngestIndex)
 
 from . import ingest_content_item
 from . import ingest_event
 from . import ingest_metric
+from . import ingest_util
+from . import rollup_metric
+from . import thumbnail
+
+
+log = logging.getLogger(__name__)
 
 
 class BulkLoader(object):
 
     __module__ = 'newslynx.tasks.bulk'
 
-    returns = None  # either "model" or "query"
+    returns = None  # either "model", "query", or "rows"
     timeout = 1000  # seconds
     result_ttl = 60  # seconds
     kwargs_ttl = 1000  # in case there is a backup in the queue
     max_workers = 7
     concurrent = True
+    chunk_size = 1000  # items per chunk stored in redis
+    commit_size = 1000  # items per transaction
+    batch_size = 1000  # rows per statement when returns == "rows"
+    max_errors = 100  # per-item errors to report
+    index = None  # an IngestIndex for skipping unchanged items
+    thumbnail_table = None  # a table to generate missing thumbnails for
     kwargs_key = 'rq:kwargs:{}'
+    chunks_key = 'rq:kwargs:{}:chunks'
     q = queues.get('bulk')
     redis = rds
 
@@ -41,28 +60,270 @@ class BulkLoader(object):
         """
         raise NotImplemented
 
-    def _load_one(self, item, **kw):
+    def finish(self, session, **kw):
+        """
+        Optionally do something once every chunk has been loaded.
+        """
+        pass
+
+    def committed(self, batch, **kw):
+        """
+        Optionally do something once a batch of (index, output)
+        pairs has been committed.
+        """
+        pass
+
+    def load_many(self, pairs, **kw):
+        """
+        Load a list of (index, item) pairs, yielding (index, output)
+        or (index, Exception) pairs. By default this runs ``load_one``
+        on each item, concurrently if possible.
+        """
+        fx = partial(self._load_one, **kw)
+        if self.concurrent:
+            pool = Pool(min([len(pairs), self.max_workers]))
+            return pool.imap_unordered(fx, pairs)
+        return (fx(pair) for pair in pairs)
+
+    def persist_one(self, output, session, **kw):
+        """
+        The method to overwrite when returns == "model".
+        Adds an object to the session without committing.
+        """
+        session.add(output)
+        return output
+
+    def load_rows(self, rows, session):
+        """
+        The method to overwrite when returns == "rows".
+        Upserts a batch of rows and returns the number loaded.
+        """
+        raise NotImplemented
+
+    def prepare_chunk(self, data, **kw):
+        """
+        An optional hook for resolving shared state
+        for a chunk of items. Returns kwargs for ``load_one``.
+        """
+        return kw
+
+    def _load_one(self, pair, **kw):
         """
         A wrapper which will catch errors
         and bubble them up
         """
+        i, item = pair
         try:
-            return self.load_one(item, **kw)
+            return i, self.load_one(item, **kw)
         except Exception as e:
-            return Exception(e.message)
+            return i, Exception(e.message)
+
+    def _format_error(self, i, e):
+        return {'index': i, 'message': e.message or str(e)}
+
+    def _handle_errors(self, errors, nitems):
+        """
+        Summarize per-item errors.
+        """
+        err = RequestError(
+            'There were errors while bulk uploading {} of {} items: '
+            '{}'.format(len(errors), nitems, errors[0]['message']))
+        err.errors = errors[:self.max_errors]
+        return err
 
-    def _handle_errors(self, errors):
-        if not isinstance(errors, list):
-            errors = [errors]
-        return RequestError(
-            'There was an error while bulk uploading: '
-            '{}'.format(errors[0].message))
+    def _update_job_meta(self, **kw):
+        """
+        Record progress on the running job so it's visible
+        via /api/v1/jobs/<job_id>
+        """
+        job = get_current_job()
+        if not job:
+            return
+        job.meta.update(kw)
+        job.save()
+
+    def persist(self, batch, session, **kw):
+        """
+        Write a batch of (index, output) pairs to the session.
+        Returns the number of items / rows loaded, the ids
+        of any persisted models by index, and the ids of
+        models which still need a thumbnail.
+        """
+        # add objects
+        if self.returns == 'model':
+            objs = [(i, self.persist_one(o, session, **kw)) for i, o in batch]
+            objs = [(i, o) for i, o in objs if o is not None]
+
+            # flush so ids are assigned before commit expires them.
+            session.flush()
+            ids = dict((i, o.id) for i, o in objs)
+            thumbnail_ids = []
+            if self.thumbnail_table:
+                thumbnail_ids = [o.id for i, o in objs
+                                 if o.img_url and not o.thumbnail]
+            return len(ids), ids, thumbnail_ids
+
+        # execute queries
+        elif self.returns == 'query':
+            for i, query in batch:
+                session.execute(query)
+
+        # set-based upserts in batches.
+        elif self.returns == 'rows':
+            nrows = 0
+            for rows in chunk_list([o for i, o in batch], self.batch_size):
+                nrows += self.load_rows(rows, session)
+            return nrows, {}, []
+
+        return len(batch), {}, []
+
+    def _persist_batch(self, batch, session, index_entries={}, **kw):
+        """
+        Persist + commit a batch of (index, output) pairs in one
+        transaction. If it fails, bisect it to isolate the bad items.
+        Returns the number loaded and a list of errors.
+        """
+        try:
+            n, ids, thumbnail_ids = self.persist(batch, session, **kw)
+            session.commit()
+
+        except Exception as e:
+            session.rollback()
+            if len(batch) == 1:
+                return 0, [self._format_error(batch[0][0], e)]
+
+            mid = len(batch) / 2
+            n1, errors1 = self._persist_batch(
+                batch[:mid], session, index_entries, **kw)
+            n2, errors2 = self._persist_batch(
+                batch[mid:], session, index_entries, **kw)
+            return n1 + n2, errors1 + errors2
+
+        self.committed(batch, **kw)
+        self._update_index(ids, index_entries, **kw)
+
+        # generate missing thumbnails asynchronously.
+        if self.thumbnail_table and len(thumbnail_ids):
+            thumbnail.enqueue(self.thumbnail_table, thumbnail_ids)
+        return n, []
+
+    def index_key(self, item, **kw):
+        """
+        The method to overwrite when using an ``index``.
+        Returns the raw key that identifies an item, or None.
+        """
+        return None
+
+    def index_exists(self, ids, session, **kw):
+        """
+        The method to overwrite when using an ``index``.
+        Returns the subset of ``ids`` that still exist in the database.
+        """
+        return set()
+
+    def skipped(self, pairs, session, **kw):
+        """
+        Optionally do something with the (id, item) pairs of
+        unchanged items the index let us skip.
+        """
+        pass
+
+    def _check_index(self, data, session, offset=0, **kw):
+        """
+        Look up a chunk's raw keys in the index. Returns the index =>
+        id of items we've already loaded, unchanged, and the raw key +
+        fingerprint of each item to index once it's been loaded.
+        """
+        index_entries = {}
+        for i, item in enumerate(data, offset):
+            key = self.index_key(item, **kw)
+            if key:
+                index_entries[i] = (key, self.index.fingerprint(item))
+
+        known = self.index.get_many(
+            kw['org_id'], [k for k, f in index_entries.values()])
+        candidates = {}
+        for i, (key, fingerprint) in index_entries.items():
+            if key in known and known[key][1] == fingerprint:
+                candidates[i] = known[key][0]
+
+        # make sure they haven't been deleted since.
+        skip = {}
+        if len(candidates):
+            existing = self.index_exists(
+                set(candidates.values()), session, **kw)
+            skip = dict((i, id) for i, id in candidates.items()
+                        if id in existing)
+        return skip, index_entries
+
+    def _update_index(self, ids, index_entries, **kw):
+        """
+        Index the raw keys of newly-loaded items.
+        """
+        if self.index is None or not len(ids):
+            return
+        entries = {}
+        for i, id in ids.items():
+            if i in index_entries:
+                key, fingerprint = index_entries[i]
+                entries[key] = (id, fingerprint)
+        self.index.set_many(kw['org_id'], entries)
+
+    def load_chunk(self, data, session, offset=0, **kw):
+        """
+        Load + commit one chunk of items. Returns the number of
+        items / rows loaded, a list of errors, and the number of
+        unchanged items that were skipped.
+        """
+        if not len(data):
+            return 0, [], 0
+
+        outputs = []
+        errors = []
+
+        kw = self.prepare_chunk(data, **kw)
+
+        # skip items we've already loaded before doing any work.
+        skip = {}
+        index_entries = {}
+        if self.index is not None:
+            skip, index_entries = self._check_index(
+                data, session, offset, **kw)
+        if len(skip):
+            self.skipped([(skip[i], data[i - offset]) for i in sorted(skip)],
+                         session, **kw)
+
+        pairs = [(i, item) for i, item in enumerate(data, offset)
+                 if i not in skip]
+
+        if not len(pairs):
+            return 0, [], len(skip)
+
+        for i, res in self.load_many(pairs, **kw):
+            if isinstance(res, Exception):
+                errors.append(self._format_error(i, res))
+            elif res is not None:
+                outputs.append((i, res))
+
+        # persist in input order.
+        outputs.sort(key=lambda pair: pair[0])
+
+        nrows = 0
+        for batch in chunk_list(outputs, self.commit_size):
+            n, batch_errors = self._persist_batch(
+                batch, session, index_entries, **kw)
+            nrows += n
+            errors.extend(batch_errors)
+
+        errors.sort(key=lambda err: err['index'])
+        return nrows, errors, len(skip)
 
     def load_all(self, kwargs_key):
         """
-        Do the work.
+        Do the work, one chunk at a time.
         """
         start = time.time()
+        chunks_key = None
         try:
             # create a session specific to this task
             session = gen_session()
@@ -75,65 +336,56 @@ class BulkLoader(object):
                 )
 
             kwargs = pickle_to_obj(kwargs)
-            data = kwargs.get('data')
             kw = kwargs.get('kw')
+            chunks_key = kwargs.get('chunks_key')
 
             # delete them
             self.redis.delete(kwargs_key)
 
-            outputs = []
+            progress = {
+                'chunks': kwargs.get('chunks'),
+                'chunks_loaded': 0,
+                'items': 0,
+                'rows': 0,
+                'rows_per_second': 0,
+                'skipped': 0,
+                'errors': 0
+            }
+            self._update_job_meta(**progress)
+
+            # pop chunks off the list so we only ever hold one in memory.
             errors = []
-
-            fx = partial(self._load_one, **kw)
-
-            if self.concurrent:
-                pool = Pool(min([len(data), self.max_workers]))
-                for res in pool.imap_unordered(fx, data):
-                    if isinstance(res, Exception):
-                        errors.append(res)
-                    else:
-                        outputs.append(res)
-            else:
-                for item in data:
-                    res = fx(item)
-                    if isinstance(res, Exception):
-                        errors.append(res)
-                    else:
-                        outputs.append(res)
+            while True:
+                chunk = self.redis.lpop(chunks_key)
+                if chunk is None:
+                    break
+
+                chunk = pickle_to_obj(chunk)
+                nrows, chunk_errors, nskipped = self.load_chunk(
+                    chunk, session, offset=progress['items'], **kw)
+
+                errors.extend(chunk_errors)
+                progress['skipped'] += nskipped
+                progress['items'] += len(chunk)
+                progress['rows'] += nrows
+                progress['errors'] = len(errors)
+                progress['chunks_loaded'] += 1
+                duration = max(time.time() - start, 0.001)
+                progress['rows_per_second'] = \
+                    round(progress['rows'] / duration, 2)
+                self._update_job_meta(**progress)
+
+            log.info('Bulk loaded {rows} rows at {rows_per_second} rows/sec'
+                     .format(**progress))
+
+            self.finish(session, **kw)
+            session.close()
 
             # return errors
             if len(errors):
-                self._handle_errors(errors)
-
-            # add objects and execute
-            if self.returns == 'model':
-                for o in outputs:
-                    if o is not None:
-                        try:
-                            session.add(o)
-                            session.commit(o)
-                        except Exception as e:
-                            self._handle_errors(e)
-
-            # union all queries
-            elif self.returns == 'query':
-                for query in outputs:
-                    if query is not None:
-                        try:
-                            session.execute(query)
-                        except Exception as e:
-                            self._handle_errors(e)
-
-            try:
-                session.commit()
-
-            except Exception as e:
-                session.rollback()
-                session.remove()
-                self._handle_errors(e)
+                return self._handle_errors(errors, progress['items'])
 
             # return true if everything worked.
-            session.close()
             return True
 
         except JobTimeoutException:
@@ -142,17 +394,39 @@ class BulkLoader(object):
                 'Bulk loading timed out after {} seconds'
                 .format(end-start))
 
+        # don't leave the rest of a failed job's chunks lying around.
+        finally:
+            if chunks_key:
+                self.redis.delete(chunks_key)
+
     def run(self, data, **kw):
 
-        # store the data + kwargs in redis temporarily
-        # this makes the enqueuing process much, much more
-        # efficient by allowing us to only pass a single key
-        # into the queue rather than a massive dump of data
+        # store the data in redis temporarily as a list of
+        # pickled chunks. this makes the enqueuing process much,
+        # much more efficient by allowing us to only pass a single key
+        # into the queue rather than a massive dump of data and
+        # lets workers load one chunk at a time.
+        # `data` can be any iterable, so a streaming request body
+        # is never held in memory all at once.
         # however it also means that all kwargs must be
         # json serializable
         job_id = gen_uuid()
         kwargs_key = self.kwargs_key.format(job_id)
-        kwargs = {'data': data, 'kw': kw}
+        chunks_key = self.chunks_key.format(job_id)
+
+        nchunks = 0
+        try:
+            for chunk in chunk_list(data, self.chunk_size):
+                self.redis.rpush(chunks_key, obj_to_pickle(chunk))
+                self.redis.expire(chunks_key, self.kwargs_ttl)
+                nchunks += 1
+
+        # don't leave partial uploads lying around.
+        except Exception:
+            self.redis.delete(chunks_key)
+            raise
+
+        kwargs = {'kw': kw, 'chunks_key': chunks_key, 'chunks': nchunks}
         self.redis.set(kwargs_key, obj_to_pickle(kwargs), ex=self.kwargs_ttl)
 
         # send the job to the task queue
@@ -166,11 +440,45 @@ class BulkLoader(object):
 
 class ContentTimeseriesBulkLoader(BulkLoader):
 
-    returns = 'query'
+    returns = 'rows'
     timeout = 240
 
+    def __init__(self):
+        # the earliest datetime loaded for each content item, so
+        # we only rebuild the rollup buckets which have changed.
+        self.changed = {}
+
     def load_one(self, item, **kw):
-        return ingest_metric.content_timeseries(item, **kw)
+        return ingest_metric.content_timeseries_row(item, **kw)
+
+    def load_many(self, pairs, **kw):
+        # validate the whole chunk in one pass.
+        batch = ingest_metric.content_timeseries_batch(pairs, **kw)
+        results = list(batch.rows())
+        results.extend((i, Exception(e.message)) for i, e in batch.errors)
+        return results
+
+    def load_rows(self, rows, session):
+        changed = self.changed
+        for r in rows:
+            id, dt = r['content_item_id'], r['datetime']
+            if id not in changed or dt < changed[id]:
+                changed[id] = dt
+        return ingest_metric.bulk_content_timeseries(rows, session)
+
+    def committed(self, batch, **kw):
+        # log changes as we go so summaries catch up even
+        # if a later chunk fails or the job times out.
+        ids = set(r['content_item_id'] for i, r in batch)
+        rollup_metric.content_timeseries_changes.record(kw['org_id'], ids)
+
+    def finish(self, session, **kw):
+        changed, self.changed = self.changed, {}
+        if not len(changed):
+            return
+        org = session.query(Org).get(kw['org_id'])
+        rollup_metric.content_timeseries_to_rollups(
+            org, changed=changed, session=session)
 
 
 class ContentSummaryBulkLoader(BulkLoader):
@@ -178,8 +486,22 @@ class ContentSummaryBulkLoader(BulkLoader):
     returns = 'query'
     timeout = 480
 
+    def __init__(self):
+        # the content items loaded, so we only recompute
+        # the comparisons which include them.
+        self.changed = set()
+
     def load_one(self, item, **kw):
-        return ingest_metric.content_summary(item, **kw)
+        content_item_id = item.get('content_item_id')
+        cmd = ingest_metric.content_summary(item, **kw)
+        self.changed.add(content_item_id)
+        return cmd
+
+    def finish(self, session, **kw):
+        changed, self.changed = self.changed, set()
+        if not len(changed):
+            return
+        rollup_metric.summaries_changed(kw['org_id'], list(changed))
 
 
 class OrgTimeseriesBulkLoader(BulkLoader):
@@ -195,18 +517,131 @@ class EventBulkLoader(BulkLoader):
 
     returns = 'model'
     timeout = 480
+    commit_size = 100
+    index = EventIngestIndex()
+    thumbnail_table = 'events'
+
+    def __init__(self):
+        # the content items linked to approved events, so
+        # we only recount their event tags.
+        self.changed = set()
+
+    def prepare_chunk(self, data, **kw):
+        kw['lookups'] = ingest_util.prepare_lookups(data, kw['org_id'])
+        return kw
+
+    def load_many(self, pairs, **kw):
+        # resolve the chunk's distinct urls + thumbnails concurrently
+        # before preparing items.
+        kw['resolved'] = ingest_util.resolve_batch(
+            [p[1] for p in pairs], domains=kw['org_domains'])
+        return super(EventBulkLoader, self).load_many(pairs, **kw)
+
+    def index_key(self, item, **kw):
+        # manual events get random source ids so can't be deduped.
+        if not item.get('recipe_id') or not item.get('source_id'):
+            return None
+        slug = ingest_util.lookup_recipe_slug(
+            item['recipe_id'], kw['org_id'], None, kw['lookups'])
+        if not slug:
+            return None
+        return "{}:{}".format(slug, item['source_id'])
+
+    def index_exists(self, ids, session, **kw):
+        # deleted events should still raise an error.
+        return set(r.id for r in session.query(Event.id)
+                   .filter_by(org_id=kw['org_id'])
+                   .filter(Event.id.in_(ids))
+                   .filter(Event.status != 'deleted'))
+
+    def skipped(self, pairs, session, **kw):
+        # links aren't part of the fingerprint, so an unchanged event
+        # may link to content items which have been loaded since.
+        pairs = [(id, item) for id, item in pairs if item.get('links')]
+        if not len(pairs):
+            return
+        resolved = ingest_util.resolve_batch(
+            [item for id, item in pairs], domains=kw['org_domains'],
+            url_field=None, img_field=None)
+        events = dict((e.id, e) for e in session.query(Event)
+                      .filter(Event.id.in_([id for id, item in pairs])))
+        changed = set()
+        try:
+            for id, item in pairs:
+                e = events.get(id)
+                links = ingest_util.prepare_links(
+                    item['links'], kw['org_domains'], resolved=resolved)
+                if not e or not len(links):
+                    continue
+                content_items = ingest_event._fetch_content_items(
+                    kw['org_id'], links, item.get('content_item_ids', []),
+                    session)
+                for c in content_items:
+                    if c.id not in e.content_item_ids:
+                        e.content_items.append(c)
+                        if e.status == 'approved':
+                            changed.add(c.id)
+            session.commit()
+        except Exception as err:
+            session.rollback()
+            log.warning('Error linking unchanged events: {}'.format(err))
+            return
+        rollup_metric.event_tags_changed(kw['org_id'], changed)
 
     def load_one(self, item, **kw):
-        return ingest_event.ingest(item, **kw)
+        return ingest_event.prepare(item, **kw)
+
+    def persist_one(self, output, session, **kw):
+        # persisting mutates the prepared item, so copy it in
+        # case this batch gets retried.
+        e = ingest_event.persist(copy.deepcopy(output), session, **kw)
+        if e is not None:
+            # include events which were approved before this update.
+            history = inspect(e).attrs.status.history
+            if 'approved' in [e.status] + list(history.deleted or []):
+                self.changed.update(e.content_item_ids)
+        return e
+
+    def committed(self, batch, **kw):
+        changed, self.changed = self.changed, set()
+        rollup_metric.event_tags_changed(kw['org_id'], changed)
 
 
 class ContentItemBulkLoader(BulkLoader):
 
     returns = 'model'
     timeout = 240
+    commit_size = 100
+    index = ContentItemIngestIndex()
+    thumbnail_table = 'content'
+
+    def prepare_chunk(self, data, **kw):
+        kw['lookups'] = ingest_util.prepare_lookups(data, kw['org_id'])
+        return kw
+
+    def load_many(self, pairs, **kw):
+        # resolve the chunk's distinct urls + thumbnails concurrently
+        # before preparing items.
+        kw['resolved'] = ingest_util.resolve_batch([p[1] for p in pairs])
+        return super(ContentItemBulkLoader, self).load_many(pairs, **kw)
+
+    def index_key(self, item, **kw):
+        if not item.get('type') or not item.get('url'):
+            return None
+        return "{}:{}".format(item['type'], item['url'])
+
+    def index_exists(self, ids, session, **kw):
+        return set(r.id for r in session.query(ContentItem.id)
+                   .filter_by(org_id=kw['org_id'])
+                   .filter(ContentItem.id.in_(ids)))
 
     def load_one(self, item, **kw):
-        return ingest_content_item.ingest(item, **kw)
+        return ingest_content_item.prepare(item, **kw)
+
+    def persist_one(self, output, session, **kw):
+        # persisting mutates the prepared item, so copy it in
+        # case this batch gets retried.
+        return ingest_content_item.persist(copy.deepcopy(output), session, **kw)
 
 
 # make sure the functions are importable + pickleable
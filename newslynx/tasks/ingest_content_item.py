@@ -3,13 +3,14 @@ from psycopg2 import IntegrityError
 from newslynx.core import gen_session
 from newslynx.models import ExtractCache
 from newslynx.models import (
-    ContentItem, Tag, Recipe, Author)
+    ContentItem)
 from newslynx.models.util import (
     get_table_columns,
     fetch_by_id_or_field)
 from newslynx.views.util import validate_content_item_types
 from newslynx.exc import RequestError
 from newslynx.tasks import ingest_util
+from newslynx.tasks import thumbnail
 
 
 extract_cache = ExtractCache()
@@ -21,14 +22,46 @@ def ingest(
         url_fields=['body'],
         requires=['url', 'type'],
         extract=True,
-        kill_session=True):
+        kill_session=True,
+        lookups=None):
     """
-    Ingest an Event.
+    Ingest an Event. ``lookups`` are pre-resolved
+    tags / recipes / authors from ``ingest_util.prepare_lookups``.
     """
 
     # distinct session for this eventlet.
     session = gen_session()
 
+    prepared = prepare(obj, org_id, requires=requires, extract=extract)
+    c = persist(prepared, session, lookups=lookups)
+
+    # generate the thumbnail asynchronously.
+    session.flush()
+    needs_thumbnail = c.img_url and not c.thumbnail
+    c_id = c.id
+
+    session.commit()
+    if needs_thumbnail:
+        thumbnail.enqueue('content', [c_id])
+    if kill_session:
+        session.close()
+    return c
+
+
+def prepare(
+        obj,
+        org_id,
+        requires=['url', 'type'],
+        extract=True,
+        resolved=None,
+        **kw):
+    """
+    Validate, normalize and extract a Content Item. This is the slow,
+    network-bound part of ingestion and doesn't touch the database,
+    so it can be run concurrently. ``resolved`` are urls / thumbnails
+    from ``ingest_util.resolve_batch``.
+    """
+
     # check required fields
     ingest_util.check_requires(obj, requires, type='Content Item')
 
@@ -43,7 +76,7 @@ def ingest(
     obj.pop('id', None)
 
     # normalize the url
-    obj['url'] = ingest_util.prepare_url(obj, 'url')
+    obj['url'] = ingest_util.prepare_url(obj, 'url', resolved=resolved)
 
     # run article extraction.
     if extract:
@@ -69,8 +102,12 @@ def ingest(
         if not obj['created']:
             obj.pop('created')
 
-    # get thumbnail
-    obj['thumbnail'] = ingest_util.prepare_thumbnail(obj, 'img_url')
+    # thumbnails are generated asynchronously unless
+    # they've already been resolved for this batch.
+    obj['thumbnail'] = ingest_util.prepare_thumbnail(
+        obj, 'img_url', resolved=resolved, defer=True)
+    if not obj['thumbnail']:
+        obj.pop('thumbnail')
 
     # split out tags_ids + authors + links
     tag_ids = obj.pop('tag_ids', [])
@@ -78,8 +115,26 @@ def ingest(
     authors.extend(obj.pop('authors', []))  # accept names too
     # links = obj.pop('links', {})
 
+    return {
+        'obj': obj,
+        'org_id': org_id,
+        'tag_ids': tag_ids,
+        'authors': authors
+    }
+
+
+def persist(prepared, session, lookups=None, **kw):
+    """
+    Upsert a prepared Content Item and its associations
+    into ``session`` without committing.
+    """
+    obj = prepared['obj']
+    org_id = prepared['org_id']
+    tag_ids = prepared['tag_ids']
+    authors = prepared['authors']
+
     # determine event provenance
-    obj = _content_item_provenance(obj, org_id)
+    obj = _content_item_provenance(obj, org_id, session, lookups)
 
     # split out meta fields
     obj = ingest_util.split_meta(obj, get_table_columns(ContentItem))
@@ -97,6 +152,10 @@ def ingest(
 
     # else, update it
     else:
+        # the thumbnail is stale if the image changed.
+        if 'img_url' in obj and obj['img_url'] != c.img_url:
+            c.thumbnail = None
+
         for k, v in obj.items():
             setattr(c, k, v)
 
@@ -113,23 +172,21 @@ def ingest(
 
     # associate tags
     if len(tag_ids):
-        c = _associate_tags(c, org_id, tag_ids, session)
+        c = _associate_tags(c, org_id, tag_ids, session, lookups)
 
     # associate tags
     if len(authors):
-        _authors = _associate_authors(c, org_id, authors, session)
+        _authors = _associate_authors(
+            c, org_id, authors, session, lookups)
         for a in _authors:
             if a.id not in c.author_ids:
                 c.authors.append(a)
 
     session.add(c)
-    session.commit()
-    if kill_session:
-        session.close()
     return c
 
 
-def _content_item_provenance(obj, org_id):
+def _content_item_provenance(obj, org_id, session, lookups=None):
     """
     if there's not a recipe_id set the provenance as "manual"
     otherwise check it the recipe id is valid and set as "recipe"
@@ -142,12 +199,10 @@ def _content_item_provenance(obj, org_id):
     # this is from a recipe
     else:
         # fetch the associated recipe
-        r = Recipe.query\
-            .filter_by(id=obj['recipe_id'])\
-            .filter_by(org_id=org_id)\
-            .first()
+        slug = ingest_util.lookup_recipe_slug(
+            obj['recipe_id'], org_id, session, lookups)
 
-        if not r:
+        if not slug:
             raise RequestError(
                 'Recipe id "{recipe_id}" does not exist.'
                 .format(**obj))
@@ -158,7 +213,7 @@ def _content_item_provenance(obj, org_id):
     return obj
 
 
-def _associate_authors(c, org_id, authors, session):
+def _associate_authors(c, org_id, authors, session, lookups=None):
     """
     Associate authors with a content item.
     """
@@ -167,40 +222,14 @@ def _associate_authors(c, org_id, authors, session):
     _authors = []
 
     for author in authors:
-        # is this an id or a name ?
-        try:
-            int(author)
-            is_name = False
-
-        except ValueError:
-            is_name = True
-
-        # upsert by name.
-        if is_name:
-
-            # standardize as much as we can.
-            author = author.upper().strip()
-            a = session.query(Author)\
-                .filter_by(name=author, org_id=org_id)\
-                .first()
-
-            if not a:
-                a = Author(org_id=org_id, name=author)
-
-        # get by id.
-        else:
-            a = session.query(Author)\
-                .filter_by(id=author, org_id=org_id)\
-                .first()
-            if not a:
-                a = Author(org_id=org_id, id=author)
+        a = ingest_util.lookup_author(author, org_id, session, lookups)
         _authors.append(a)
 
     # return authors
     return _authors
 
 
-def _associate_tags(c, org_id, tag_ids, session):
+def _associate_tags(c, org_id, tag_ids, session, lookups=None):
     """
     Associate tags with event ids.
     """
@@ -209,27 +238,7 @@ def _associate_tags(c, org_id, tag_ids, session):
 
     for tag in tag_ids:
 
-        # is this an id or a name ?
-        try:
-            int(tag)
-            is_name = False
-
-        except ValueError:
-            is_name = True
-
-        # upsert by name.
-        if is_name:
-
-            # standardize as much as we can.
-            t = session.query(Tag)\
-                .filter_by(slug=tag, org_id=org_id)\
-                .first()
-
-        # upsert by id.
-        else:
-            t = session.query(Tag)\
-                .filter_by(id=tag, org_id=org_id)\
-                .first()
+        t = ingest_util.lookup_tag(tag, org_id, session, lookups)
 
         # create new author.
         if not t:
@@ -3,11 +3,12 @@ from sqlalchemy import or_
 from newslynx.core import gen_session
 from newslynx.util import gen_uuid
 from newslynx.models import (
-    Event, ContentItem, Tag, Recipe)
+    Event, ContentItem)
 from newslynx.models.util import get_table_columns
 from newslynx.views.util import validate_event_status
 from newslynx.exc import RequestError, UnprocessableEntityError
 from newslynx.tasks import ingest_util
+from newslynx.tasks import thumbnail
 
 
 def ingest(
@@ -17,15 +18,47 @@ def ingest(
         url_fields=['title', 'body', 'description'],
         requires=['title'],
         must_link=False,
-        kill_session=True):
+        kill_session=True,
+        lookups=None):
     """
-    Ingest an Event.
+    Ingest an Event. ``lookups`` are pre-resolved
+    tags / recipes from ``ingest_util.prepare_lookups``.
     """
 
     # distinct session for this eventlet.
     session = gen_session()
 
-    has_content_items = False
+    prepared = prepare(obj, org_id, org_domains, requires=requires)
+    e = persist(prepared, session, must_link=must_link, lookups=lookups)
+    if not e:
+        return None
+
+    # generate the thumbnail asynchronously.
+    session.flush()
+    needs_thumbnail = e.img_url and not e.thumbnail
+    e_id = e.id
+
+    session.commit()
+    if needs_thumbnail:
+        thumbnail.enqueue('events', [e_id])
+    if kill_session:
+        session.close()
+    return e
+
+
+def prepare(
+        obj,
+        org_id,
+        org_domains,
+        requires=['title'],
+        resolved=None,
+        **kw):
+    """
+    Validate and normalize an Event. This is the slow, network-bound
+    part of ingestion and doesn't touch the database, so it can be
+    run concurrently. ``resolved`` are urls / thumbnails from
+    ``ingest_util.resolve_batch``.
+    """
 
     # check required fields
     ingest_util.check_requires(obj, requires, type='Event')
@@ -45,7 +78,7 @@ def ingest(
     obj.pop('id', None)
 
     # normalize the url
-    obj['url'] = ingest_util.prepare_url(obj, 'url')
+    obj['url'] = ingest_util.prepare_url(obj, 'url', resolved=resolved)
 
     # sanitize creation date
     obj['created'] = ingest_util.prepare_date(obj, 'created')
@@ -58,16 +91,56 @@ def ingest(
         obj, 'description', obj['url'])
     obj['body'] = ingest_util.prepare_str(obj, 'body', obj['url'])
 
-    # get thumbnail
-    obj['thumbnail'] = ingest_util.prepare_thumbnail(obj, 'img_url')
+    # thumbnails are generated asynchronously unless
+    # they've already been resolved for this batch.
+    obj['thumbnail'] = ingest_util.prepare_thumbnail(
+        obj, 'img_url', resolved=resolved, defer=True)
+    if not obj['thumbnail']:
+        obj.pop('thumbnail')
 
     # split out tags_ids + content_item_ids
     tag_ids = obj.pop('tag_ids', [])
     content_item_ids = obj.pop('content_item_ids', [])
     links = obj.pop('links', [])
 
+    # extract urls and normalize urls asynchronously.
+    links = ingest_util.prepare_links(links, org_domains, resolved=resolved)
+
+    return {
+        'obj': obj,
+        'org_id': org_id,
+        'tag_ids': tag_ids,
+        'content_item_ids': content_item_ids,
+        'links': links
+    }
+
+
+def persist(
+        prepared,
+        session,
+        must_link=False,
+        lookups=None,
+        **kw):
+    """
+    Upsert a prepared Event and its associations into ``session``
+    without committing. Returns None if the event should be skipped.
+    """
+    obj = prepared['obj']
+    org_id = prepared['org_id']
+
+    # detect content_items
+    content_items = []
+    if len(prepared['links']):
+        content_items = _fetch_content_items(
+            org_id, prepared['links'], prepared['content_item_ids'], session)
+
+    # dont commit event if we're only looking
+    # for events that link to content_items
+    if not len(content_items) and must_link:
+        return None
+
     # determine event provenance
-    obj = _event_provenance(obj, org_id, session)
+    obj = _event_provenance(obj, org_id, session, lookups)
 
     # split out meta fields
     obj = ingest_util.split_meta(obj, get_table_columns(Event))
@@ -92,34 +165,27 @@ def ingest(
                 'Event {} already exists and has been previously deleted.'
                 .format(e.id))
 
+        # the thumbnail is stale if the image changed.
+        if 'img_url' in obj and obj['img_url'] != e.img_url:
+            e.thumbnail = None
+
         for k, v in obj.items():
             setattr(e, k, v)
 
-    # extract urls and normalize urls asynchronously.
-    links = ingest_util.prepare_links(links, org_domains)
-
-    # detect content_items
-    if len(links):
-        e, has_content_items = _associate_content_items(
-            e, org_id, links, content_item_ids, session)
+    # upsert content_items.
+    for t in content_items:
+        if t.id not in e.content_item_ids:
+            e.content_items.append(t)
 
     # associate tags
-    if len(tag_ids):
-        e = _associate_tags(e, org_id, tag_ids, session)
-
-    # dont commit event if we're only looking
-    # for events that link to content_items
-    if not has_content_items and must_link:
-        return None
+    if len(prepared['tag_ids']):
+        e = _associate_tags(e, org_id, prepared['tag_ids'], session, lookups)
 
     session.add(e)
-    session.commit()
-    if kill_session:
-        session.close()
     return e
 
 
-def _event_provenance(o, org_id, session):
+def _event_provenance(o, org_id, session, lookups=None):
     """
     if there's not a recipe_id set a random source id +
     set the recipe_id as "None" and preface the source_id
@@ -144,19 +210,17 @@ def _event_provenance(o, org_id, session):
                 'Recipe-generated events must include a source_id.')
 
         # fetch the associated recipe
-        r = session.query(Recipe)\
-            .filter_by(id=o['recipe_id'])\
-            .filter_by(org_id=org_id)\
-            .first()
+        slug = ingest_util.lookup_recipe_slug(
+            o['recipe_id'], org_id, session, lookups)
 
-        if not r:
+        if not slug:
             raise RequestError(
                 'Recipe id "{recipe_id}" does not exist.'
                 .format(**o))
 
         # reformant source id.
         o['source_id'] = "{}:{}"\
-            .format(str(r.slug), str(o['source_id']))
+            .format(str(slug), str(o['source_id']))
 
         # set this event as non-manual
         o['provenance'] = 'recipe'
@@ -164,29 +228,18 @@ def _event_provenance(o, org_id, session):
     return o
 
 
-def _associate_content_items(e, org_id, urls, content_item_ids, session):
+def _fetch_content_items(org_id, urls, content_item_ids, session):
     """
-    Check if event has associations with content items.
+    Fetch content items an event links to.
     """
-    has_content_items = False
-
-    content_items = session.query(ContentItem)\
+    return session.query(ContentItem)\
         .filter(or_(ContentItem.url.in_(urls),
                     ContentItem.id.in_(content_item_ids)))\
         .filter(ContentItem.org_id == org_id)\
         .all()
 
-    if len(content_items):
-        has_content_items = True
 
-        # upsert content_items.
-        for t in content_items:
-            if t.id not in e.content_item_ids:
-                e.content_items.append(t)
-    return e, has_content_items
-
-
-def _associate_tags(e, org_id, tag_ids, session):
+def _associate_tags(e, org_id, tag_ids, session, lookups=None):
     """
     Associate tags with event ids.
     """
@@ -195,27 +248,7 @@ def _associate_tags(e, org_id, tag_ids, session):
 
     for tag in tag_ids:
 
-        # is this an id or a name ?
-        try:
-            int(tag)
-            is_name = False
-
-        except ValueError:
-            is_name = True
-
-        # upsert by name.
-        if is_name:
-
-            # standardize as much as we can.
-            t = session.query(Tag)\
-                .filter_by(slug=tag, org_id=org_id)\
-                .first()
-
-        # upsert by id.
-        else:
-            t = session.query(Tag)\
-                .filter_by(id=tag, org_id=org_id)\
-                .first()
+        t = ingest_util.lookup_tag(tag, org_id, session, lookups)
 
         # create new author.
         if not t:
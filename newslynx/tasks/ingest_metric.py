@@ -1,3 +1,6 @@
+import logging
+from collections import OrderedDict
+
 from newslynx.core import db
 from newslynx.lib import dates
 from newslynx.exc import RequestError
@@ -5,6 +8,9 @@ from newslynx.tasks import ingest_util
 from newslynx.lib.serialize import obj_to_json
 
 
+log = logging.getLogger(__name__)
+
+
 def content_timeseries(
         obj,
         org_id=None,
@@ -14,9 +20,42 @@ def content_timeseries(
     """
     Ingest Timeseries Metrics for a content item.
     """
+    cmd_kwargs = content_timeseries_row(
+        obj,
+        org_id=org_id,
+        metrics_lookup=metrics_lookup,
+        content_item_ids=content_item_ids)
+    metrics = cmd_kwargs.pop('metrics')
+
+    # upsert command
+    cmd = """SELECT upsert_content_metric_timeseries(
+                {org_id},
+                {content_item_id},
+                '{datetime}',
+                '{metrics}')
+           """.format(metrics=obj_to_json(metrics), **cmd_kwargs)
+
+    if commit:
+        try:
+            db.session.execute(cmd)
+        except Exception as err:
+            raise RequestError(err.message)
+        cmd_kwargs['metrics'] = metrics
+    return cmd
+
+
+def content_timeseries_row(
+        obj,
+        org_id=None,
+        metrics_lookup=None,
+        content_item_ids=None):
+    """
+    Validate a content timeseries record and return the
+    row we'll upsert: org_id, content_item_id, datetime, metrics.
+    """
     # if not content_item_id or not org or not metrics_lookup:
     #     raise RequestError('Missing required kwargs.')
-    content_item_id = obj.pop('content_item_id')
+    content_item_id = obj.pop('content_item_id', None)
     if not content_item_id:
         raise RequestError('Object is missing a "content_item_id"')
     if not content_item_id in content_item_ids:
@@ -39,27 +78,159 @@ def content_timeseries(
         cmd_kwargs['datetime'] = dates.floor(
             dt, unit='hour', value=1).isoformat()
 
-    metrics = ingest_util.prepare_metrics(
+    cmd_kwargs['metrics'] = ingest_util.prepare_metrics(
         obj,
         metrics_lookup,
         valid_levels=['content_item', 'all'],
         check_timeseries=True)
+    return cmd_kwargs
 
-    # upsert command
-    cmd = """SELECT upsert_content_metric_timeseries(
-                {org_id},
-                {content_item_id},
-                '{datetime}',
-                '{metrics}')
-           """.format(metrics=obj_to_json(metrics), **cmd_kwargs)
 
-    if commit:
-        try:
-            db.session.execute(cmd)
-        except Exception as err:
-            raise RequestError(err.message)
-        cmd_kwargs['metrics'] = metrics
-    return cmd
+def content_timeseries_batch(
+        pairs,
+        org_id=None,
+        metrics_lookup=None,
+        content_item_ids=None):
+    """
+    Validate a batch of (position, record) pairs for the content
+    timeseries in one pass. ``metrics_lookup`` should be a compiled
+    MetricSchema. Returns a MetricBatch of org_id, content_item_id,
+    datetime and metrics columns.
+    """
+    content_item_ids = set(content_item_ids or [])
+    now = dates.floor_now(unit='hour', value=1).isoformat()
+    datetimes = {}
+    prepared = []
+    errors = []
+
+    for i, obj in pairs:
+        content_item_id = obj.pop('content_item_id', None)
+        if not content_item_id:
+            errors.append(
+                (i, RequestError('Object is missing a "content_item_id"')))
+            continue
+        if not content_item_id in content_item_ids:
+            errors.append((i, RequestError(
+                'Content Item with ID {} doesnt exist'
+                .format(content_item_id))))
+            continue
+
+        # rows in a batch tend to share timestamps.
+        ds = obj.pop('datetime', None)
+        if ds is None:
+            dt = now
+        elif ds in datetimes:
+            dt = datetimes[ds]
+        else:
+            try:
+                dt = dates.floor(
+                    dates.parse_iso(ds), unit='hour', value=1).isoformat()
+            except Exception as e:
+                errors.append((i, e))
+                continue
+            datetimes[ds] = dt
+
+        obj['org_id'] = org_id
+        obj['content_item_id'] = content_item_id
+        obj['datetime'] = dt
+        prepared.append((i, obj))
+
+    batch = metrics_lookup.validate_batch(
+        prepared, fields=['org_id', 'content_item_id', 'datetime'])
+    batch.errors.extend(errors)
+    return batch
+
+
+def bulk_content_timeseries(rows, session=None):
+    """
+    Upsert a batch of content timeseries rows (as returned by
+    `content_timeseries_row`) with a single statement.
+
+    The rows are staged as a multi-row VALUES list and merged
+    into `content_metric_timeseries` with an UPDATE ... FROM
+    followed by an INSERT of the rows that didn't match. This
+    mirrors `upsert_content_metric_timeseries`: existing metrics
+    are merged with the new ones and `updated` is bumped.
+
+    If the statement fails (IE: a concurrent insert of the same key)
+    we fall back to the per-row upsert function for this batch, each
+    row in it's own savepoint so a bad row only fails itself.
+
+    Returns the number of distinct rows upserted.
+    """
+    if session is None:
+        session = db.session
+
+    # merge duplicate keys in order, just like sequential upserts would.
+    merged = OrderedDict()
+    for r in rows:
+        k = (r['org_id'], r['content_item_id'], r['datetime'])
+        if k not in merged:
+            merged[k] = {}
+        merged[k].update(r['metrics'])
+
+    if not len(merged):
+        return 0
+
+    # we're using the raw cursor here to avoid having sqlalchemy
+    # parse thousands of literals for bind params.
+    cursor = session.connection().connection.cursor()
+    values = ",\n".join([
+        cursor.mogrify(
+            "(%s, %s, %s::timestamptz, %s::jsonb)",
+            (org_id, content_item_id, dt, obj_to_json(metrics)))
+        for (org_id, content_item_id, dt), metrics in merged.items()
+    ])
+
+    cmd = """WITH staged (org_id, content_item_id, datetime, metrics) AS (
+                VALUES {values}
+            ),
+            updated AS (
+                UPDATE content_metric_timeseries t
+                SET metrics = COALESCE(t.metrics, '{{}}'::jsonb) || s.metrics,
+                    updated = current_timestamp
+                FROM staged s
+                WHERE
+                    t.org_id = s.org_id AND
+                    t.content_item_id = s.content_item_id AND
+                    t.datetime = s.datetime
+                RETURNING t.org_id, t.content_item_id, t.datetime
+            )
+            INSERT INTO content_metric_timeseries
+                (org_id, content_item_id, datetime, metrics, updated)
+            SELECT s.org_id, s.content_item_id, s.datetime,
+                   s.metrics, current_timestamp
+            FROM staged s
+            LEFT JOIN updated u ON
+                u.org_id = s.org_id AND
+                u.content_item_id = s.content_item_id AND
+                u.datetime = s.datetime
+            WHERE u.content_item_id IS NULL
+         """.format(values=values)
+
+    cursor.execute("SAVEPOINT bulk_content_timeseries")
+    try:
+        cursor.execute(cmd)
+        cursor.execute("RELEASE SAVEPOINT bulk_content_timeseries")
+
+    except Exception:
+        cursor.execute("ROLLBACK TO SAVEPOINT bulk_content_timeseries")
+        n = 0
+        for (org_id, content_item_id, dt), metrics in merged.items():
+            nested = session.begin_nested()
+            try:
+                cursor.execute(
+                    "SELECT upsert_content_metric_timeseries(%s, %s, %s, %s)",
+                    (org_id, content_item_id, dt, obj_to_json(metrics)))
+                nested.commit()
+                n += 1
+            except Exception as e:
+                nested.rollback()
+                log.warning(
+                    'Error upserting timeseries for content item {} at {}: {}'
+                    .format(content_item_id, dt, e))
+        return n
+    return len(merged)
 
 
 def content_summary(
@@ -71,7 +242,7 @@ def content_summary(
     """
     Ingest Summary Metrics for a content item.
     """
-    content_item_id = obj.pop('content_item_id')
+    content_item_id = obj.pop('content_item_id', None)
     if not content_item_id:
         raise RequestError('Object is missing a "content_item_id"')
     if not content_item_id in content_item_ids:
@@ -1,13 +1,18 @@
 from gevent.monkey import patch_all
 patch_all()
-from gevent.pool import Pool
+from gevent.lock import BoundedSemaphore
 
+from sqlalchemy import or_
+
+from newslynx.core import gen_session
 from newslynx.lib import dates
 from newslynx.lib import url
 from newslynx.lib import text
 from newslynx.lib import html
 from newslynx.lib import stats
 from newslynx.models import URLCache, ThumbnailCache
+from newslynx.models import Tag, Recipe, Author
+from newslynx.models import MetricSchema
 from newslynx import settings
 from newslynx.exc import RequestError
 from newslynx.constants import METRIC_FACET_KEYS
@@ -16,27 +21,108 @@ from newslynx.constants import METRIC_FACET_KEYS
 url_cache = URLCache()
 thumbnail_cache = ThumbnailCache()
 
-# a pool to multithread url_cache.
-url_cache_pool = Pool(settings.URL_CACHE_POOL_SIZE)
+
+def filter_links(links=[], domains=[]):
+    """
+    Only keep links to an org's domains.
+    """
+    if not len(domains):
+        return links
+    return [l for l in links if any([d in l for d in domains])]
 
 
-def prepare_links(links=[], domains=[]):
+def prepare_links(links=[], domains=[], resolved=None):
     """
     Prepare links to be tested against content items.
     """
-    if len(domains):
-        _links = []
-        for l in links:
-            if any([d in l for d in domains]):
-                _links.append(l)
-        links = _links
+    links = filter_links(links, domains)
     raw_urls = list(set(links))
     clean_urls = set()
-    for cache_response in url_cache_pool.imap_unordered(url_cache.get, list(raw_urls)):
-        clean_urls.add(cache_response.value)
+
+    # use urls resolved for the whole batch. those which
+    # failed have already been retried by `resolve_many`.
+    if resolved is not None:
+        for u in raw_urls:
+            if resolved['urls'].get(u):
+                clean_urls.add(resolved['urls'][u])
+        raw_urls = [u for u in raw_urls if u not in resolved['urls']]
+
+    for cache_response in url_cache.get_many(raw_urls).values():
+        if cache_response.value:
+            clean_urls.add(cache_response.value)
     return list(clean_urls)
 
 
+def resolve_many(cache, values, pool_size, per_host):
+    """
+    Get many values from a cache, working on misses concurrently
+    but allowing no more than ``per_host`` concurrent requests per
+    host. Values which fail are retried once. Returns a dictionary
+    of value => result.
+    """
+    semaphores = {}
+
+    def _work(v):
+        host = url.get_domain(v)
+        if host not in semaphores:
+            semaphores[host] = BoundedSemaphore(per_host)
+        with semaphores[host]:
+            try:
+                return cache.work(v)
+            except Exception:
+                return None
+
+    values = list(set(values))
+    if not len(values):
+        return {}
+    results = {}
+    for attempt in range(2):
+        responses = cache.get_many(values, work=_work, pool_size=pool_size)
+        results.update((v, cr.value) for v, cr in responses.items())
+        values = [v for v, r in results.items() if not r]
+        if not len(values):
+            break
+    return results
+
+
+def resolve_batch(
+        data,
+        domains=[],
+        url_field='url',
+        img_field='img_url',
+        links_field='links'):
+    """
+    Collect and dedupe all of the urls, links and image urls in a batch
+    of items and resolve them concurrently through the url and thumbnail
+    caches. Returns a lookup to pass into ``prepare_url``,
+    ``prepare_links`` and ``prepare_thumbnail`` as ``resolved``.
+    Links which aren't to one of ``domains`` are skipped, as they
+    are in ``prepare_links``.
+    """
+    urls = set()
+    imgs = set()
+    for obj in data:
+        u = obj.get(url_field)
+        if u:
+            try:
+                urls.add(url.prepare(
+                    u, canonicalize=False, expand=False))
+            except Exception:
+                pass
+        for l in filter_links(obj.get(links_field) or [], domains):
+            urls.add(l)
+        if obj.get(img_field):
+            imgs.add(obj[img_field])
+
+    pool_size = settings.RESOLVE_POOL_SIZE
+    per_host = settings.RESOLVE_PER_HOST
+    return {
+        'urls': resolve_many(url_cache, urls, pool_size, per_host),
+        'thumbnails': resolve_many(
+            thumbnail_cache, imgs, pool_size, per_host)
+    }
+
+
 def prepare_str(o, field, source_url=None):
     """
     Prepare text/html field
@@ -66,7 +152,7 @@ def prepare_date(o, field):
     return dt
 
 
-def prepare_url(o, field, source=None):
+def prepare_url(o, field, source=None, resolved=None):
     """
     Prepare a url
     """
@@ -76,19 +162,26 @@ def prepare_url(o, field, source=None):
         return None
     # prepare it first before the sending to the canoncilation cache
     u = url.prepare(o[field], source=source, canonicalize=False, expand=False)
+    if resolved is not None and resolved['urls'].get(u):
+        return resolved['urls'][u]
     cache_response = url_cache.get(u)
     return cache_response.value
 
 
-def prepare_thumbnail(o, field):
+def prepare_thumbnail(o, field, resolved=None, defer=False):
     """
-    Prepare a url
+    Prepare a url. If ``defer``, only use an already-resolved thumbnail,
+    leaving generation to the thumbnail queue.
     """
     if field not in o:
         return None
     if o[field] is None:
         return None
     u = o[field]
+    if resolved is not None and resolved['thumbnails'].get(u):
+        return resolved['thumbnails'][u]
+    if defer:
+        return None
 
     # create a thumbnail from an image.
     cache_response = thumbnail_cache.get(u)
@@ -129,6 +222,10 @@ def prepare_metrics(
     """
     Validate a metric.
     """
+    # use the compiled schema if we have one.
+    if isinstance(org_metric_lookup, MetricSchema):
+        return org_metric_lookup.validate(obj)
+
     # check if metrics exist and are properly formatted.
     obj.update(obj.pop('metrics', {}))
     for k in obj.keys():
@@ -146,9 +243,189 @@ def prepare_metrics(
         if m['faceted'] and not set(obj[k][0].keys()) == set(METRIC_FACET_KEYS):
             raise RequestError(
                 "Metric '{}' is faceted, but it\'s elements are not properly formatted. "
-                "Each facet must be a dictionary of '{\"facet\":\"facet_name\", \"value\": 1234}"
+                "Each facet must be a dictionary of '{{\"facet\":\"facet_name\", \"value\": 1234}}"
                 .format(k))
 
         # parse number
         obj[k] = stats.parse_number(obj[k])
     return obj
+
+
+def _listify(v):
+    if v is None:
+        return []
+    if not isinstance(v, list):
+        return [v]
+    return v
+
+
+def _split_ids_and_names(values):
+    """
+    Split a list of values into integer ids and string names.
+    """
+    ids = set()
+    names = set()
+    for v in values:
+        try:
+            ids.add(int(v))
+        except (ValueError, TypeError):
+            if isinstance(v, basestring):
+                names.add(v)
+    return ids, names
+
+
+def prepare_lookups(data, org_id):
+    """
+    Resolve all of the tags, recipes and authors referenced by
+    a batch of events / content items in a handful of queries.
+    Returns a dictionary of lookups to pass into ``ingest``:
+
+        - tags: tag id / slug => detached Tag
+        - recipes: recipe id => recipe slug
+        - authors: author id / name => detached Author
+    """
+    tags = set()
+    recipes = set()
+    authors = set()
+    for obj in data:
+        tags.update(_listify(obj.get('tag_ids')))
+        authors.update(_listify(obj.get('author_ids')))
+        authors.update(_listify(obj.get('authors')))
+        if obj.get('recipe_id'):
+            recipes.add(obj['recipe_id'])
+
+    lookups = {'tags': {}, 'recipes': {}, 'authors': {}}
+
+    # use a distinct session so the detached objects can be
+    # merged into each item's session.
+    session = gen_session()
+
+    tag_ids, tag_slugs = _split_ids_and_names(tags)
+    if len(tag_ids) or len(tag_slugs):
+        filters = []
+        if len(tag_ids):
+            filters.append(Tag.id.in_(tag_ids))
+        if len(tag_slugs):
+            filters.append(Tag.slug.in_(tag_slugs))
+        for t in session.query(Tag)\
+                .filter_by(org_id=org_id)\
+                .filter(or_(*filters)):
+            lookups['tags'][t.id] = t
+            lookups['tags'][t.slug] = t
+
+    recipe_ids, _ = _split_ids_and_names(recipes)
+    if len(recipe_ids):
+        for r in session.query(Recipe.id, Recipe.slug)\
+                .filter_by(org_id=org_id)\
+                .filter(Recipe.id.in_(recipe_ids)):
+            lookups['recipes'][r.id] = r.slug
+
+    author_ids, author_names = _split_ids_and_names(authors)
+    author_names = set([a.upper().strip() for a in author_names])
+    if len(author_ids) or len(author_names):
+        filters = []
+        if len(author_ids):
+            filters.append(Author.id.in_(author_ids))
+        if len(author_names):
+            filters.append(Author.name.in_(author_names))
+        for a in session.query(Author)\
+                .filter_by(org_id=org_id)\
+                .filter(or_(*filters)):
+            lookups['authors'][a.id] = a
+            lookups['authors'][a.name] = a
+
+    session.close()
+    return lookups
+
+
+def lookup_tag(tag, org_id, session, lookups=None):
+    """
+    Fetch a tag by id or slug, preferring a pre-resolved lookup.
+    """
+    # is this an id or a name ?
+    try:
+        tag = int(tag)
+        is_name = False
+
+    except ValueError:
+        is_name = True
+
+    if lookups is not None:
+        t = lookups['tags'].get(tag)
+        if t:
+            return session.merge(t, load=False)
+        return None
+
+    # upsert by name.
+    if is_name:
+        return session.query(Tag)\
+            .filter_by(slug=tag, org_id=org_id)\
+            .first()
+
+    # upsert by id.
+    return session.query(Tag)\
+        .filter_by(id=tag, org_id=org_id)\
+        .first()
+
+
+def lookup_recipe_slug(recipe_id, org_id, session, lookups=None):
+    """
+    Fetch a recipe's slug by id, preferring a pre-resolved lookup.
+    """
+    if lookups is not None:
+        try:
+            return lookups['recipes'].get(int(recipe_id))
+        except (ValueError, TypeError):
+            return None
+
+    r = session.query(Recipe.slug)\
+        .filter_by(id=recipe_id)\
+        .filter_by(org_id=org_id)\
+        .first()
+    if r:
+        return r.slug
+    return None
+
+
+def lookup_author(author, org_id, session, lookups=None):
+    """
+    Fetch an author by id or name, preferring a pre-resolved lookup.
+    Creates a new author if none exists.
+    """
+    # is this an id or a name ?
+    try:
+        author = int(author)
+        is_name = False
+
+    except ValueError:
+        is_name = True
+
+    # standardize as much as we can.
+    if is_name:
+        author = author.upper().strip()
+
+    if lookups is not None:
+        a = lookups['authors'].get(author)
+        if a:
+            return session.merge(a, load=False)
+
+    # a miss might be an author created earlier
+    # in this session, so fall back to querying.
+
+    # upsert by name.
+    if is_name:
+        a = session.query(Author)\
+            .filter_by(name=author, org_id=org_id)\
+            .first()
+
+    # get by id.
+    else:
+        a = session.query(Author)\
+            .filter_by(id=author, org_id=org_id)\
+            .first()
+
+    if a:
+        return a
+    if is_name:
+        return Author(org_id=org_id, name=author)
+    return Author(org_id=org_id, id=author)
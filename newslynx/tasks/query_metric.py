@@ -1,11 +1,26 @@
 from datetime import datetime, date
 import copy
 
+from sqlalchemy import text, bindparam, Integer, DateTime
+from sqlalchemy.dialects.postgresql import ARRAY
+
 from newslynx.core import db
-from .util import ResultIter
+from newslynx.exc import RequestError
+from newslynx import settings
+from newslynx.models import ContentMetricRollup
+from newslynx.models.metric_schema import get_schema_version
+from newslynx.models.cache import LocalCache
+from .util import ResultIter, stream
 from newslynx.util import uniq
 
 
+# an in-process LRU of compiled statements:
+# shape => (schema version, statement)
+_templates = LocalCache(
+    settings.TIMESERIES_TEMPLATE_CACHE_SIZE,
+    settings.TIMESERIES_TEMPLATE_CACHE_TTL)
+
+
 class TSQuery(object):
 
     """
@@ -16,6 +31,17 @@ class TSQuery(object):
     metrics_attr = None
     computed_metrics_attr = None
     cal_fx = None
+    rollup_table = None
+    rollup_model = None
+    rollup_units = []
+    # aggregates which give the same result over pre-aggregated buckets.
+    rollup_aggs = ['sum', 'min', 'max']
+
+    # transforms which reduce many ids' timeseries to one.
+    across_id_transforms = ['median', 'avg']
+
+    # transforms which need a row for every unit.
+    calendar_transforms = ['roll_avg', 'per_change', 'median', 'avg']
 
     date_col = 'datetime'
     metrics_col = 'metrics'
@@ -34,10 +60,20 @@ class TSQuery(object):
         self.sparse = kw.get('sparse', True)
         self.sig_digits = kw.get('sig_digits', 2)
         self.group_by_id = kw.get('group_by_id', True)
+        # override each metric's aggregation across ids.
+        self.agg = kw.get('agg', None)
         self.rm_nulls = kw.get('rm_nulls', False)
         self.time_since_start = kw.get('time_since_start', False)  # TODO
         # cumulative, avg, median, per_change, roll_avg
         self.transform = kw.get('transform', None)
+        self.roll_window = kw.get(
+            'roll_window', settings.TIMESERIES_ROLL_WINDOW)
+        # median + avg are taken across each id's timeseries.
+        if self.transform in self.across_id_transforms and \
+           not self.group_by_id:
+            raise RequestError(
+                "The '{}' transform requires group_by_id=true."
+                .format(self.transform))
         self.before = kw.get('before', None)
         self.after = kw.get('after', None)
         self.metrics = getattr(org, self.metrics_attr)
@@ -45,6 +81,7 @@ class TSQuery(object):
         # self.select_metrics()
         self.format_dates()
         self.compute = len(self.computed_metrics.keys()) > 0
+        self.rollup = self.use_rollup()
 
     # @property
     # def computed_metrics_require(self):
@@ -114,17 +151,78 @@ class TSQuery(object):
         """
         Format a date
         """
-        if isinstance(d, (datetime, date)):
-            return d.isoformat()
+        if isinstance(d, date) and not isinstance(d, datetime):
+            return datetime(d.year, d.month, d.day)
         return d
 
+    def is_bucket_start(self, d):
+        """
+        Is a date at the start of a bucket of this unit (in UTC)?
+        """
+        if not isinstance(d, datetime):
+            return False
+        if d.utcoffset():
+            return False
+        if (d.hour, d.minute, d.second, d.microsecond) != (0, 0, 0, 0):
+            return False
+        if self.unit == 'month' and d.day != 1:
+            return False
+        return True
+
+    def use_rollup(self):
+        """
+        Can we read pre-aggregated buckets instead of raw rows and
+        get the same result?
+        """
+        if not self.rollup_table or self.unit not in self.rollup_units:
+            return False
+
+        # partial buckets.
+        if self.before:
+            return False
+        if self.after and not self.is_bucket_start(self.after):
+            return False
+
+        # on raw rows cumulative metrics are turned into counts
+        # with lag() over only the rows after `after`, while
+        # rollups are built from the whole series.
+        if self.after:
+            for m in self.metrics.values():
+                if m['type'] == 'cumulative':
+                    return False
+
+        # averages of averages, etc.
+        if not self.group_by_id:
+            for m in self.metrics.values():
+                if self.metric_agg(m) not in self.rollup_aggs:
+                    return False
+
+        # rollups built from an old version of the org's metrics.
+        version = get_schema_version(self.org.id)
+        return self.rollup_model.is_current(self.org.id, version)
+
+    def metric_agg(self, metric):
+        """
+        The aggregation to apply to a metric.
+        """
+        if self.agg and not self.group_by_id:
+            return self.agg
+        return metric['agg']
+
+    @property
+    def aggregate_ids(self):
+        """
+        Do we need to aggregate rows across ids, even at the
+        minimum unit?
+        """
+        return not self.group_by_id and len(self.ids) > 1
+
     @property
     def ids_array(self):
         """
-        The array of ids to select.
+        The array of ids to select, as a bind.
         """
-        idstring = ", ".join([str(i) for i in self.ids])
-        return "ARRAY[{}]".format(idstring)
+        return "CAST(:ids AS int[])"
 
     @property
     def date_filter(self):
@@ -132,20 +230,31 @@ class TSQuery(object):
         Filter by date.
         """
         clauses = []
-        fmt = "{} {} '{}'"
+        fmt = "{} {} {}"
         if not self.filter_dates:
             return ""
 
         if self.before:
-            c = fmt.format(self.date_col, "<=", self.before)
+            c = fmt.format(self.date_col, "<=", ":before")
             clauses.append(c)
 
         if self.after:
-            c = fmt.format(self.date_col, ">=", self.after)
+            c = fmt.format(self.date_col, ">=", ":after")
             clauses.append(c)
 
         return "AND {}".format(" AND ".join(clauses))
 
+    @property
+    def metric_binds(self):
+        """
+        The bind name for each metric key.
+        """
+        if not hasattr(self, '_metric_binds'):
+            self._metric_binds = dict(
+                (n, 'metric_{}'.format(i))
+                for i, n in enumerate(sorted(self.metrics.keys())))
+        return self._metric_binds
+
     @property
     def query_kw(self):
         """
@@ -155,7 +264,7 @@ class TSQuery(object):
             table=self.table,
             id_col=self.id_col,
             date_col=self.date_col,
-            sig_digits=self.sig_digits,
+            sig_digits=":sig_digits",
             metrics_col=self.metrics_col,
             unit=self.unit,
             cal_fx=self.cal_fx,
@@ -176,8 +285,9 @@ class TSQuery(object):
         """
         Pull a json key out of the metrics store.
         """
-        return "({metrics_col} ->> '{name}')::text::numeric"\
-               .format(**self.add_kw(**metric))
+        return "({metrics_col} ->> CAST(:{bind} AS text))::text::numeric"\
+               .format(bind=self.metric_binds[metric['name']],
+                       **self.add_kw(**metric))
 
     def select_simple(self, metric):
         """
@@ -208,7 +318,9 @@ class TSQuery(object):
         A select statement for the agg query.
         """
         s = "ROUND({agg}({name}), {sig_digits}) as {name}"
-        return s.format(**self.add_kw(**metric))
+        kw = self.add_kw(**metric)
+        kw['agg'] = self.metric_agg(metric)
+        return s.format(**kw)
 
     def select_non_sparse(self, metric):
         """
@@ -227,6 +339,50 @@ class TSQuery(object):
         s = "sum({name}) OVER ({p} ORDER BY {date_col} ASC) AS {name}"
         return s.format(p=p, **self.add_kw(**metric))
 
+    def select_roll_avg(self, metric):
+        """
+        A select statement for a rolling average of a metric over
+        the last `roll_window` units.
+        """
+        s = """ROUND(avg({name}) OVER (
+                    {p} ORDER BY {date_col} ASC
+                    ROWS BETWEEN :roll_window PRECEDING AND CURRENT ROW
+                ), {sig_digits}) AS {name}"""
+        return s.format(p=self.window_partition, **self.add_kw(**metric))
+
+    def select_per_change(self, metric):
+        """
+        A select statement for the percent change of a metric
+        from the previous unit.
+        """
+        lag = "lag({name}) OVER ({p} ORDER BY {date_col} ASC)"\
+              .format(p=self.window_partition, **self.add_kw(**metric))
+        s = "ROUND(({name} - {lag}) / NULLIF({lag}, 0) * 100, {sig_digits}) AS {name}"
+        return s.format(lag=lag, **self.add_kw(**metric))
+
+    def select_median(self, metric):
+        """
+        A select statement for the median of a metric across ids.
+        """
+        s = "ROUND(percentile_cont(0.5) WITHIN GROUP (ORDER BY {name})::numeric, {sig_digits}) AS {name}"
+        return s.format(**self.add_kw(**metric))
+
+    def select_avg(self, metric):
+        """
+        A select statement for the average of a metric across ids.
+        """
+        s = "ROUND(avg({name}), {sig_digits}) AS {name}"
+        return s.format(**self.add_kw(**metric))
+
+    @property
+    def window_partition(self):
+        """
+        Partition window functions by id.
+        """
+        if not self.group_by_id:
+            return ""
+        return "PARTITION BY {}".format(self.id_col)
+
     @property
     def init_selects(self):
         """
@@ -234,7 +390,8 @@ class TSQuery(object):
         """
         ss = []
         for n, m in self.metrics.items():
-            if m['type'] == 'cumulative':
+            # rollups already hold counts.
+            if m['type'] == 'cumulative' and not self.rollup:
                 ss.append(self.select_cumulative_to_count(m))
             else:
                 ss.append(self.select_simple(m))
@@ -286,6 +443,17 @@ class TSQuery(object):
                 ss.append(n)
         return ",\n".join(ss)
 
+    @property
+    def transform_selects(self):
+        """
+        Generate select statements for the transform query.
+        """
+        fx = getattr(self, 'select_{}'.format(self.transform))
+        ss = []
+        for n, m in dict(self.metrics.items() + self.computed_metrics.items()).items():
+            ss.append(fx(m))
+        return ",\n".join(ss)
+
     @property
     def init_kw(self):
         """
@@ -295,9 +463,17 @@ class TSQuery(object):
         if not self.group_by_id:
             init_id_col = ""
 
+        table = self.table
+        rollup_filter = ""
+        if self.rollup:
+            table = self.rollup_table
+            rollup_filter = "AND unit = '{}'".format(self.unit)
+
         return self.add_kw(
             select=self.init_selects,
-            init_id_col=init_id_col
+            init_id_col=init_id_col,
+            table=table,
+            rollup_filter=rollup_filter
         )
 
     @property
@@ -312,6 +488,7 @@ class TSQuery(object):
                     {select}
                 FROM {table}
                     WHERE {id_col} IN (select unnest({ids_array}))
+                    {rollup_filter}
                     {date_filter}
             """.format(**self.init_kw)
 
@@ -356,9 +533,9 @@ class TSQuery(object):
         before = ""
         after = ""
         if self.before:
-            before = ", '{}'".format(self.before)
+            before = ', "before" := :before'
         if self.after:
-            after = ", '{}'".format(self.after)
+            after = ', "after" := :after'
         return self.add_kw(before=before, after=after)
 
     @property
@@ -374,7 +551,7 @@ class TSQuery(object):
         """
         kwargs for the non-sparse query.
         """
-        if self.unit == self.min_unit:
+        if self.unit == self.min_unit and not self.aggregate_ids:
             init_q = self.init_query
         else:
             init_q = self.agg_query
@@ -457,12 +634,17 @@ class TSQuery(object):
             """.format(**self.add_kw(**kw))
 
     @property
-    def cumulative_kw(self):
+    def transform_kw(self):
         """
-        kwargs for the cumulative query.
+        kwargs for the transform queries.
         """
-        # determine initial query
-        if self.sparse and self.unit == 'hour' and self.group_by_id:
+        # determine initial query. window + across id transforms
+        # need a value for every id at every date, so units
+        # without a row count as zeros.
+        if self.transform in self.calendar_transforms:
+            init_q = self.non_sparse_query
+
+        elif self.sparse and self.unit == 'hour' and self.group_by_id:
             init_q = self.init_query
 
         elif self.sparse:
@@ -478,10 +660,14 @@ class TSQuery(object):
         if self.compute:
             init_q = self.computed_query(init_q)
 
+        _order_by = ", {}".format(self.id_col)
+        if not self.group_by_id:
+            _order_by = ""
+
         return self.add_kw(
-            select=self.cumulative_selects,
             init_q=init_q,
-            _id_col=_id_col
+            _id_col=_id_col,
+            _order_by=_order_by
         )
 
     @property
@@ -497,7 +683,41 @@ class TSQuery(object):
                 FROM (
                     {init_q}
                 ) t2
-            """.format(**self.cumulative_kw)
+            """.format(select=self.cumulative_selects, **self.transform_kw)
+
+    @property
+    def window_query(self):
+        """
+        A rolling average / percent change over each id's
+        calendar-filled timeseries, whether or not sparse=True.
+        """
+        return \
+            """ SELECT
+                    {date_col},
+                    {_id_col}
+                    {select}
+                FROM (
+                    {init_q}
+                ) t2
+                ORDER BY {date_col} {_order_by} ASC
+            """.format(select=self.transform_selects, **self.transform_kw)
+
+    @property
+    def across_ids_query(self):
+        """
+        A median / average of each id's calendar-filled
+        timeseries, whether or not sparse=True.
+        """
+        return \
+            """ SELECT
+                    {date_col},
+                    {select}
+                FROM (
+                    {init_q}
+                ) t2
+                GROUP BY {date_col}
+                ORDER BY {date_col} ASC
+            """.format(select=self.transform_selects, **self.transform_kw)
 
     @property
     def query(self):
@@ -508,6 +728,7 @@ class TSQuery(object):
         # simple query.
         if self.sparse and \
            self.unit == self.min_unit and \
+           not self.aggregate_ids and \
            not self.transform:
 
             if not self.compute:
@@ -534,22 +755,85 @@ class TSQuery(object):
         elif self.transform == 'cumulative':
             return self.cumulative_query
 
-        # TODO: rolling average, per_change, median + average timeseries for
-        # multiple ids.
+        # rolling average, percent change
+        elif self.transform in ['roll_avg', 'per_change']:
+            return self.window_query
 
-        # return self.cumulative_query
+        # median + average timeseries for multiple ids.
+        elif self.transform in self.across_id_transforms:
+            return self.across_ids_query
 
-    def execute(self):
+    @property
+    def shape(self):
+        """
+        Everything that goes into the text of the query,
+        save for the org's metrics.
+        """
+        return (self.__class__.__name__, self.org.id, self.unit,
+                self.sparse, self.transform, self.group_by_id,
+                self.agg, self.aggregate_ids,
+                bool(self.before), bool(self.after), self.compute,
+                self.rollup)
+
+    @property
+    def params(self):
+        """
+        The bind parameters for the query.
+        """
+        params = {
+            'ids': [int(i) for i in self.ids],
+            'sig_digits': self.sig_digits
+        }
+        if self.before:
+            params['before'] = self.before
+        if self.after:
+            params['after'] = self.after
+        if self.transform == 'roll_avg':
+            params['roll_window'] = max(int(self.roll_window) - 1, 0)
+        for n, b in self.metric_binds.items():
+            params[b] = n
+        return params
+
+    @property
+    def statement(self):
+        """
+        The query as a compiled statement. These are cached
+        per shape until the org's metrics change. This only saves
+        building + compiling the query in python: psycopg2 binds
+        parameters client-side, so postgres still parses + plans
+        each statement.
+        """
+        version = get_schema_version(self.org.id)
+        cached = _templates.get(self.shape)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        query = self.query
+        binds = [bindparam('ids', type_=ARRAY(Integer))]
+        for i in ['sig_digits', 'roll_window']:
+            if ':{}'.format(i) in query:
+                binds.append(bindparam(i, type_=Integer))
+        for d in ['before', 'after']:
+            if getattr(self, d):
+                binds.append(bindparam(d, type_=DateTime(timezone=True)))
+        stmt = stream(text(query).bindparams(*binds))
+        _templates.set(self.shape, (version, stmt))
+        return stmt
+
+    def execute(self, **kw):
         """
         Execute the query stream the results.
         """
-        return ResultIter(db.session.execute(self.query))
+        return ResultIter(db.session.execute(self.statement, self.params), **kw)
 
 
 class QueryContentMetricTimeseries(TSQuery):
     table = "content_metric_timeseries"
     id_col = "content_item_id"
     cal_fx = "content_metric_calendar"
+    rollup_table = "content_metric_rollup"
+    rollup_model = ContentMetricRollup
+    rollup_units = settings.CONTENT_ROLLUP_UNITS
     metrics_attr = "content_timeseries_metrics"
     computed_metrics_attr = "computed_content_timeseries_metrics"
 
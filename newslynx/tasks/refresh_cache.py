@@ -0,0 +1,14 @@
+"""
+Background refreshes for caches which serve stale values
+while they're recomputed (see `Cache.soft_ttl`).
+"""
+from newslynx import models
+
+
+def refresh(cache_name, args, kw):
+    """
+    Recompute a cached value.
+    """
+    cache = getattr(models, cache_name)()
+    cr = cache.refresh(*args, **kw)
+    return cr.value is not None
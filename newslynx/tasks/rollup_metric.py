@@ -1,23 +1,61 @@
 from datetime import timedelta
 
+from sqlalchemy import text
+
 from newslynx.lib.serialize import obj_to_json
-from newslynx.core import db
+from newslynx.core import db, gen_session, queues
 from newslynx.lib import dates
 from newslynx.constants import IMPACT_TAG_CATEGORIES, IMPACT_TAG_LEVELS
 from newslynx.tasks.query_metric import QueryContentMetricTimeseries
-from newslynx.models import Org
+from newslynx.models import (
+    Org, ContentMetricRollup, ContentTimeseriesChangeLog, EventTagsChangeLog,
+    ContentSummaryChangeTimes)
+from newslynx.models.metric_schema import get_schema_version
+from newslynx import settings
+
+
+content_timeseries_changes = ContentTimeseriesChangeLog()
+event_tags_changes = EventTagsChangeLog()
+content_summary_changes = ContentSummaryChangeTimes()
+
+q = queues.get('rollup')
+
+
+def summaries_changed(org_id, content_item_ids=None):
+    """
+    Note that content summaries have changed so
+    comparisons which include them are recomputed.
+    """
+    if content_item_ids is None:
+        content_summary_changes.record_all(org_id)
+    else:
+        content_summary_changes.record(org_id, content_item_ids)
 
 
-def content_timeseries_to_summary(org, num_hours=24):
+def content_timeseries_to_summary(org, num_hours=24, content_item_ids=None, session=None):
     """
     Rollup content-timseries metrics into summaries.
     Optimize this query by only updating content items whose
-    timeseries have been updated in last X hours.
+    timeseries have been updated in last X hours, or only
+    the content items in `content_item_ids`.
     """
+    if session is None:
+        session = db.session
 
     # just use this to generate a giant timeseries select with computed
     # metrics.
-    ts = QueryContentMetricTimeseries(org, org.content_item_ids)
+    if content_item_ids is None:
+        ts = QueryContentMetricTimeseries(org, org.content_item_ids)
+        updated_filter = """WHERE content_item_id in (
+                    SELECT
+                        distinct(content_item_id)
+                    FROM content_metric_timeseries
+                    WHERE updated > '{}'
+                    )""".format(
+            (dates.now() - timedelta(hours=num_hours)).isoformat())
+    else:
+        ts = QueryContentMetricTimeseries(org, content_item_ids)
+        updated_filter = ""
 
     # generate aggregation statments + list of metric names.
     summary_pattern = "{agg}({name}) AS {name}"
@@ -32,7 +70,7 @@ def content_timeseries_to_summary(org, num_hours=24):
         'select_statements': ",\n".join(select_statements),
         'metrics': ", ".join(metrics),
         'org_id': org.id,
-        'last_updated': (dates.now() - timedelta(hours=num_hours)).isoformat(),
+        'updated_filter': updated_filter,
         'ts_query': ts.query
     }
 
@@ -46,26 +84,175 @@ def content_timeseries_to_summary(org, num_hours=24):
                     content_item_id,
                     {select_statements}
                 FROM ({ts_query}) zzzz
-                WHERE content_item_id in (
-                    SELECT
-                        distinct(content_item_id)
-                    FROM content_metric_timeseries
-                    WHERE updated > '{last_updated}'
-                    )
+                {updated_filter}
                 GROUP BY content_item_id
                 ) t1
             ) t2
         """.format(**qkw)
-    db.session.execute(q)
-    db.session.commit()
+    session.execute(q, ts.params)
+    session.commit()
+    summaries_changed(org.id, content_item_ids)
     return True
 
 
-def event_tags_to_summary(org):
+def incremental_content_timeseries_to_summary(org, session=None):
+    """
+    Rollup summaries for only the content items whose timeseries have
+    changed since the last run, in batches. Returns the number of
+    content items processed or None if a run is already in progress.
+    """
+    def _summarize(ids):
+        content_timeseries_to_summary(
+            org, content_item_ids=ids, session=session)
+
+    return content_timeseries_changes.process(
+        org.id, _summarize, batch_size=settings.SUMMARY_BATCH_SIZE)
+
+
+def content_timeseries_to_rollups(org, changed=None, since=None, session=None):
+    """
+    Pre-aggregate content-timeseries metrics into day + month rollups.
+    Only buckets at or after the earliest changed row of a content
+    item are rebuilt:
+        - `changed` is a dict of content_item_id => earliest datetime
+          changed (or None to rebuild the whole item).
+        - `since` rebuilds items with rows updated after a timestamp.
+        - with neither, everything is rebuilt.
+    """
+    if session is None:
+        session = db.session
+
+    # use this to generate the selects for each raw row.
+    ts = QueryContentMetricTimeseries(org, [])
+    if not len(ts.metrics.keys()):
+        return True
+    version = get_schema_version(org.id)
+
+    # stage the content items + buckets we're rebuilding.
+    session.execute("DROP TABLE IF EXISTS rollup_changed")
+    session.execute(
+        """CREATE TEMP TABLE rollup_changed (
+              content_item_id int PRIMARY KEY,
+              start timestamp with time zone
+           ) ON COMMIT DROP""")
+
+    if changed is not None:
+        if not len(changed):
+            return True
+        session.execute(
+            text("INSERT INTO rollup_changed VALUES (:id, :start)"),
+            [{'id': int(k), 'start': v or '-infinity'}
+             for k, v in changed.items()])
+    else:
+        updated_filter = ""
+        if since:
+            updated_filter = "AND updated > :since"
+        session.execute(
+            """INSERT INTO rollup_changed
+               SELECT content_item_id, MIN(datetime)
+               FROM content_metric_timeseries
+               WHERE org_id = :org_id {}
+               GROUP BY content_item_id
+            """.format(updated_filter),
+            {'org_id': org.id, 'since': since})
+
+    agg_pattern = "{agg}({name}) AS {name}"
+    qkw = {
+        'select_statements': ts.init_selects,
+        'agg_statements': ",\n".join(
+            [agg_pattern.format(**m) for m in ts.metrics.values()]),
+        'metrics': ", ".join(ts.metrics.keys())
+    }
+    params = ts.params
+    params['org_id'] = org.id
+
+    for unit in settings.CONTENT_ROLLUP_UNITS:
+        qkw['unit'] = unit
+        session.execute(
+            """DELETE FROM content_metric_rollup r
+               USING rollup_changed c
+               WHERE r.content_item_id = c.content_item_id AND
+                     r.unit = '{unit}' AND
+                     r.datetime >= date_trunc('{unit}', c.start)
+            """.format(**qkw))
+
+        # lag()s for cumulative metrics need each item's whole
+        # history so we filter buckets after selecting.
+        session.execute(
+            """INSERT INTO content_metric_rollup
+                  (org_id, content_item_id, unit, datetime, metrics, updated)
+               SELECT
+                  :org_id,
+                  content_item_id,
+                  '{unit}',
+                  datetime,
+                  (SELECT row_to_json(_) from (SELECT {metrics}) as _)::jsonb,
+                  current_timestamp
+               FROM (
+                  SELECT
+                      t.content_item_id,
+                      date_trunc('{unit}', t.datetime) AS datetime,
+                      {agg_statements}
+                  FROM (
+                      SELECT
+                          content_item_id,
+                          datetime,
+                          {select_statements}
+                      FROM content_metric_timeseries
+                      WHERE content_item_id IN (
+                          SELECT content_item_id FROM rollup_changed)
+                  ) t
+                  JOIN rollup_changed c ON
+                      c.content_item_id = t.content_item_id
+                  WHERE t.datetime >= date_trunc('{unit}', c.start)
+                  GROUP BY t.content_item_id, date_trunc('{unit}', t.datetime)
+               ) b
+            """.format(**qkw), params)
+
+    session.commit()
+
+    # full rebuilds bring the rollups in line with the org's metrics.
+    if changed is None and since is None:
+        ContentMetricRollup.set_version(org.id, version)
+    return True
+
+
+def refresh_content_rollups(org, session=None):
+    """
+    Bring an org's content rollups up to date. If the org's metrics
+    have changed since they were built (or they never have been),
+    rebuild everything. Otherwise, only rebuild buckets with rows
+    updated since the last refresh.
+    """
+    if session is None:
+        session = db.session
+
+    now = session.execute("SELECT now()").scalar()
+    watermark = ContentMetricRollup.get_watermark(org.id)
+    version = get_schema_version(org.id)
+
+    if not watermark or not ContentMetricRollup.is_current(org.id, version):
+        content_timeseries_to_rollups(org, session=session)
+
+    else:
+        # rows committed by transactions which started before the last
+        # refresh carry an older `updated`, so look back a bit further.
+        since = dates.parse_iso(watermark) - \
+            timedelta(seconds=settings.CONTENT_ROLLUP_OVERLAP)
+        content_timeseries_to_rollups(org, since=since, session=session)
+
+    ContentMetricRollup.set_watermark(org.id, now)
+    return True
+
+
+def event_tags_to_summary(org, content_item_ids=None, session=None):
     """
     Count up impact tag categories + levels assigned to events
-    by the content_items they're associated with.
+    by the content_items they're associated with. Optionally
+    only for the content items in `content_item_ids`.
     """
+    if session is None:
+        session = db.session
 
     # build up list of metrics to compute
     event_tag_metrics = ['total_events', 'total_event_tags']
@@ -100,8 +287,16 @@ def event_tags_to_summary(org):
         "metrics": ", ".join(event_tag_metrics),
         "case_statements": ",\n".join(case_statements),
         "org_id": org.id,
-        "null_metrics": obj_to_json({k: 0 for k in event_tag_metrics})
+        "null_metrics": obj_to_json({k: 0 for k in event_tag_metrics}),
+        "events_filter": "",
+        "content_filter": ""
     }
+    params = {}
+    if content_item_ids is not None:
+        qkw['events_filter'] = \
+            "AND content_items_events.content_item_id = ANY(CAST(:ids AS int[]))"
+        qkw['content_filter'] = "AND id = ANY(CAST(:ids AS int[]))"
+        params['ids'] = [int(i) for i in content_item_ids]
 
     q = """
         WITH content_event_tags AS (
@@ -118,6 +313,7 @@ def event_tags_to_summary(org):
                   FULL OUTER JOIN tags on events_tags.tag_id = tags.id
                   WHERE events.org_id = {org_id} AND
                         events.status = 'approved'
+                        {events_filter}
                 ) t
                 WHERE content_item_id IS NOT NULL
         ),
@@ -152,15 +348,69 @@ def event_tags_to_summary(org):
             FROM (
                 SELECT org_id, id as content_item_id
                 FROM content
-                WHERE org_id = {org_id} AND
+                WHERE org_id = {org_id}
+                {content_filter} AND
                 id NOT IN (
                     SELECT distinct(content_item_id)
                     FROM content_event_metrics
                     )
             ) t
         )
-        SELECT * from positive_metrics, null_metrics
+        -- UNION ALL so both upserts run even when one side is empty.
+        SELECT * FROM positive_metrics
+        UNION ALL
+        SELECT * FROM null_metrics
         """.format(**qkw)
-    db.session.execute(q)
-    db.session.commit()
+    session.execute(q, params)
+    session.commit()
+    summaries_changed(org.id, content_item_ids)
     return True
+
+
+def incremental_event_tags_to_summary(org, session=None):
+    """
+    Recount event tags for only the content items whose events
+    have changed since the last run, in batches. Returns the number of
+    content items processed or None if a run is already in progress.
+    """
+    def _summarize(ids):
+        event_tags_to_summary(org, content_item_ids=ids, session=session)
+
+    return event_tags_changes.process(
+        org.id, _summarize, batch_size=settings.SUMMARY_BATCH_SIZE)
+
+
+def event_tags_summary_job(org_id):
+    """
+    Recount event tags for an org's changed content items.
+    """
+    session = gen_session()
+    try:
+        org = session.query(Org).get(org_id)
+        n = incremental_event_tags_to_summary(org, session=session)
+    finally:
+        session.close()
+
+    # pick up anything which changed while we were running.
+    if n is not None and event_tags_changes.count(org_id):
+        enqueue_event_tags_summary(org_id)
+    return n
+
+
+def enqueue_event_tags_summary(org_id):
+    return q.enqueue(
+        event_tags_summary_job, org_id,
+        timeout=settings.SUMMARY_JOB_TIMEOUT,
+        result_ttl=0)
+
+
+def event_tags_changed(org_id, content_item_ids):
+    """
+    Queue up event tag summaries for content items
+    whose events have changed.
+    """
+    ids = [i for i in content_item_ids if i]
+    if not len(ids):
+        return
+    event_tags_changes.record(org_id, ids)
+    enqueue_event_tags_summary(org_id)
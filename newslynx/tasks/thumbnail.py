@@ -0,0 +1,99 @@
+"""
+Asynchronous thumbnail generation for events and content items.
+Items are committed with a NULL thumbnail and these jobs fill
+them in on the `thumbnail` queue. Rows which still carry a legacy
+b64 data-uri are moved to the thumbnail store as well.
+"""
+import logging
+
+from sqlalchemy import text
+
+from newslynx.core import queues, gen_session
+from newslynx import settings
+from newslynx.exc import RequestError
+from newslynx.models import ThumbnailCache
+from newslynx.tasks import ingest_util
+from newslynx.util import chunk_list
+
+
+log = logging.getLogger(__name__)
+
+thumbnail_cache = ThumbnailCache()
+
+# the tables with img_url / thumbnail columns.
+THUMBNAIL_TABLES = ['events', 'content']
+
+q = queues.get('thumbnail')
+
+# rows which need a thumbnail.
+MISSING = "(thumbnail IS NULL OR left(thumbnail, 5) = 'data:')"
+
+
+def _check_table(table):
+    if table not in THUMBNAIL_TABLES:
+        raise RequestError(
+            '"{}" does not have thumbnails.'.format(table))
+
+
+def fill(table, ids):
+    """
+    Generate thumbnails for rows which are still missing them.
+    """
+    _check_table(table)
+    if not len(ids):
+        return True
+
+    session = gen_session()
+    rows = session.execute(
+        """SELECT id, img_url FROM {}
+           WHERE id IN ({}) AND {} AND img_url IS NOT NULL
+        """.format(table, ",".join([str(int(i)) for i in ids]), MISSING)).fetchall()
+
+    # fetch each distinct image once.
+    thumbnails = ingest_util.resolve_many(
+        thumbnail_cache, [r.img_url for r in rows],
+        settings.RESOLVE_POOL_SIZE, settings.RESOLVE_PER_HOST)
+
+    cmd = text("""UPDATE {} SET thumbnail = :thumbnail
+                  WHERE id = :id AND {}
+               """.format(table, MISSING))
+    params = [{'id': r.id, 'thumbnail': thumbnails.get(r.img_url)}
+              for r in rows if thumbnails.get(r.img_url)]
+    if len(params):
+        session.execute(cmd, params)
+    session.commit()
+    session.close()
+    return True
+
+
+def enqueue(table, ids):
+    """
+    Queue up thumbnail generation for rows.
+    """
+    _check_table(table)
+    return q.enqueue(
+        fill, table, list(ids),
+        timeout=settings.THUMBNAIL_JOB_TIMEOUT,
+        result_ttl=0)
+
+
+def backfill(table, batch_size=100):
+    """
+    Queue up thumbnail generation for all rows which are missing
+    them in batches, so they can be processed in parallel by
+    many workers. Returns the number of jobs queued.
+    """
+    _check_table(table)
+    session = gen_session()
+    rows = session.execute(
+        """SELECT id FROM {}
+           WHERE {} AND img_url IS NOT NULL
+           ORDER BY id
+        """.format(table, MISSING))
+    njobs = 0
+    for batch in chunk_list((r.id for r in rows), batch_size):
+        enqueue(table, batch)
+        njobs += 1
+    session.close()
+    log.info('Queued {} thumbnail jobs for {}'.format(njobs, table))
+    return njobs
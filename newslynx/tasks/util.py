@@ -1,4 +1,12 @@
+import re
 from inspect import isgenerator
+from collections import OrderedDict
+from datetime import datetime, date
+from decimal import Decimal
+
+from sqlalchemy import text
+
+from newslynx import settings
 
 
 def convert_row(row):
@@ -7,34 +15,150 @@ def convert_row(row):
     return dict(row.items())
 
 
+def _column_converter(values):
+    """
+    Pick one converter for a column from it's first non-null value.
+    """
+    for v in values:
+        if v is None:
+            continue
+        if isinstance(v, (datetime, date)):
+            return lambda v: v.isoformat() if v is not None else None
+        if isinstance(v, Decimal):
+            return lambda v: float(v) if v is not None else None
+        return None
+    return None
+
+
+def to_columns(rows):
+    """
+    Turn a ResultIter into an OrderedDict of column => list of
+    values, coercing dates + decimals once per column rather
+    than once per value.
+    """
+    if isinstance(rows, ResultIter):
+        rows.tuples = True
+    values = list(rows)
+    keys = getattr(rows, 'keys', [])
+    columns = OrderedDict()
+    for k, col in zip(keys, zip(*values) or [[]] * len(keys)):
+        col = list(col)
+        fx = _column_converter(col)
+        if fx:
+            col = [fx(v) for v in col]
+        columns[k] = col
+    return columns
+
+
+# statements which can be run in a server-side cursor.
+re_streamable = re.compile(
+    r'\s*(SELECT|VALUES|TABLE|WITH)\b', re.I | re.UNICODE)
+
+# the tokens we need to find a statement's final keyword (the
+# first outside of it's subqueries) and anything that can't go
+# in a cursor: quoted strings + comments (skipped), parens,
+# semicolons, statement keywords, INTO and locking clauses.
+re_tokens = re.compile(
+    r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*|/\*.*?\*/|(\()|(\))|(;)|"""
+    r"""\b(FOR\s+(?:NO\s+KEY\s+)?UPDATE|FOR\s+(?:KEY\s+)?SHARE|"""
+    r"""SELECT|INSERT|UPDATE|DELETE|VALUES|TABLE|INTO)\b""",
+    re.I | re.UNICODE | re.S)
+
+
+def is_streamable(sql):
+    """
+    Can a statement be run in a server-side cursor? Only a
+    single query can, including a WITH whose final statement
+    is one, so long as nothing in it modifies data, creates
+    a table (SELECT INTO) or locks rows (FOR UPDATE / SHARE).
+    """
+    if not re_streamable.match(sql):
+        return False
+    depth = 0
+    final = None
+    for m in re_tokens.finditer(sql):
+        open_paren, close_paren, semicolon, keyword = m.groups()
+        if open_paren:
+            depth += 1
+        elif close_paren:
+            depth -= 1
+        elif semicolon:
+            # a trailing semicolon is fine, another statement isn't.
+            if sql[m.end():].strip():
+                return False
+        elif keyword:
+            keyword = keyword.upper()
+            if keyword.startswith('FOR') or \
+               keyword in ('INSERT', 'UPDATE', 'DELETE', 'INTO'):
+                return False
+            if depth == 0 and final is None:
+                final = keyword
+    return final in ('SELECT', 'VALUES', 'TABLE')
+
+
+def stream(query):
+    """
+    Mark a query to be run with a server-side cursor
+    so it's results can be streamed with ResultIter.
+    psycopg2 runs every `stream_results` statement as a
+    named cursor, so anything other than a query is
+    left as is.
+    """
+    if isinstance(query, basestring):
+        query = text(query)
+    if not is_streamable(query.text):
+        return query
+    return query.execution_options(stream_results=True)
+
+
 class ResultIter(object):
     """ SQLAlchemy ResultProxies are not iterable to get a
-    list of dictionaries. This is to wrap them. """
+    list of dictionaries. This is to wrap them. Rows are
+    fetched `fetch_size` at a time, so when the query was run
+    with a server-side cursor (see `stream`) results are never
+    held in memory all at once. With tuples=True, rows are
+    yielded as tuples which share the key list `keys`. """
 
-    def __init__(self, result_proxies):
+    def __init__(self, result_proxies, fetch_size=None, tuples=False):
         if not isgenerator(result_proxies):
             result_proxies = iter((result_proxies, ))
         self.result_proxies = result_proxies
-        self._iter = None
+        self.fetch_size = fetch_size or settings.SQL_FETCH_SIZE
+        self.tuples = tuples
+        self.keys = []
+        self._rp = None
+        self._iter = iter([])
 
     def _next_rp(self):
         try:
             rp = next(self.result_proxies)
             self.keys = list(rp.keys())
-            self._iter = iter(rp.fetchall())
+            self._rp = rp
             return True
         except StopIteration:
             return False
 
+    def _next_batch(self):
+        rows = self._rp.fetchmany(self.fetch_size)
+        if not len(rows):
+            self._rp.close()
+            self._rp = None
+            return False
+        self._iter = iter(rows)
+        return True
+
     def __next__(self):
-        if self._iter is None:
-            if not self._next_rp():
-                raise StopIteration
-        try:
-            return convert_row(next(self._iter))
-        except StopIteration:
-            self._iter = None
-            return self.__next__()
+        while True:
+            try:
+                row = next(self._iter)
+                break
+            except StopIteration:
+                if self._rp is None and not self._next_rp():
+                    raise StopIteration
+                self._next_batch()
+        if self.tuples:
+            return tuple(row)
+        return dict(zip(self.keys, row))
 
     next = __next__
 
@@ -74,3 +74,18 @@ def gen_short_uuid(n=6):
     start = random.choice(range(1, (len(uuid) - n)+1))
     end = start + n
     return uuid[start:end]
+
+
+def chunk_list(seq, size=1000):
+    """
+    Split any iterable into lists of length `size`,
+    without loading the whole thing into memory.
+    """
+    chunk = []
+    for item in seq:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if len(chunk):
+        yield chunk
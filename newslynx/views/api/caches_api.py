@@ -0,0 +1,21 @@
+from flask import Blueprint
+
+from newslynx.exc import ForbiddenError
+from newslynx.views.decorators import load_user
+from newslynx.lib.serialize import jsonify
+from newslynx.models.cache import cache_stats
+
+# bp
+bp = Blueprint('caches', __name__)
+
+
+@bp.route('/api/v1/caches', methods=['GET'])
+@load_user
+def get_cache_stats(user):
+    """
+    Hit / miss counters for each cache in this API process.
+    """
+    if not user.super_user:
+        raise ForbiddenError(
+            "Only the super user can access cache stats.")
+    return jsonify(cache_stats())
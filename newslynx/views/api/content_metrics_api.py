@@ -2,24 +2,32 @@ import logging
 
 from flask import Blueprint
 
+from newslynx import settings
 from newslynx.views.decorators import load_user, load_org
 from newslynx.exc import NotFoundError, RequestError, InternalServerError
-from newslynx.models import ContentItem
+from newslynx.models import ContentItem, get_metric_schema
 from newslynx.lib.serialize import jsonify
-from newslynx.views.util import request_data, url_for_job_status
+from newslynx.lib import dates
+from newslynx.views.util import (
+    request_data, request_bulk_data, url_for_job_status)
 from newslynx.tasks import ingest_bulk
 from newslynx.tasks import ingest_metric
 from newslynx.tasks import rollup_metric
-from newslynx.constants import CONTENT_METRIC_COMPARISONS
+from newslynx.constants import (
+    CONTENT_METRIC_COMPARISONS, TIMESERIES_ID_AGGREGATIONS)
 from newslynx.tasks.query_metric import QueryContentMetricTimeseries
+from newslynx.tasks.util import to_columns
+from newslynx.views.api.content_api import (
+    arg_content_item_filters, apply_content_item_filters)
 from newslynx.models import (
     ComparisonsCache, AllContentComparisonCache,
     SubjectTagsComparisonCache,
     ContentTypeComparisonCache,
     ImpactTagsComparisonCache)
 from newslynx.views.util import (
-    arg_bool, arg_str, validate_ts_unit, arg_list,
-    arg_date, arg_int, delete_response
+    arg_bool, arg_str, validate_ts_unit, validate_ts_transform, arg_list,
+    arg_date, arg_int, delete_response, columnar_response,
+    ndjson_response
 )
 
 # blueprint
@@ -68,14 +76,84 @@ def get_content_timeseries(user, org, content_item_id):
         rm_nulls=arg_bool('rm_nulls', default=False),
         time_since_start=arg_bool('time_since_start', default=False),
         transform=arg_str('transform', default=None),
+        roll_window=arg_int('roll_window', default=settings.TIMESERIES_ROLL_WINDOW),
         before=arg_date('before', default=None),
         after=arg_date('after', default=None)
     )
 
+    validate_ts_unit(kw['unit'])
+    validate_ts_transform(kw['transform'])
     q = QueryContentMetricTimeseries(org, [content_item_id], **kw)
+    if arg_str('format', default='rows') == 'columns':
+        return columnar_response(to_columns(q.execute(tuples=True)))
     return jsonify(list(q.execute()))
 
 
+@bp.route('/api/v1/content/timeseries', methods=['GET'])
+@load_user
+@load_org
+def get_content_timeseries_bulk(user, org):
+    """
+    Query the timeseries of many content items in one query,
+    selected by `ids` or by the same filters as `GET /content`.
+    With `group_by_id=false` the timeseries are aggregated across
+    items, by each metric's aggregation or by `agg`. Rows are
+    streamed as newline-delimited json.
+    """
+    ids = arg_list('ids', default=[], typ=int)
+
+    content_query = ContentItem.query
+    if len(ids):
+        content_query = content_query\
+            .filter_by(org_id=org.id)\
+            .filter(ContentItem.id.in_(ids))
+    else:
+        content_query, _ = apply_content_item_filters(
+            content_query, **arg_content_item_filters(org))
+    ids = [r[0] for r in content_query.with_entities(ContentItem.id).all()]
+
+    # select / exclude
+    select, exclude = arg_list('select', typ=str, exclusions=True, default=['*'])
+    if '*' in select:
+        exclude = []
+        select = "*"
+
+    agg = arg_str('agg', default=None)
+    if agg and agg not in TIMESERIES_ID_AGGREGATIONS:
+        raise RequestError(
+            "'{}' is not a valid aggregation. Choose from: {}."
+            .format(agg, ", ".join(TIMESERIES_ID_AGGREGATIONS)))
+
+    kw = dict(
+        unit=arg_str('unit', default='hour'),
+        sparse=arg_bool('sparse', default=True),
+        sig_digits=arg_int('sig_digits', default=2),
+        select=select,
+        exclude=exclude,
+        group_by_id=arg_bool('group_by_id', default=True),
+        agg=agg,
+        rm_nulls=arg_bool('rm_nulls', default=False),
+        time_since_start=arg_bool('time_since_start', default=False),
+        transform=arg_str('transform', default=None),
+        roll_window=arg_int('roll_window', default=settings.TIMESERIES_ROLL_WINDOW),
+        before=arg_date('before', default=None),
+        after=arg_date('after', default=None)
+    )
+
+    validate_ts_unit(kw['unit'])
+    validate_ts_transform(kw['transform'])
+    columns = arg_str('format', default='rows') == 'columns'
+    if not len(ids):
+        rows = []
+    else:
+        q = QueryContentMetricTimeseries(org, ids, **kw)
+        rows = q.execute(tuples=columns)
+
+    if columns:
+        return columnar_response(to_columns(rows))
+    return ndjson_response(rows)
+
+
 @bp.route('/api/v1/content/<content_item_id>/timeseries', methods=['POST'])
 @load_user
 @load_org
@@ -104,11 +182,20 @@ def create_content_item_timeseries(user, org, content_item_id):
     # insert content item id
     req_data['content_item_id'] = content_item_id
 
+    # only rebuild the rollup buckets from the posted datetime on.
+    if 'datetime' in req_data:
+        start = dates.parse_iso(req_data['datetime'])
+    else:
+        start = dates.floor_now(unit='hour', value=1)
+
     ret = ingest_metric.content_timeseries(
         req_data,
         org_id=org.id,
-        metrics_lookup=org.content_timeseries_metrics,
+        metrics_lookup=get_metric_schema(org, 'content_timeseries_metrics'),
         commit=True)
+    rollup_metric.content_timeseries_changes.record(org.id, [c.id])
+    rollup_metric.content_timeseries_to_rollups(
+        org, changed={c.id: start})
     return jsonify(ret)
 
 
@@ -119,26 +206,13 @@ def bulk_create_content_timeseries(user, org):
     """
     bulk upsert timseries metrics for an organization's content items.
     """
-    req_data = request_data()
-
-    # check for valid format.
-    if not isinstance(req_data, list):
-        raise RequestError(
-            "Bulk endpoints require a list of json objects."
-        )
-
-    # check for content_item_id.
-    if not 'content_item_id' in req_data[0].keys():
-        raise RequestError(
-            'You must pass in a content_item_id with each record.'
-        )
+    req_data = request_bulk_data()
 
     job_id = ingest_bulk.content_timeseries(
         req_data,
         org_id=org.id,
-        metrics_lookup=org.content_timeseries_metrics,
-        content_item_ids=org.content_item_ids,
-        commit=False)
+        metrics_lookup=get_metric_schema(org, 'content_timeseries_metrics'),
+        content_item_ids=org.content_item_ids)
     ret = url_for_job_status(apikey=user.apikey, job_id=job_id, queue='bulk')
     return jsonify(ret, status=202)
 
@@ -174,10 +248,11 @@ def content_metrics_summary(user, org, content_item_id):
     ret = ingest_metric.content_summary(
         req_data,
         org_id=org.id,
-        metrics_lookup=org.content_summary_metrics,
+        metrics_lookup=get_metric_schema(org, 'content_summary_metrics'),
         content_item_ids=org.content_item_ids,
         commit=True
     )
+    rollup_metric.summaries_changed(org.id, [c.id])
     return jsonify(ret)
 
 
@@ -188,23 +263,12 @@ def bulk_create_content_summary(user, org):
     """
     bulk upsert summary metrics for an organization's content items.
     """
-    req_data = request_data()
-
-    # check for valid format.
-    if not isinstance(req_data, list):
-        raise RequestError(
-            "Bulk endpoints require a list of json objects."
-        )
-
-    # check for content_item_id.
-    if not 'content_item_id' in req_data[0].keys():
-        raise RequestError(
-            'You must pass in a content_item_id with each record.')
+    req_data = request_bulk_data()
 
     job_id = ingest_bulk.content_summary(
         req_data,
         org_id=org.id,
-        metrics_lookup=org.content_summary_metrics,
+        metrics_lookup=get_metric_schema(org, 'content_summary_metrics'),
         content_item_ids=org.content_item_ids,
         commit=False)
 
@@ -217,11 +281,20 @@ def bulk_create_content_summary(user, org):
 @load_org
 def refresh_content_summary(user, org):
     """
-    Refresh content summary metrics
+    Refresh content summary metrics. Event tag counts are only
+    recomputed for content items whose events have changed
+    unless `recount` is set.
     """
-    since = arg_int('since', 24)
-    rollup_metric.content_timeseries_to_summary(org, since)
-    rollup_metric.event_tags_to_summary(org)
+    since = arg_int('since', None)
+    if since:
+        rollup_metric.content_timeseries_to_summary(org, since)
+    else:
+        rollup_metric.incremental_content_timeseries_to_summary(org)
+    if arg_bool('recount', default=False):
+        rollup_metric.event_tags_to_summary(org)
+    else:
+        rollup_metric.incremental_event_tags_to_summary(org)
+    rollup_metric.refresh_content_rollups(org)
     return jsonify({'success': True})
 
 
@@ -277,7 +350,8 @@ def get_one_content_comparisons(user, org, type):
     cache_details = arg_bool('cache_details', default=False)
     if refresh:
         comparison_types[type].invalidate(org.id)
-    cr = comparison_types[type].get(org.id)
+        comparisons_cache.invalidate(org.id)
+    cr = comparisons_cache.get(org.id)
     if refresh and cr.is_cached:
         raise InternalServerError(
             'Something went wrong with the comparison cache invalidation process.')
@@ -298,7 +372,8 @@ def refresh_one_content_comparisons(user, org, type):
             "'{}' is an invalid content metric comparison. Choose from {}"
             .format(type, ", ".join(CONTENT_METRIC_COMPARISONS)))
     comparison_types[type].invalidate(org.id)
-    cr = comparison_types[type].get(org.id)
+    comparisons_cache.invalidate(org.id)
+    cr = comparisons_cache.get(org.id)
     if not cr.is_cached:
         return jsonify({'success': True})
     raise InternalServerError(
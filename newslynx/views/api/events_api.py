@@ -7,7 +7,8 @@ from flask import Blueprint, request
 
 from newslynx.core import db
 from newslynx.exc import RequestError, NotFoundError
-from newslynx.models import Event, Tag, SousChef, Recipe, ContentItem
+from newslynx.models import (
+    Event, Tag, SousChef, Recipe, ContentItem, EventIngestIndex)
 from newslynx.models.relations import events_tags, content_items_events
 from newslynx.models.util import get_table_columns
 from newslynx.lib.serialize import jsonify
@@ -16,6 +17,7 @@ from newslynx.views.util import *
 from newslynx.tasks import facet
 from newslynx.tasks import ingest_event
 from newslynx.tasks import ingest_bulk
+from newslynx.tasks import rollup_metric
 from newslynx.constants import EVENT_FACETS
 
 # blueprint
@@ -346,6 +348,8 @@ def create_event(user, org):
         kill_session=False)
     if not e:
         return jsonify(None)
+    if e.status == 'approved':
+        rollup_metric.event_tags_changed(org.id, e.content_item_ids)
     return jsonify(e.to_dict(incl_body=True, incl_img=True))
 
 
@@ -356,12 +360,7 @@ def bulk_create_event(user, org):
     """
     Create an event.
     """
-    req_data = request_data()
-    print "REQ DATA", req_data
-    # check for valid format.
-    if not isinstance(req_data, list):
-        raise RequestError(
-            "Non-bulk endpoints require a list of json objects.")
+    req_data = request_bulk_data()
 
     job_id = ingest_bulk.events(
         req_data,
@@ -408,6 +407,9 @@ def event_update(user, org, event_id):
     # get request data
     req_data = request_data()
 
+    # content items whose event tag counts might change.
+    affected = set(e.content_item_ids)
+
     # fetch tag and thing
     tag_ids = listify_data_arg('tag_ids')
     content_item_ids = listify_data_arg('content_item_ids')
@@ -466,6 +468,8 @@ def event_update(user, org, event_id):
     # commit changes
     db.session.add(e)
     db.session.commit()
+    affected.update(e.content_item_ids)
+    rollup_metric.event_tags_changed(org.id, affected)
 
     # return modified event
     return jsonify(e)
@@ -489,9 +493,14 @@ def event_delete(user, org, event_id):
             'An Event with ID {} does not exist.'
             .format(event_id))
 
+    # bulk loads shouldn't skip this event anymore.
+    EventIngestIndex().remove(org.id, [event_id])
+    affected = e.content_item_ids
+
     if arg_bool('force', False):
         db.session.delete(e)
         db.session.commit()
+        rollup_metric.event_tags_changed(org.id, affected)
         return delete_response()
 
     # remove associations
@@ -509,6 +518,7 @@ def event_delete(user, org, event_id):
     e.status = 'deleted'
     db.session.add(e)
     db.session.commit()
+    rollup_metric.event_tags_changed(org.id, affected)
 
     # return modified event
     return delete_response()
@@ -548,9 +558,10 @@ def event_add_tag(user, org, event_id, tag_id):
     if tag.id not in e.tag_ids:
         e.tags.append(tag)
 
-
     db.session.add(e)
     db.session.commit()
+    if e.status == 'approved':
+        rollup_metric.event_tags_changed(org.id, e.content_item_ids)
 
     # return modified event
     return jsonify(e)
@@ -585,6 +596,8 @@ def event_delete_tag(user, org, event_id, tag_id):
 
     db.session.add(e)
     db.session.commit()
+    if e.status == 'approved':
+        rollup_metric.event_tags_changed(org.id, e.content_item_ids)
 
     # return modified event
     return jsonify(e)
@@ -622,6 +635,8 @@ def event_add_thing(user, org, event_id, content_item_id):
 
     db.session.add(e)
     db.session.commit()
+    if e.status == 'approved':
+        rollup_metric.event_tags_changed(org.id, [c.id])
 
     # return modified event
     return jsonify(e)
@@ -661,6 +676,8 @@ def event_delete_content_item(user, org, event_id, content_item_id):
 
     db.session.add(e)
     db.session.commit()
+    if e.status == 'approved':
+        rollup_metric.event_tags_changed(org.id, [c.id])
 
     # return modified event
     return jsonify(e)
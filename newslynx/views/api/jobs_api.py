@@ -72,6 +72,10 @@ def get_status(user, job_id):
         ret['status'] = 'error'
         ret['message'] = "An unknown error occurred."
 
+    # include any progress the job has reported
+    if job.meta:
+        ret['meta'] = job.meta
+
     if job.is_finished:
         rv = job.return_value
 
@@ -84,4 +88,8 @@ def get_status(user, job_id):
             ret['status'] = 'error'
             ret['message'] = rv.message
 
+            # bulk loaders report per-item errors
+            if getattr(rv, 'errors', None):
+                ret['errors'] = rv.errors
+
     return jsonify(ret)
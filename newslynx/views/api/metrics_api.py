@@ -1,7 +1,7 @@
 from collections import defaultdict, Counter
 
 from flask import Blueprint
-from sqlalchemy import or_
+from sqlalchemy import or_, text
 
 from newslynx.core import db
 from newslynx.models import Metric, Recipe, SousChef
@@ -283,22 +283,25 @@ def delete_metric(user, org, name_id):
             .format(name_id))
 
     # format for deleting metrics from metric store.
-    cmd_fmt = "UPDATE {table} " + \
-              "SET metrics=json_del_keys(metrics, '{name}'::text);"\
-              .format(name=m.name)
+    cmd_fmt = "UPDATE {table} SET metrics = metrics - CAST(:name AS text) " + \
+              "WHERE metrics ? CAST(:name AS text)"
 
     # delete metric from metric stores.
+    tables = []
     if 'timeseries' in m.content_levels:
-        db.session.execute(cmd_fmt.format(table="content_metric_timeseries"))
+        tables.extend(["content_metric_timeseries", "content_metric_rollup"])
 
     if 'summary' in m.content_levels:
-        db.session.execute(cmd_fmt.format(table="content_metric_summary"))
+        tables.append("content_metric_summary")
 
     if 'timeseries' in m.org_levels:
-        db.session.execute(cmd_fmt.format(table="org_metric_timeseries"))
+        tables.append("org_metric_timeseries")
 
     if 'summary' in m.org_levels:
-        db.session.execute(cmd_fmt.format(table="org_metric_summary"))
+        tables.append("org_metric_summary")
+
+    for table in tables:
+        db.session.execute(text(cmd_fmt.format(table=table)), {'name': m.name})
 
     db.session.delete(m)
     db.session.commit()
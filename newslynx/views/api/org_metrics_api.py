@@ -2,18 +2,20 @@ import logging
 
 from flask import Blueprint, request
 
+from newslynx import settings
 from newslynx.views.decorators import load_user
 from newslynx.exc import NotFoundError, ForbiddenError
-from newslynx.models import Org
+from newslynx.models import Org, get_metric_schema
 from newslynx.lib.serialize import jsonify
-from newslynx.views.util import request_data
+from newslynx.views.util import request_data, request_bulk_data
 from newslynx.tasks import ingest_metric
 from newslynx.tasks import ingest_bulk
 from newslynx.tasks.query_metric import QueryOrgMetricTimeseries
+from newslynx.tasks.util import to_columns
 from newslynx.models.util import fetch_by_id_or_field
 from newslynx.views.util import (
-    arg_bool, arg_str, validate_ts_unit, localize,
-    url_for_job_status,  arg_list, arg_date, arg_int)
+    arg_bool, arg_str, validate_ts_unit, validate_ts_transform, localize,
+    url_for_job_status,  arg_list, arg_date, arg_int, columnar_response)
 
 # blueprint
 bp = Blueprint('org_metrics', __name__)
@@ -111,11 +113,16 @@ def get_org_timeseries(user, org_id_slug):
         rm_nulls=arg_bool('rm_nulls', default=False),
         time_since_start=arg_bool('time_since_start', default=False),
         transform=arg_str('transform', default=None),
+        roll_window=arg_int('roll_window', default=settings.TIMESERIES_ROLL_WINDOW),
         before=arg_date('before', default=None),
         after=arg_date('after', default=None)
     )
 
+    validate_ts_unit(kw['unit'])
+    validate_ts_transform(kw['transform'])
     q = QueryOrgMetricTimeseries(org, [org.id], **kw)
+    if arg_str('format', default='rows') == 'columns':
+        return columnar_response(to_columns(q.execute(tuples=True)))
     return jsonify(list(q.execute()))
 
 
@@ -144,7 +151,7 @@ def create_org_timeseries(user, org_id_slug):
     ret = ingest_metric.org_timeseries(
         req_data,
         org_id=org.id,
-        metrics_lookup=org.metrics_lookup,
+        metrics_lookup=get_metric_schema(org, 'timeseries_metrics'),
         commit=True
     )
     return jsonify(ret)
@@ -167,12 +174,12 @@ def bulk_create_org_timeseries(user, org_id_slug):
         raise ForbiddenError(
             'You are not allowed to access this Org')
 
-    req_data = request_data()
+    req_data = request_bulk_data()
 
     job_id = ingest_bulk.org_timeseries(
         req_data,
         org_id=org.id,
-        metrics_lookup=org.timeseries_metrics,
+        metrics_lookup=get_metric_schema(org, 'timeseries_metrics'),
         commit=False
     )
     ret = url_for_job_status(apikey=user.apikey, job_id=job_id, queue='bulk')
@@ -10,8 +10,9 @@ from newslynx.views.decorators import load_user
 from newslynx.lib.serialize import obj_to_json
 from newslynx.lib.serialize import jsonify
 from newslynx.views.util import request_data
-from newslynx.tasks.util import ResultIter
-from newslynx.views.util import arg_str, arg_bool
+from newslynx.tasks.util import ResultIter, stream as stream_query
+from newslynx.views.util import arg_str, arg_bool, arg_int
+from newslynx import settings
 
 
 # bp
@@ -37,8 +38,9 @@ def exec_query(user):
     if not q:
         raise RequestError('A query - "q" is required.')
     stream = arg_bool('stream', default=True)
+    fetch_size = arg_int('fetch_size', default=settings.SQL_FETCH_SIZE)
     try:
-        results = db.session.execute(q)
+        results = db.session.execute(stream_query(q))
     except Exception as e:
         raise RequestError(
             "There was an error executing this query: "
@@ -46,7 +48,7 @@ def exec_query(user):
 
     def generate():
         try:
-            for row in ResultIter(results):
+            for row in ResultIter(results, fetch_size=fetch_size):
                 if stream:
                     yield obj_to_json(row) + "\n"
                 else:
@@ -4,13 +4,15 @@ from sqlalchemy import func
 from flask import Blueprint
 
 from newslynx.core import db
-from newslynx.models import Tag
-from newslynx.models.relations import events_tags, content_items_tags
+from newslynx.models import Tag, Event
+from newslynx.models.relations import (
+    events_tags, content_items_tags, content_items_events)
 from newslynx.models.util import fetch_by_id_or_field
 from newslynx.lib.serialize import jsonify
 from newslynx.views.decorators import load_user, load_org
 from newslynx.models.util import get_table_columns
 from newslynx.views.util import *
+from newslynx.tasks import rollup_metric
 from newslynx.constants import (
     IMPACT_TAG_CATEGORIES, IMPACT_TAG_LEVELS)
 from newslynx.exc import (
@@ -165,6 +167,21 @@ def get_tag(user, org, tag_id):
     return jsonify(tag)
 
 
+def impact_tag_content_item_ids(tag):
+    """
+    The content items of approved events carrying an impact tag.
+    """
+    if tag.type != 'impact':
+        return []
+    q = db.session.query(content_items_events.c.content_item_id)\
+        .join(Event, Event.id == content_items_events.c.event_id)\
+        .join(events_tags, events_tags.c.event_id == Event.id)\
+        .filter(events_tags.c.tag_id == tag.id)\
+        .filter(Event.status == 'approved')\
+        .distinct()
+    return [r.content_item_id for r in q]
+
+
 @bp.route('/api/v1/tags/<tag_id>', methods=['PUT', 'PATCH'])
 @load_user
 @load_org
@@ -212,6 +229,12 @@ def update_tag(user, org, tag_id):
         if k not in columns:
             req_data.pop(k)
 
+    # event tag summaries group by these.
+    content_item_ids = []
+    if any(req_data.get(k, getattr(tag, k)) != getattr(tag, k)
+           for k in ['type', 'level', 'category']):
+        content_item_ids = impact_tag_content_item_ids(tag)
+
     # update attributes
     for k, v in req_data.items():
         setattr(tag, k, v)
@@ -224,6 +247,7 @@ def update_tag(user, org, tag_id):
     except Exception as err:
         raise RequestError(err.message)
 
+    rollup_metric.event_tags_changed(org.id, content_item_ids)
     return jsonify(tag)
 
 
@@ -241,8 +265,10 @@ def delete_tag(user, org, tag_id):
             'A Tag with ID {} does not exist'
             .format(tag_id))
 
+    content_item_ids = impact_tag_content_item_ids(tag)
     db.session.delete(tag)
     db.session.commit()
+    rollup_metric.event_tags_changed(org.id, content_item_ids)
     return delete_response()
 
 
@@ -0,0 +1,36 @@
+from flask import Blueprint, Response, request
+
+from newslynx.core import db
+from newslynx.models import Thumbnail
+from newslynx.exc import NotFoundError
+from newslynx import settings
+
+# bp
+bp = Blueprint('thumbnails', __name__)
+
+
+# thumbnails are public so they can be used in <img> tags,
+# their ids are just the md5 of a (public) image url.
+@bp.route('/api/v1/thumbnails/<id>', methods=['GET'])
+def get_thumbnail(id):
+    t = db.session.query(Thumbnail.etag, Thumbnail.format)\
+        .filter_by(id=id).first()
+    if not t:
+        raise NotFoundError(
+            'Thumbnail "{}" does not exist.'.format(id))
+
+    headers = {
+        'ETag': '"{}"'.format(t.etag),
+        'Cache-Control': 'public, max-age={}'
+                         .format(settings.THUMBNAIL_CACHE_TTL)
+    }
+
+    # don't bother fetching the data if the client has it.
+    if t.etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+
+    data = db.session.query(Thumbnail.data)\
+        .filter_by(id=id).scalar()
+    return Response(
+        bytes(data), headers=headers,
+        mimetype='image/{}'.format(t.format.lower()))
@@ -4,13 +4,14 @@ import math
 from urlparse import urljoin
 import re
 
-from flask import request, Response, url_for
+from flask import request, Response, url_for, stream_with_context
 from flask import Blueprint
 
 from newslynx.core import db
 from newslynx.exc import NotFoundError, RequestError
 from newslynx.lib import dates
-from newslynx.lib.serialize import json_to_obj, jsonify
+from newslynx.lib.serialize import (
+    json_to_obj, jsonify, obj_to_json, obj_to_msgpack, msgpack)
 from newslynx import settings
 from newslynx.models.util import get_table_columns
 from newslynx.constants import *
@@ -173,17 +174,47 @@ def request_data():
 
 def request_bulk_data():
     """
-    Fetch request data from jsonlines.
+    Fetch bulk request data. Newline-delimited json
+    (optionally sent with `Transfer-Encoding: chunked`)
+    is parsed lazily, one line at a time, so large uploads
+    are never held in memory all at once. Otherwise fall
+    back to a json list.
     """
-    data = request.get_json(silent=True)
-    if data is None:
+    if request.mimetype in NDJSON_MIMETYPES:
+        return _iter_ndjson()
+
+    data = request_data()
+    if not isinstance(data, list):
+        raise RequestError(
+            "Bulk endpoints require a list of json objects "
+            "or newline-delimited json.")
+    return data
+
+
+def _iter_ndjson():
+    """
+    Yield objects from a newline-delimited json request body.
+    """
+    # werkzeug limits `request.stream` to the content-length,
+    # which chunked uploads don't send.
+    if 'chunked' in request.headers.get('Transfer-Encoding', '').lower():
+        stream = request.environ['wsgi.input']
+    else:
+        stream = request.stream
+
+    for i, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
         try:
-            data = json_to_obj(request.data)
+            obj = json_to_obj(line)
         except:
-            data = None
-    if data is None:
-        data = dict(request.form.items())
-    return data
+            raise RequestError(
+                'Invalid json on line {} of bulk upload.'.format(i))
+        if not isinstance(obj, dict):
+            raise RequestError(
+                'Line {} of bulk upload is not a json object.'.format(i))
+        yield obj
 
 
 def listify_data_arg(name):
@@ -465,6 +496,16 @@ def validate_ts_unit(value):
             .format(value, METRIC_TS_UNITS))
 
 
+def validate_ts_transform(value):
+    """
+    check a value against timeseries transforms.
+    """
+    if value is not None and value not in METRIC_TS_TRANSFORMS:
+        raise RequestError(
+            "'{}' is not a valid timeseries transform. Choose from {}."
+            .format(value, METRIC_TS_TRANSFORMS))
+
+
 def validate_recipe_statuses(values):
     """
     Validate recipe statuses.
@@ -613,6 +654,42 @@ def delete_response():
     return r
 
 
+def ndjson_response(rows):
+    """
+    Stream rows as newline-delimited json.
+    """
+    def generate():
+        for row in rows:
+            yield obj_to_json(row) + "\n"
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+
+def columnar_response(columns):
+    """
+    Return an OrderedDict of column => values (see
+    `tasks.util.to_columns`) as json or, when requested via
+    `?encoding=msgpack` or the Accept header, msgpack.
+    """
+    encoding = arg_str('encoding', default=None)
+    if encoding is None:
+        accept = request.headers.get('Accept', '')
+        encoding = 'msgpack' if 'application/x-msgpack' in accept else 'json'
+
+    if encoding == 'msgpack':
+        if msgpack is None:
+            raise RequestError(
+                'msgpack encoding is not supported by this API.')
+        return Response(obj_to_msgpack(columns),
+                        mimetype='application/x-msgpack')
+
+    if encoding != 'json':
+        raise RequestError(
+            '"{}" is not a valid encoding. Choose from: json, msgpack.'
+            .format(encoding))
+    return Response(obj_to_json(columns), mimetype='application/json')
+
+
 def error_response(name, err):
     """
     Return an empty response from a delete request
@@ -64,6 +64,30 @@ def test_bulk_content_timeseries(nrows=10000):
         .format(nrows, round((end-start), 2))
 
 
+def test_bulk_content_timeseries_stream(nrows=100000):
+    """
+    Test streaming timeseries metrics as newline-delimited json.
+    """
+    start = time.time()
+    content_item_ids = [r['id'] for r in api.orgs.simple_content()]
+
+    def gen():
+        for i in xrange(nrows):
+            hours = nrows - i
+            yield {
+                'content_item_id': choice(content_item_ids),
+                'datetime': (dates.now() - timedelta(days=30, hours=hours)).isoformat(),
+                'metrics': {'twitter_shares': i}
+            }
+
+    # generators are sent as chunked ndjson.
+    res = api.content.bulk_create_timeseries(gen())
+    poll_status_url(res.get('status_url'))
+    end = time.time()
+    print "Streaming {} Content Timeseries Metrics Took {} seconds"\
+        .format(nrows, round((end-start), 2))
+
+
 def test_bulk_content_summary(nrows=1000):
     """
     Test bulk loading summary metrics.
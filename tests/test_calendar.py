@@ -0,0 +1,90 @@
+"""
+Benchmark the set-based content_metric_calendar against the
+legacy per-id plpgsql loop.
+"""
+import time
+
+from newslynx.core import db_session
+
+# the function we used to use in newslynx/sql/4-calendar.sql
+LEGACY_CALENDAR = """
+CREATE OR REPLACE FUNCTION pg_temp.legacy_content_metric_calendar(
+  text,
+  "c_ids" anyarray,
+  "after" timestamp with time zone DEFAULT '2000-01-01',
+  "before" timestamp with time zone DEFAULT '2100-01-01')
+RETURNS TABLE(content_item_id int, datetime timestamp with time zone) AS
+$BODY$
+DECLARE
+   c_id int;
+   unit text;
+BEGIN
+  unit := split_part($1, ' ', 2);
+  IF unit = 'days' THEN
+    unit := 'day';
+  END IF;
+  IF unit = 'hours' THEN
+    unit := 'hour';
+  END IF;
+
+  FOR c_id IN
+    SELECT unnest("c_ids")
+  LOOP
+    RETURN QUERY EXECUTE
+      'WITH cal AS (
+          WITH mm AS (
+              SELECT
+                  MIN(date_trunc('''|| unit || ''', datetime)) AS minmin,
+                  MAX(date_trunc('''|| unit || ''', datetime)) AS maxmax,
+                  content_item_id
+              FROM content_metric_timeseries
+                  WHERE content_item_id=' || c_id || ' AND
+                        datetime >='''|| "after" || ''' AND
+                        datetime <='''|| "before" || '''
+                  GROUP BY content_item_id)
+          SELECT
+              content_item_id,
+              generate_series(mm.minmin , mm.maxmax , '''|| $1 || '''::interval) AS datetime
+          FROM mm
+          )
+     SELECT content_item_id, datetime FROM cal ORDER BY datetime ASC';
+  END LOOP;
+END
+$BODY$
+LANGUAGE plpgsql;
+"""
+
+BENCH_QUERY = """
+SELECT count(1), count(distinct(content_item_id)), max(datetime)
+FROM {cal}('1 {unit}s', ARRAY(SELECT generate_series(1, {nids})))
+"""
+
+
+def _time_calendar(cal, nids, unit):
+    start = time.time()
+    row = db_session.execute(
+        BENCH_QUERY.format(cal=cal, nids=nids, unit=unit)).first()
+    return round(time.time() - start, 2), tuple(row)
+
+
+def test_calendar_benchmark(sizes=[1000, 10000], units=['hour', 'day']):
+    """
+    Compare calendar generation per-id vs set-based.
+    """
+    db_session.execute(LEGACY_CALENDAR)
+    for nids in sizes:
+        for unit in units:
+            legacy, lrow = _time_calendar(
+                "pg_temp.legacy_content_metric_calendar", nids, unit)
+            native, nrow = _time_calendar(
+                "content_metric_calendar", nids, unit)
+            print "Generating a {} Calendar for {} Content Items per-id Took {} seconds"\
+                .format(unit, nids, legacy)
+            print "Generating a {} Calendar for {} Content Items set-based Took {} seconds"\
+                .format(unit, nids, native)
+            assert(lrow == nrow)
+    db_session.rollback()
+
+
+if __name__ == '__main__':
+    test_calendar_benchmark()
@@ -0,0 +1,43 @@
+"""
+Check that a change to a content item's summary shows up in the
+all-content comparisons after one soft-ttl cycle: first the stale
+comparisons are served, then the background refresh picks it up.
+"""
+import time
+
+from newslynx.client import API
+from newslynx.models import ComparisonsCache
+
+org = 1
+api = API(org=org)
+
+cache = ComparisonsCache()
+cache.soft_ttl = 1
+
+# prime the cache.
+cache.invalidate(org)
+cr = cache.get(org)
+assert(not cr.is_cached)
+
+# push a summary metric past the current max.
+comparison = cr.value['all'][0]
+metric = comparison['metric']
+value = int(comparison['max'] or 0) + 1000
+c = api.content.search(per_page=1)['content_items'][0]
+api.content.create_summary(c['id'], **{metric: value})
+
+# past the soft ttl the stale comparisons are served + refreshed.
+time.sleep(cache.soft_ttl + 1)
+cr = cache.get(org)
+assert(cr.is_cached and cr.is_stale)
+assert(cr.refresh_age is not None)
+maxes = dict((m['metric'], m['max']) for m in cr.value['all'])
+assert(maxes[metric] == comparison['max'])
+
+# what the 'cache' worker runs.
+cache.refresh(org)
+
+cr = cache.get(org)
+assert(cr.is_cached and not cr.is_stale)
+maxes = dict((m['metric'], m['max']) for m in cr.value['all'])
+assert(float(maxes[metric]) == value)
@@ -0,0 +1,66 @@
+"""
+Check that a cached facet comparison is only recomputed when the
+summaries of it's own content items change.
+"""
+import time
+
+from newslynx.models import SubjectTagsComparisonCache
+from newslynx.models.change_log import ContentSummaryChangeTimes
+
+org = 1
+cache = SubjectTagsComparisonCache()
+changes = ContentSummaryChangeTimes()
+
+ids = set([1, 2, 3])
+version = '1'
+ids_hash = cache.ids_hash(ids)
+
+# the hash doesn't depend on order.
+assert(ids_hash == cache.ids_hash([3, 1, 2]))
+assert(ids_hash != cache.ids_hash([1, 2]))
+
+changes.flush()
+cached = {
+    'value': [],
+    'ids_hash': ids_hash,
+    'version': version,
+    'computed': time.time()
+}
+time.sleep(0.01)
+
+# nothing has changed yet.
+changed = changes.since(org, cached['computed'])
+all_changed = changes.all_changed(org)
+assert(changed == {})
+assert(not cache.is_stale(cached, ids, ids_hash, version, changed, all_changed))
+
+# a change to an item outside the facet.
+changes.record(org, [4])
+changed = changes.since(org, cached['computed'])
+assert(changed.keys() == [4])
+assert(not cache.is_stale(cached, ids, ids_hash, version, changed, all_changed))
+
+# a change to an item in the facet.
+changes.record(org, [2])
+changed = changes.since(org, cached['computed'])
+assert(sorted(changed.keys()) == [2, 4])
+assert(cache.is_stale(cached, ids, ids_hash, version, changed, all_changed))
+
+# changes from before the facet was computed don't count.
+cached['computed'] = time.time()
+time.sleep(0.01)
+changed = changes.since(org, cached['computed'])
+assert(changed == {})
+assert(not cache.is_stale(cached, ids, ids_hash, version, changed, all_changed))
+
+# new members, a new metric schema, or every item changing.
+new_hash = cache.ids_hash([1, 2, 3, 5])
+assert(cache.is_stale(cached, ids, new_hash, version, changed, all_changed))
+assert(cache.is_stale(cached, ids, ids_hash, '2', changed, all_changed))
+changes.record_all(org)
+all_changed = changes.all_changed(org)
+assert(cache.is_stale(cached, ids, ids_hash, version, changed, all_changed))
+
+# no cached comparison.
+assert(cache.is_stale(None, ids, ids_hash, version, changed, all_changed))
+changes.flush()
@@ -0,0 +1,94 @@
+"""
+Benchmark the single-scan content comparisons against the legacy
+per-metric UNION ALL of array_agg + plpythonu percentile() calls.
+"""
+import time
+
+from newslynx.core import db
+from newslynx.tasks.compare_metric import ContentComparison
+from newslynx.tasks.util import ResultIter
+
+METRICS = ['twitter_shares', 'facebook_shares', 'ga_pageviews']
+
+PERCENTILES = [2.5, 5.0, 10.0, 25.0, 50.0, 75.0, 90.0, 95.0, 97.5]
+
+BENCH_TABLE = """
+CREATE TEMP TABLE comparison_bench ON COMMIT DROP AS
+SELECT
+    i AS content_item_id,
+    json_build_object(
+        'twitter_shares', (random() * 100)::int,
+        'facebook_shares', CASE WHEN i % 3 = 0 THEN 0 ELSE (random() * 1000)::int END,
+        'ga_pageviews', CASE WHEN i % 10 = 0 THEN NULL ELSE round((random() * 10000)::numeric, 3) END
+    )::jsonb AS metrics
+FROM generate_series(1, {nitems}) i
+"""
+
+# the query we used to generate in newslynx/tasks/compare_metric.py
+LEGACY_METRIC_QUERY = """
+SELECT '{name}' as metric,
+       mean, median, min, max,
+       {percentiles}
+FROM (
+    SELECT array_agg(metric) as metric_arr,
+           ROUND(avg(metric), 2) as mean,
+           ROUND(min(metric), 2) as min,
+           ROUND(median(metric), 2) as median,
+           ROUND(max(metric), 2) as max
+    FROM (
+        SELECT (metrics ->> '{name}')::text::numeric as metric
+        FROM comparison_bench
+        WHERE content_item_id in (select unnest(ARRAY[{ids}])) AND
+        (metrics ->> '{name}')::text::numeric IS NOT NULL
+    ) AS "{name}_init"
+) AS "{name}_summary"
+"""
+
+
+class BenchOrg(object):
+    id = 0
+    content_metric_comparisons = dict((n, {'name': n}) for n in METRICS)
+
+
+class BenchComparison(ContentComparison):
+    table = "comparison_bench"
+
+
+def legacy_query(ids):
+    cc = BenchComparison(BenchOrg(), ids)
+    percentiles = ",\n".join([
+        "percentile(metric_arr, {}) as {}".format(per, cc.percentile_col(per))
+        for per in PERCENTILES])
+    return "\nUNION ALL\n".join([
+        LEGACY_METRIC_QUERY.format(
+            name=n, percentiles=percentiles,
+            ids=",".join([str(i) for i in ids]))
+        for n in METRICS])
+
+
+def test_comparison_benchmark(sizes=[10000, 100000]):
+    """
+    Compare content comparisons via numpy vs one scan.
+    """
+    for nitems in sizes:
+        db.session.execute(BENCH_TABLE.format(nitems=nitems))
+        ids = range(1, nitems + 1)
+
+        start = time.time()
+        legacy = list(ResultIter(db.session.execute(legacy_query(ids))))
+        legacy_time = round(time.time() - start, 2)
+
+        start = time.time()
+        native = list(BenchComparison(BenchOrg(), ids).execute())
+        native_time = round(time.time() - start, 2)
+
+        print "Comparing {} Content Items via plpythonu Took {} seconds"\
+            .format(nitems, legacy_time)
+        print "Comparing {} Content Items in one scan Took {} seconds"\
+            .format(nitems, native_time)
+        assert(legacy == native)
+        db.session.rollback()
+
+
+if __name__ == '__main__':
+    test_comparison_benchmark()
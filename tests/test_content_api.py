@@ -102,6 +102,37 @@ class TestContentAPI(unittest.TestCase):
         except Exception as e:
             assert(e.status_code == 404)
 
+    def test_window_transforms_on_gapped_timeseries(self):
+        metrics = self.api.metrics.list(content_levels='timeseries')['metrics']
+        m = [m for m in metrics
+             if m['type'] == 'count' and not m['faceted']][0]['name']
+        c = self.api.content.create(extract=False, **{
+            'url': 'http://example.com/window-transforms-on-gapped-timeseries',
+            'type': 'article',
+            'title': 'a timeseries with a gap'
+        })
+
+        # nothing at 01:00 or 02:00.
+        self.api.content.create_timeseries(
+            c['id'], datetime='2015-06-01T00:00:00+00:00', **{m: 10})
+        self.api.content.create_timeseries(
+            c['id'], datetime='2015-06-01T03:00:00+00:00', **{m: 40})
+
+        kw = {'after': '2015-06-01T00:00:00+00:00',
+              'before': '2015-06-01T03:00:00+00:00'}
+        def by_hour(ts):
+            return dict((r['datetime'][11:13], r[m]) for r in ts)
+
+        ts = by_hour(self.api.content.get_timeseries(
+            c['id'], transform='roll_avg', roll_window=2, **kw))
+        assert(float(ts['02']) == 0)
+        assert(float(ts['03']) == 20)
+
+        ts = by_hour(self.api.content.get_timeseries(
+            c['id'], transform='per_change', **kw))
+        assert(float(ts['01']) == -100)
+        assert(ts['03'] is None)
+
     def test_add_remove_subject_tag(self):
         tags = self.api.tags.list(type='subject')
         t = choice(tags['tags'])
@@ -1,6 +1,9 @@
 import unittest
 
 from newslynx.client import API
+from newslynx.core import gen_session
+from newslynx.models import Org, ContentMetricSummary
+from newslynx.tasks import rollup_metric
 
 
 class TestEventsAPI(unittest.TestCase):
@@ -200,6 +203,42 @@ class TestEventsAPI(unittest.TestCase):
         event = self.api.events.remove_content_item(event['id'], 1)
         assert(1 not in [t['id'] for t in event['content_items']])
 
+    def test_event_tags_summary_drops_to_zero(self):
+        c = self.api.content.create(extract=False, **{
+            'url': 'http://example.com/event-tags-summary-drops-to-zero',
+            'type': 'article',
+            'title': 'an item with a single approved event'
+        })
+        event = self.api.events.create(**{
+            'source_id': 'event-tags-summary-drops-to-zero',
+            'title': 'the only approved event',
+            'url': 'http://example.com/event-tags-summary-drops-to-zero/event',
+            'body': 'foo bar'
+        })
+        event['content_item_ids'] = [c['id']]
+        event['tag_ids'] = [1]
+        event['status'] = 'approved'
+        event = self.api.events.update(event['id'], **event)
+
+        session = gen_session()
+        org = session.query(Org).get(self.org)
+
+        def total_events():
+            rollup_metric.event_tags_to_summary(
+                org, content_item_ids=[c['id']], session=session)
+            s = session.query(ContentMetricSummary)\
+                .filter_by(org_id=self.org, content_item_id=c['id'])\
+                .first()
+            session.expire_all()
+            return s.metrics['total_events']
+
+        try:
+            assert(total_events() == 1)
+            self.api.events.delete(event['id'], force=True)
+            assert(total_events() == 0)
+        finally:
+            session.close()
+
     def test_event_facet_by_provenance(self):
         res = self.api.events.search(status='approved', per_page=1, facets='provenances')
         assert(res['total'] == sum([f['count'] for f in res['facets']['provenances']]))
@@ -0,0 +1,60 @@
+"""
+Benchmark the native jsonb merge against the
+legacy plpythonu json_merge function.
+"""
+import time
+
+from newslynx.core import db_session
+
+# the function we used to use in newslynx/sql/2-json.sql
+LEGACY_JSON_MERGE = """
+CREATE OR REPLACE FUNCTION pg_temp.legacy_json_merge(left JSON, right JSON)
+RETURNS JSON AS $$
+  import json
+  l, r = json.loads(left), json.loads(right)
+  if not l:
+      return json.dumps(r)
+  if not r:
+      return json.dumps(l)
+  l.update(r)
+  return json.dumps(l)
+$$ LANGUAGE PLPYTHONU;
+"""
+
+BENCH_QUERY = """
+SELECT count({merge})
+FROM (
+    SELECT
+        ('{{"a": ' || i || ', "b": 1, "c": 2}}') as l,
+        ('{{"b": ' || i || ', "d": 3}}') as r
+    FROM generate_series(1, {nrows}) i
+) t
+"""
+
+
+def _time_merge(merge, nrows):
+    start = time.time()
+    db_session.execute(BENCH_QUERY.format(merge=merge, nrows=nrows))
+    return round(time.time() - start, 2)
+
+
+def test_json_merge_benchmark(nrows=100000):
+    """
+    Compare merging metrics natively vs via plpythonu.
+    """
+    db_session.execute(LEGACY_JSON_MERGE)
+    legacy = _time_merge("pg_temp.legacy_json_merge(l::json, r::json)", nrows)
+    native = _time_merge("json_merge(l::jsonb, r::jsonb)", nrows)
+    print "Merging {} Metric Objects via plpythonu Took {} seconds"\
+        .format(nrows, legacy)
+    print "Merging {} Metric Objects via jsonb Took {} seconds"\
+        .format(nrows, native)
+    row = db_session.execute(
+        """SELECT json_merge('{"a": 1, "b": 1}'::jsonb, '{"b": 2}'::jsonb)::text"""
+    ).first()
+    assert(row[0] == '{"a": 1, "b": 2}')
+    db_session.rollback()
+
+
+if __name__ == '__main__':
+    test_json_merge_benchmark()
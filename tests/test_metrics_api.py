@@ -35,5 +35,19 @@ class TestMetricsAPI(unittest.TestCase):
         except:
             assert True
 
+    def test_delete_metric_from_stores(self):
+        metrics = self.api.metrics.list(content_levels='summary')['metrics']
+        m = [m for m in metrics if not m['faceted']][0]
+        c = self.api.content.search(per_page=1)['content_items'][0]
+        self.api.content.create_summary(c['id'], **{m['name']: 1})
+        c = self.api.content.get(c['id'])
+        assert(m['name'] in c['metrics'])
+
+        r = self.api.metrics.delete(m['id'])
+        assert(r)
+
+        c = self.api.content.get(c['id'])
+        assert(m['name'] not in c['metrics'])
+
 if __name__ == '__main__':
     unittest.main()
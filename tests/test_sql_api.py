@@ -7,6 +7,25 @@ api = API(org=1)
 for res in api.sql.execute('SELECT * FROM users'):
     assert(isinstance(res, dict))
 
+for res in api.sql.execute('WITH u AS (SELECT * FROM users) SELECT * FROM u'):
+    assert(isinstance(res, dict))
+
 for res in api.sql.execute("UPDATE users set name = name || '1' "):
     assert(isinstance(res, dict))
     assert(res['success'])
+
+for res in api.sql.execute("WITH u AS (SELECT id FROM users) UPDATE users set name = name || '1' WHERE id IN (SELECT id FROM u)"):
+    assert(isinstance(res, dict))
+    assert(res['success'])
+
+for res in api.sql.execute("WITH u AS (UPDATE users set name = name || '1' RETURNING id) SELECT * FROM u"):
+    assert(isinstance(res, dict))
+
+for res in api.sql.execute("SELECT id INTO TEMP TABLE sql_api_users FROM users"):
+    assert(isinstance(res, dict))
+
+for res in api.sql.execute("SELECT id FROM users FOR UPDATE"):
+    assert(isinstance(res, dict))
+
+for res in api.sql.execute("SELECT 1; UPDATE users set name = name || '1'"):
+    assert(isinstance(res, dict))